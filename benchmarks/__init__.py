@@ -0,0 +1,187 @@
+"""
+Standalone performance benchmarks. Every benchmark runs against a throwaway SQLite
+database so it never touches ``db.sqlite3``, e.g.::
+
+    python -m benchmarks.range_queries --rows 10000 1000000
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(database_name):
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'diavantage.settings')
+
+    import django
+    from django.conf import settings
+
+    if not settings.configured or not django.apps.apps.ready:
+        settings.DATABASES['default']['NAME'] = database_name
+        settings.DEBUG = False
+        django.setup()
+    else:
+        from django.db import connection
+        connection.close()
+        connection.settings_dict['NAME'] = database_name
+
+
+def create_schema():
+    """
+    Creates the tables of every installed model directly, as the project keeps no
+    migration files in the repository.
+    """
+    from django.apps import apps
+    from django.db import connection
+
+    with connection.schema_editor() as editor:
+        for model in apps.get_models():
+            if model._meta.managed and not model._meta.proxy:
+                editor.create_model(model)
+
+
+@contextmanager
+def temporary_database():
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'benchmark.sqlite3'))
+        create_schema()
+        try:
+            yield directory
+        finally:
+            from django.db import connection
+            connection.close()
+
+
+def summarize(timings):
+    """
+    Latency statistics in milliseconds of a list of timings in milliseconds.
+    """
+    timings = sorted(timings)
+    if not timings:
+        return {'runs': 0}
+
+    def percentile(fraction):
+        return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+    return {
+        'runs': len(timings),
+        'mean_ms': statistics.fmean(timings),
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': timings[-1],
+    }
+
+
+def measure(function, repeat):
+    """
+    Calls ``function`` ``repeat`` times and returns latency statistics in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+
+def run_load(tasks, users, duration, make_session=lambda: None, seed=0):
+    """
+    Locust style load driver. ``users`` threads each create a session with
+    ``make_session`` and call randomly picked ``tasks`` (name -> function taking the
+    session) back to back for ``duration`` seconds. Returns throughput, errors and
+    latency statistics per task.
+    """
+    from django.db import connection
+
+    timings = {name: [] for name in tasks}
+    errors = {name: 0 for name in tasks}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user(number):
+        rng = random.Random(seed + number)
+        session = make_session()
+        names = list(tasks)
+        try:
+            while time.perf_counter() < deadline:
+                name = rng.choice(names)
+                start = time.perf_counter()
+                try:
+                    tasks[name](session)
+                    failed = False
+                except Exception:
+                    failed = True
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    if failed:
+                        errors[name] += 1
+                    else:
+                        timings[name].append(elapsed)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=user, args=(number,)) for number in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    requests = sum(len(values) for values in timings.values())
+    return {
+        'users': users,
+        'duration_s': elapsed,
+        'requests': requests,
+        'errors': sum(errors.values()),
+        'throughput_rps': requests / elapsed,
+        'tasks': {name: summarize(values) | {'errors': errors[name]} for name, values in timings.items()},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, key='p50_ms'):
+    """
+    Ratio of ``key`` in ``results`` to the same entry of the baseline results file,
+    for every nested statistic present in both. Values above 1 are slowdowns.
+    """
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+
+    changes = {}
+
+    def walk(current, previous, path):
+        if isinstance(current, dict) and isinstance(previous, dict):
+            if key in current and key in previous and previous[key]:
+                changes['.'.join(path)] = current[key] / previous[key]
+            for name in current.keys() & previous.keys():
+                walk(current[name], previous[name], path + [name])
+
+    walk(results, baseline, [])
+    return dict(sorted(changes.items()))
+
+
+def report(results, output=None):
+    text = json.dumps(results, indent=4, default=str)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text)
+    print(text)
@@ -0,0 +1,130 @@
+"""
+Profiles the CPU time and response payload of every dashboard callback and of the
+layout. The date controls are compared with their previous implementations, which
+rebuilt the layout on every page load and derived the slider from a daily
+``pd.date_range``; the data callbacks are profiled cold and warm against a
+synthetic patient.
+
+    python -m benchmarks.callbacks --repeat 200 --years 25 --output callbacks.json
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from benchmarks import temporary_database, summarize, report, git_revision, compare
+
+END = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def legacy_update_slider(start_date, end_date):
+    import pandas as pd
+    from dash import dcc
+    from diaweb.graphs import unix_time_millis
+
+    daterange = pd.date_range(start=f'1-1-{start_date}', end=f'31-12-{end_date}', freq='1D')
+    nth = len(daterange) // 5
+    marks = {unix_time_millis(date): str(date.strftime('%Y-%m-%d'))
+             for i, date in enumerate(daterange) if i % nth == 1}
+    return dcc.RangeSlider(id='date-slider', min=unix_time_millis(daterange.min()),
+                           max=unix_time_millis(daterange.max()),
+                           value=[unix_time_millis(daterange.min()), unix_time_millis(daterange.max())],
+                           marks=marks, allowCross=False)
+
+
+def legacy_layout():
+    from diaweb import graphs
+
+    layout = graphs.build_layout.__wrapped__(END.year)
+    # The end year options were sent with the layout as well
+    layout.children[1].children[0].children[2].options = list(range(2000, END.year + 1))
+    return layout
+
+
+def payload(result):
+    from plotly.utils import PlotlyJSONEncoder
+    return len(json.dumps(result, cls=PlotlyJSONEncoder).encode())
+
+
+def profile(function, repeat):
+    """
+    Wall and CPU latency, queries and payload size of ``function``.
+    """
+    from diaweb import metrics
+
+    wall, cpu, queries = [], [], 0
+    for _ in range(repeat):
+        with metrics.profile() as result:
+            start, start_cpu = time.perf_counter(), time.process_time()
+            output = function()
+            cpu.append((time.process_time() - start_cpu) * 1000)
+            wall.append((time.perf_counter() - start) * 1000)
+        queries += result.queries
+    return {'wall': summarize(wall), 'cpu': summarize(cpu), 'queries': queries / repeat,
+            'payload_bytes': payload(output)}
+
+
+def comparison(legacy, current, repeat):
+    legacy, current = profile(legacy, repeat), profile(current, repeat)
+    return {'legacy': legacy, 'current': current,
+            'cpu_speedup': legacy['cpu']['mean_ms'] / max(current['cpu']['mean_ms'], 1e-6),
+            'payload_reduction': 1 - current['payload_bytes'] / legacy['payload_bytes']}
+
+
+def run(repeat, years, days):
+    from unittest import mock
+    from django.utils import timezone as django_timezone
+    from diaweb import cache, graphs, metrics, synthetic
+
+    metrics.MetricsMiddleware.instrument_connections()
+    start_year = END.year - years + 1
+    results = {'revision': git_revision(), 'repeat': repeat, 'years': years}
+
+    with mock.patch('django.utils.timezone.now', return_value=END):
+        results['layout'] = comparison(legacy_layout, graphs.app.layout, repeat)
+        results['update_end_date'] = comparison(lambda: (list(range(start_year, django_timezone.now().year + 1)), False),
+                                                lambda: graphs.update_end_date(start_year), repeat)
+        results['update_slider'] = comparison(lambda: legacy_update_slider(start_year, END.year),
+                                              lambda: graphs.update_slider(start_year, END.year), repeat)
+
+    synthetic.generate(1, physicians=1, days=days, end=END)
+    patient_id = synthetic.Patient.objects.get().pk
+    request = SimpleNamespace(session={'patient_id': patient_id})
+    minimum, maximum, _ = graphs.slider_range(END.year - days // 365, END.year - 1)
+    series = list(graphs.MEASUREMENT_SERIES)
+
+    data_callbacks = {
+        'update_graph': lambda: graphs.update_graph(series, [minimum, maximum], request=request),
+        'update_data_statistics': lambda: graphs.update_data_statistics([minimum, maximum], series, request=request),
+    }
+    for name, callback in data_callbacks.items():
+
+        def cold():
+            cache.invalidate(patient_id)
+            return callback()
+
+        results[name] = {'cold': profile(cold, max(repeat // 10, 1)), 'warm': profile(callback, repeat)}
+    results['update_slider_output'] = profile(lambda: graphs.update_slider_output([minimum, maximum]), repeat)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--years', type=int, default=25, help='Years covered by the date controls')
+    parser.add_argument('--days', type=int, default=730, help='Days of synthetic readings for the data callbacks')
+    parser.add_argument('--compare', default=None, help='Earlier results file to compare against')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file')
+    args = parser.parse_args()
+
+    with temporary_database():
+        results = run(args.repeat, args.years, args.days)
+    if args.compare:
+        results['p50_change'] = compare(results, args.compare)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Measures API throughput under concurrent load for the database connection
+settings: a new connection per request with SQLite defaults, persistent
+connections, and persistent connections with the WAL pragmas of
+``settings.SQLITE_PRAGMAS``.
+
+Requests go over HTTP to a WSGI server with a fixed pool of worker threads, like
+a threaded production server, because Django's test client never closes
+connections.
+
+    python -m benchmarks.connections --users 16 --duration 20 --output connections.json
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+from benchmarks import temporary_database, run_load, report, git_revision
+
+END = datetime(2024, 1, 1, tzinfo=timezone.utc)
+PASSWORD = 'benchmark'
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    Serves requests on a fixed pool of threads, which keep their database
+    connections between requests.
+    """
+    threads = 8
+
+    def server_activate(self):
+        super().server_activate()
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+CONFIGURATIONS = {
+    'per_request': {'CONN_MAX_AGE': 0, 'pragmas': False},
+    'persistent': {'CONN_MAX_AGE': 600, 'pragmas': False},
+    'persistent_wal': {'CONN_MAX_AGE': 600, 'pragmas': True},
+}
+
+
+def configure(database, configuration):
+    from django.conf import settings
+    from django.db import connections
+
+    connections.close_all()
+    options = settings.DATABASES['default']['OPTIONS']
+    options.pop('init_command', None)
+    if configuration['pragmas']:
+        options['init_command'] = ';'.join(f'PRAGMA {name}={value}' for name, value in settings.SQLITE_PRAGMAS.items())
+    settings.DATABASES['default'].update(NAME=database, CONN_MAX_AGE=configuration['CONN_MAX_AGE'])
+
+
+def tasks(base_url, patient_ids):
+    rng = random.Random(0)
+
+    def get(path):
+        return lambda headers: urllib.request.urlopen(urllib.request.Request(base_url + path(), headers=headers)).read()
+
+    def post_readings(headers):
+        rows = [{'patient': rng.choice(patient_ids), 'measurement': rng.uniform(70, 250), 'measurement_type': 0,
+                 'measurement_date': f'2023-06-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00Z'}
+                for _ in range(10)]
+        request = urllib.request.Request(base_url + '/api/glucose/bulk/', data=json.dumps(rows).encode(),
+                                         headers=headers | {'Content-Type': 'application/json'}, method='POST')
+        urllib.request.urlopen(request).read()
+
+    return {
+        'api_glucose': get(lambda: f'/api/glucose/?patient={rng.choice(patient_ids)}'),
+        'api_patients': get(lambda: '/api/patients/'),
+        'api_glucose_bulk': post_readings,
+    }
+
+
+def run(args, directory):
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connections
+    from diaweb import synthetic
+    from diaweb.models import Patient
+
+    # Basic authentication hashes the password on every request, a slow hasher would hide everything else
+    settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+    synthetic.generate(args.patients, days=args.days, glucose_per_day=96, end=END)
+    User.objects.create_superuser('benchmark', 'benchmark@example.com', PASSWORD)
+    patient_ids = list(Patient.objects.values_list('id', flat=True))
+    connections.close_all()
+
+    seeded = settings.DATABASES['default']['NAME']
+    authorization = 'Basic ' + base64.b64encode(f'benchmark:{PASSWORD}'.encode()).decode()
+
+    results = {'revision': git_revision(), 'scale': vars(args) | {'output': None}, 'configurations': {}}
+    for name, configuration in CONFIGURATIONS.items():
+        # Every configuration starts from its own copy, WAL mode persists in the file
+        database = os.path.join(directory, f'{name}.sqlite3')
+        shutil.copy(seeded, database)
+        configure(database, configuration)
+
+        PooledWSGIServer.threads = args.server_threads
+        server = make_server('127.0.0.1', 0, get_wsgi_application(), server_class=PooledWSGIServer,
+                             handler_class=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            base_url = f'http://127.0.0.1:{server.server_port}'
+            results['configurations'][name] = run_load(tasks(base_url, patient_ids), args.users, args.duration,
+                                                       lambda: {'Authorization': authorization})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    baseline = results['configurations']['per_request']['throughput_rps']
+    results['throughput_gain'] = {name: result['throughput_rps'] / baseline
+                                  for name, result in results['configurations'].items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=20)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--users', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--server-threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=15, help='Seconds per configuration')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file')
+    args = parser.parse_args()
+
+    with temporary_database() as directory:
+        results = run(args, directory)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
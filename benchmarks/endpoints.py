@@ -0,0 +1,145 @@
+"""
+Measures latency percentiles and query counts of the REST API, the web views and
+every ``diaweb.graphs`` callback on a synthetic database, then replays the HTTP
+requests concurrently with the load driver of ``benchmarks.run_load``.
+
+    python -m benchmarks.endpoints --patients 50 --years 2 --output results.json
+    python -m benchmarks.endpoints --compare results.json
+
+``--compare`` adds the p50 ratio of every case to an earlier results file, so runs
+of two commits can be compared.
+"""
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from benchmarks import temporary_database, measure, run_load, report, git_revision, compare
+
+END = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def seed(patients, years, physicians, glucose_per_day, blood_per_day):
+    from diaweb import synthetic
+    from diaweb.models import Patient
+
+    synthetic.generate(patients, physicians=physicians, days=365 * years, glucose_per_day=glucose_per_day,
+                       blood_per_day=blood_per_day, end=END)
+    return list(Patient.objects.values_list('id', flat=True))
+
+
+def make_client():
+    from django.contrib.auth.models import User
+    from django.test import Client
+
+    client = Client()
+    client.force_login(User.objects.get(username='benchmark'))
+    return client
+
+
+def request(client, path, **extra):
+    response = client.get(path, **extra)
+    if response.status_code != 200:
+        raise RuntimeError(f'{path} returned {response.status_code}')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def http_tasks(patient_ids):
+    rng = random.Random(2)
+    return {
+        'api_glucose': lambda client: request(client, f'/api/glucose/?patient={rng.choice(patient_ids)}'),
+        'api_patients': lambda client: request(client, '/api/patients/'),
+        'web_patients': lambda client: request(client, '/web/patients/', HTTP_ACCEPT='text/html'),
+        'web_patient_measurements': lambda client: request(client, f'/web/patients/{rng.choice(patient_ids)}'
+                                                                   f'/measurements/', HTTP_ACCEPT='text/html'),
+    }
+
+
+def callback_cases(patient_ids, years):
+    from diaweb import graphs
+
+    rng = random.Random(3)
+    start = END - timedelta(days=365 * years)
+    slider = [int(start.timestamp()), int(END.timestamp())]
+    month = [int((END - timedelta(days=30)).timestamp()), int(END.timestamp())]
+    series = list(graphs.MEASUREMENT_SERIES)
+
+    def with_patient(callback, *args):
+        return lambda: callback(*args, request=SimpleNamespace(session={'patient_id': rng.choice(patient_ids)}))
+
+    return {
+        'update_data_statistics': with_patient(graphs.update_data_statistics, slider, series),
+        'update_data_statistics_month': with_patient(graphs.update_data_statistics, month, series),
+        'update_graph': with_patient(graphs.update_graph, series, slider),
+        'update_graph_month': with_patient(graphs.update_graph, series, month),
+        'update_end_date': lambda: graphs.update_end_date(start.year),
+        'update_slider': lambda: graphs.update_slider(start.year, END.year),
+        'update_slider_output': lambda: graphs.update_slider_output(slider),
+    }
+
+
+def count_queries(function):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        function()
+    return len(queries)
+
+
+def run(args):
+    from django.contrib.auth.models import User
+    from django.test.utils import setup_test_environment
+    from diaweb import cache
+
+    setup_test_environment()
+    patient_ids = seed(args.patients, args.years, args.physicians, args.glucose_per_day, args.blood_per_day)
+    User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+
+    results = {'revision': git_revision(), 'scale': vars(args) | {'output': None, 'compare': None},
+               'endpoints': {}, 'callbacks': {}}
+
+    client = make_client()
+    for name, task in http_tasks(patient_ids).items():
+        results['endpoints'][name] = measure(lambda: task(client), args.repeat) | \
+            {'queries': count_queries(lambda: task(client))}
+
+    for name, callback in callback_cases(patient_ids, args.years).items():
+        def cold():
+            cache.get_cache().clear()
+            callback()
+        results['callbacks'][name] = {
+            'cold': measure(cold, args.repeat) | {'queries': count_queries(cold)},
+            'warm': measure(callback, args.repeat) | {'queries': count_queries(callback)},
+        }
+
+    results['load'] = run_load(http_tasks(patient_ids), args.users, args.duration, make_client)
+
+    if args.compare:
+        results['p50_change'] = compare(results, args.compare)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=20)
+    parser.add_argument('--years', type=int, default=1)
+    parser.add_argument('--physicians', type=int, default=5)
+    parser.add_argument('--glucose-per-day', type=int, default=96, help='CGM readings per day and patient')
+    parser.add_argument('--blood-per-day', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--users', type=int, default=8, help='Concurrent users of the load run')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of the load run')
+    parser.add_argument('--compare', default=None, help='Earlier results file to compare against')
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file')
+    args = parser.parse_args()
+
+    with temporary_database():
+        results = run(args)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures the landing page with its welcome messages scanned from disk on every
+request, as before, and served from ``diaweb.extra_context.ExtraContext`` memory.
+Filesystem accesses per request are counted with an audit hook.
+
+    python -m benchmarks.index_page --repeat 2000
+"""
+import argparse
+import sys
+from unittest import mock
+
+from benchmarks import BASE_DIR, temporary_database, measure, report
+
+SOURCE = BASE_DIR / 'diaweb' / 'static' / 'diaweb' / 'files' / 'index_page_msg'
+
+FILESYSTEM_EVENTS = {'open', 'os.listdir', 'os.scandir'}
+
+
+class ScanningExtraContext:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self):
+        from diaweb.extra_context import import_extra_context
+        return import_extra_context(self.directory)
+
+
+def run(source, repeat):
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from django.urls import reverse
+    from diaweb.extra_context import ExtraContext
+
+    setup_test_environment()
+    events = []
+    sys.addaudithook(lambda event, args: events.append(event) if event in FILESYSTEM_EVENTS else None)
+
+    client = Client()
+    url = reverse('index')
+
+    def page():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+
+    results = {'source': str(source), 'repeat': repeat}
+    for name, extra_context in [('scan', ScanningExtraContext(str(source))), ('cached', ExtraContext(source))]:
+        with mock.patch('diaweb.views.get_extra_context', return_value=extra_context):
+            # Warms up the template loaders and the message cache
+            page()
+            events.clear()
+            results[f'{name}_context'] = measure(extra_context.get, repeat)
+            context_events = len(events)
+            events.clear()
+            results[f'{name}_page'] = measure(page, repeat)
+            results[f'{name}_filesystem_calls_per_request'] = {'context': context_events / repeat,
+                                                               'page': len(events) / repeat}
+
+    results['context_speedup'] = results['scan_context']['mean_ms'] / results['cached_context']['mean_ms']
+    results['page_speedup'] = results['scan_page']['mean_ms'] / results['cached_page']['mean_ms']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--source', default=SOURCE, help='Directory of the message .txt files')
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file')
+    args = parser.parse_args()
+
+    with temporary_database():
+        results = run(args.source, args.repeat)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Measures the per-patient measurement date range query used by ``diaweb.graphs`` with
+and without the composite (patient, measurement_date) indexes.
+
+    python -m benchmarks.range_queries --rows 10000 1000000 10000000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+
+from benchmarks import temporary_database, measure, report
+
+START = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+
+def seed(rows, patients):
+    from django.contrib.auth.models import User
+    from django.db import connection, transaction
+    from diaweb.models import Patient, Glucose
+
+    users = User.objects.bulk_create([User(username=f'patient{i}', email=f'patient{i}@example.com')
+                                      for i in range(patients)])
+    patient_ids = [patient.id for patient in Patient.objects.bulk_create(
+        [Patient(user=user, birthdate=datetime(1970, 1, 1).date(), sex='M') for user in users])]
+
+    table = Glucose._meta.db_table
+    sql = (f'INSERT INTO {table} (patient_id, measurement, measurement_type, measurement_date) '
+           f'VALUES (%s, %s, %s, %s)')
+    rng = random.Random(0)
+    span = 10 * 365 * 24 * 3600
+    batch = 50000
+    with connection.cursor() as cursor:
+        for offset in range(0, rows, batch):
+            with transaction.atomic():
+                cursor.executemany(sql, [(rng.choice(patient_ids), rng.uniform(60, 300), rng.randrange(7),
+                                          (START + timedelta(seconds=rng.randrange(span))).isoformat(' '))
+                                         for _ in range(min(batch, rows - offset))])
+
+    return patient_ids
+
+
+def run(rows, patients, repeat, days):
+    from django.db import connection
+    from diaweb.models import Glucose
+
+    indexes = Glucose._meta.indexes
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.remove_index(Glucose, index)
+
+    patient_ids = seed(rows, patients)
+    rng = random.Random(1)
+
+    def query():
+        start = START + timedelta(days=rng.randrange(10 * 365 - days))
+        list(Glucose.objects.filter(patient_id=rng.choice(patient_ids), measurement_date__gte=start,
+                                    measurement_date__lte=start + timedelta(days=days))
+             .values_list('measurement', 'measurement_type', 'measurement_date'))
+
+    without_index = measure(query, repeat)
+    with connection.schema_editor() as editor:
+        for index in indexes:
+            editor.add_index(Glucose, index)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    with_index = measure(query, repeat)
+
+    return {'rows': rows, 'patients': patients, 'range_days': days,
+            'without_index': without_index, 'with_index': with_index,
+            'speedup': without_index['mean_ms'] / with_index['mean_ms']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument('--patients', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--output', default=None, help='Write the JSON results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        with temporary_database():
+            results.append(run(rows, args.patients, args.repeat, args.days))
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
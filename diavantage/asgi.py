@@ -2,6 +2,9 @@
 ASGI config for diavantage project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server, e.g. ``daphne diavantage.asgi:application`` or
+``uvicorn diavantage.asgi:application``. In this mode measurement exports use the
+async ORM and Dash callbacks run on the bounded pool of ``diaweb.executors``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'diaweb.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -61,6 +62,18 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'diavantage.urls'
 
+# Request profiling exposed at /metrics, see diaweb.metrics. Scrapers send
+# ``Authorization: Bearer <METRICS_TOKEN>``; staff users may look as well. Without a
+# token REMOTE_ADDR must be in METRICS_ALLOWED_IPS, which only holds when Django is
+# reached directly: behind a local reverse proxy every request comes from 127.0.0.1,
+# so proxied deployments must set METRICS_TOKEN.
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -80,18 +93,138 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'diavantage.wsgi.application'
 
+ASGI_APPLICATION = 'diavantage.asgi.application'
+
+# Threads building Dash figures, see diaweb.executors
+
+FIGURE_WORKERS = int(os.environ.get('FIGURE_WORKERS', 4))
+
+# Where Plotly figures are built, 'process' (pool of FIGURE_PROCESSES workers) or 'inline'
+
+FIGURE_RENDERER = os.environ.get('FIGURE_RENDERER', 'process')
+
+FIGURE_PROCESSES = int(os.environ.get('FIGURE_PROCESSES', os.cpu_count() or 1))
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# DATABASE_ENGINE selects 'sqlite' (default) or 'postgresql'. Connections are kept
+# open for DATABASE_CONN_MAX_AGE seconds, or with DATABASE_POOL=true PostgreSQL uses
+# Django's native psycopg pool instead (the two are mutually exclusive).
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+DATABASE_POOL = os.environ.get('DATABASE_POOL', 'false').lower() == 'true'
+
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 600))
+
+# WAL lets readers work alongside a writer, the rest trades durability of the last
+# transactions on power loss (not on crashes) and memory for speed
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+DATABASE_ENGINES = {
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # A file rather than shared cache memory, so concurrent test connections wait on
+        # locks for busy_timeout like in production instead of failing right away
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    'postgresql': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DATABASE_NAME', 'diavantage'),
+        'USER': os.environ.get('DATABASE_USER', 'diavantage'),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+        'PORT': os.environ.get('DATABASE_PORT', '5432'),
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 20)),
+            },
+        } if DATABASE_POOL else {},
+    },
+}
+
+DATABASES = {
+    'default': DATABASE_ENGINES[DATABASE_ENGINE] | {
+        'CONN_MAX_AGE': 0 if DATABASE_POOL else DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 
+# Measurement storage read by the dashboard, 'relational' (Glucose/Blood tables) or
+# 'timeseries' (memory-mapped files in TIMESERIES_ROOT, see diaweb.timeseries)
+
+MEASUREMENT_STORE = os.environ.get('MEASUREMENT_STORE', 'relational')
+
+TIMESERIES_ROOT = os.environ.get('TIMESERIES_ROOT', BASE_DIR / 'timeseries')
+
+# Directory holding the files read and written by background jobs, job path arguments
+# are taken relative to it and may not lead outside of it (see diaweb.jobs)
+
+JOB_FILES_ROOT = os.environ.get('JOB_FILES_ROOT', BASE_DIR / 'jobfiles')
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+MEASUREMENT_CACHE_ALIAS = 'measurements'
+
+# MEASUREMENT_CACHE selects a backend below. 'locmem' is private to every process and
+# measurement writes only invalidate the cache of the process that made them, other
+# workers keep serving their entries until MEASUREMENT_CACHE_TIMEOUT. Deployments with
+# several worker processes must use 'redis', or 'file' when they share one host.
+
+# Least recently used entries are culled past MAX_ENTRIES, a Redis server evicts by its own maxmemory-policy
+MEASUREMENT_CACHE_OPTIONS = {'MAX_ENTRIES': int(os.environ.get('MEASUREMENT_CACHE_MAX_ENTRIES', 2000))}
+
+MEASUREMENT_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'measurements',
+        'OPTIONS': MEASUREMENT_CACHE_OPTIONS,
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'measurements',
+        'OPTIONS': MEASUREMENT_CACHE_OPTIONS,
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('MEASUREMENT_CACHE_LOCATION', 'redis://127.0.0.1:6379'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # {% cache %} fragments of the web patient and physician pages, keyed by their ``updated`` version
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template_fragments',
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('TEMPLATE_FRAGMENT_CACHE_MAX_ENTRIES', 5000))},
+    },
+    MEASUREMENT_CACHE_ALIAS: MEASUREMENT_CACHE_BACKENDS[os.environ.get('MEASUREMENT_CACHE', 'locmem')] | {
+        'TIMEOUT': int(os.environ.get('MEASUREMENT_CACHE_TIMEOUT', 600)),
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -130,6 +263,15 @@ STATIC_ROOT = BASE_DIR / 'static'
 
 STATIC_URL = 'static/'
 
+# Landing page messages, kept in memory and reread when the directory mtime changes,
+# checked at most every INDEX_PAGE_MSG_CHECK_INTERVAL seconds. A file compiled with
+# ``manage.py compile_extra_context`` is read instead of the directory when present.
+INDEX_PAGE_MSG_DIR = STATIC_ROOT / 'diaweb' / 'files' / 'index_page_msg'
+
+INDEX_PAGE_MSG_COMPILED = os.environ.get('INDEX_PAGE_MSG_COMPILED', BASE_DIR / 'cache' / 'index_page_msg.json')
+
+INDEX_PAGE_MSG_CHECK_INTERVAL = float(os.environ.get('INDEX_PAGE_MSG_CHECK_INTERVAL', 5))
+
 
 
 # Default primary key field type
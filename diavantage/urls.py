@@ -18,6 +18,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
+from django_plotly_dash.urls import urlpatterns as dash_urlpatterns
 from rest_framework import routers
 
 
@@ -25,7 +26,9 @@ from rest_framework import routers
 from diaweb.views import PatientViewSet, PhysicianViewSet, AddressViewSet, GlucoseViewSet, BloodViewSet, \
     AppointmentViewSet, ReceptionViewSet, \
     BasicPageView, registration_view, PatientWebViewSet, PhysicianWebViewSet, MainPageView, \
-    UserViewSet, get_csrf
+    UserViewSet, JobViewSet, get_csrf
+from diaweb.executors import offload
+from diaweb.metrics import metrics_view
 
 router = routers.DefaultRouter()
 router.register(r'patients', PatientViewSet)
@@ -36,18 +39,24 @@ router.register(r'bloods', BloodViewSet)
 router.register(r'appointments', AppointmentViewSet)
 router.register(r'receptions', ReceptionViewSet)
 router.register(r'users', UserViewSet)
+router.register(r'jobs', JobViewSet)
 
 
 web_router = routers.SimpleRouter()
 web_router.register(r'patients', PatientWebViewSet, basename='web-patient')
 web_router.register(r'physicians', PhysicianWebViewSet, basename='web-physician')
 
+# Dash callbacks query measurements and build figures, so they run on the bounded figure pool
+dash_update_urlpatterns = [path(str(pattern.pattern), offload(pattern.callback), pattern.default_args)
+                           for pattern in dash_urlpatterns if 'update-component' in pattern.name]
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('rest-auth/', include('dj_rest_auth.urls')),
     path('api/', include(router.urls)),
     path('web/', include(web_router.urls)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+    path('django_plotly_dash/', include(dash_update_urlpatterns)),
     path('django_plotly_dash/', include('django_plotly_dash.urls', namespace='django_plotly_dash')),
 
 
@@ -55,6 +64,7 @@ urlpatterns = [
     path('web/' , MainPageView.as_view() , name='main'),
     path('register/<registration_type>/' , registration_view , name='register'),
     path('get_csrf/' , get_csrf , name='get_csrf'),
+    path('metrics', metrics_view, name='metrics'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 
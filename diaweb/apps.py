@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class DiawebConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'diaweb'
+
+    def ready(self):
+        from diaweb import signals, tasks  # noqa: F401
+        from diaweb.extra_context import get_extra_context
+
+        get_extra_context().reload()
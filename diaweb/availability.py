@@ -0,0 +1,131 @@
+"""
+Bookable appointment slots computed from ``Reception`` schedules.
+
+The weekly reception windows of all requested physicians are expanded into
+candidate slots over the date range as one NumPy array of (physician, start)
+keys. Booked appointments form a second key array sorted by start, with the
+running maximum of their ends alongside. A slot is free when every appointment
+starting before the slot ends has ended by the slot start, which is one
+``searchsorted`` call for all candidates at once. Two queries load everything,
+regardless of the number of physicians or weeks.
+"""
+from datetime import datetime, timedelta, time as dt_time
+
+import numpy as np
+from django.utils import timezone
+
+from diaweb.models import Reception, Appointment
+
+SLOT_LENGTH = Appointment.DEFAULT_DURATION
+MIN_SLOT_LENGTH = timedelta(minutes=5)
+MAX_SLOT_LENGTH = timedelta(minutes=480)
+DEFAULT_RANGE = timedelta(days=13)
+MAX_RANGE = timedelta(days=92)
+
+DAY_NUMBERS = {name.lower(): number for number, name in Reception.DAYS.items()}
+
+# Multiplier separating physicians in the combined (physician, epoch second) keys
+PHYSICIAN_STRIDE = 1 << 40
+
+
+def parse_day(day):
+    """
+    ISO weekday of a ``Reception.day`` value, stored as the choice key or its name.
+    """
+    day = str(day).strip()
+    return int(day) if day.isdigit() else DAY_NUMBERS.get(day.lower())
+
+
+def candidate_slots(receptions, start, end, slot_length=SLOT_LENGTH, tz=None):
+    """
+    Returns physician ids and slot starts (epoch seconds) of every slot fitting into
+    a reception window on the dates from ``start`` to ``end`` inclusive.
+    ``receptions`` are (physician_id, day, start_time, end_time) rows.
+    """
+    tz = tz or timezone.get_current_timezone()
+    step = int(slot_length.total_seconds())
+    dates = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    by_weekday = {}
+    for date in dates:
+        by_weekday.setdefault(date.isoweekday(), []).append(date)
+
+    physicians, starts = [], []
+    for physician_id, day, start_time, end_time in receptions:
+        weekday = parse_day(day)
+        if physician_id is None or weekday not in by_weekday or end_time <= start_time:
+            continue
+        window = int((datetime.combine(datetime.min, end_time) - datetime.combine(datetime.min, start_time))
+                     .total_seconds())
+        offsets = np.arange(0, window - step + 1, step, dtype=np.int64)
+        if not len(offsets):
+            continue
+        openings = np.array([int(datetime.combine(date, start_time, tz).timestamp()) for date in by_weekday[weekday]],
+                            dtype=np.int64)
+        slots = (openings[:, None] + offsets[None, :]).ravel()
+        starts.append(slots)
+        physicians.append(np.full(len(slots), physician_id, dtype=np.int64))
+
+    if not starts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(physicians), np.concatenate(starts)
+
+
+def free_slots(physicians, starts, booked_physicians, booked_starts, booked_ends, slot_length=SLOT_LENGTH):
+    """
+    Mask of the candidate slots not overlapping any booked appointment of the same
+    physician, which lasts from ``booked_starts`` to ``booked_ends``.
+    """
+    step = int(slot_length.total_seconds())
+    keys = physicians * PHYSICIAN_STRIDE + starts
+    if len(booked_starts) == 0:
+        return np.ones(len(keys), dtype=bool)
+
+    booked = booked_physicians * PHYSICIAN_STRIDE + booked_starts
+    order = np.argsort(booked, kind='stable')
+    # Latest end up to every appointment, ends of a physician stay below the keys of later physicians
+    ends = np.maximum.accumulate((booked_physicians * PHYSICIAN_STRIDE + booked_ends)[order])
+    before = np.searchsorted(booked[order], keys + step, side='left')
+    return (before == 0) | (ends[np.maximum(before - 1, 0)] <= keys)
+
+
+def find(physician_ids, start, end, slot_length=SLOT_LENGTH, limit=None, now=None):
+    """
+    Returns ``{physician_id: array of free slot starts as datetime64[s] UTC}`` for
+    the dates ``start`` to ``end`` inclusive, without slots in the past and with at
+    most ``limit`` earliest slots per physician.
+    """
+    physician_ids = list(physician_ids)
+    tz = timezone.get_current_timezone()
+    receptions = Reception.objects.filter(physician_id__in=physician_ids) \
+        .values_list('physician_id', 'day', 'start_time', 'end_time')
+    physicians, starts = candidate_slots(receptions, start, end, slot_length, tz)
+
+    first = datetime.combine(start, dt_time.min, tz) - MAX_SLOT_LENGTH
+    last = datetime.combine(end + timedelta(days=1), dt_time.min, tz) + slot_length
+    appointments = list(Appointment.objects.filter(physician_id__in=physician_ids, date__gte=first, date__lt=last)
+                        .values_list('physician_id', 'date', 'duration'))
+    booked_physicians = np.array([physician_id for physician_id, _, _ in appointments], dtype=np.int64)
+    booked_starts = np.array([int(date.timestamp()) for _, date, _ in appointments], dtype=np.int64)
+    booked_ends = booked_starts + np.array([int(duration.total_seconds()) for _, _, duration in appointments],
+                                           dtype=np.int64)
+
+    now = int((now or timezone.now()).timestamp())
+    mask = free_slots(physicians, starts, booked_physicians, booked_starts, booked_ends, slot_length) \
+        & (starts >= now)
+    physicians, starts = physicians[mask], starts[mask]
+
+    order = np.lexsort((starts, physicians))
+    physicians, starts = physicians[order], starts[order].astype('datetime64[s]')
+    bounds = np.searchsorted(physicians, physician_ids), np.searchsorted(physicians, physician_ids, side='right')
+
+    result = {}
+    for physician_id, low, high in zip(physician_ids, *bounds):
+        result[physician_id] = starts[low:high if limit is None else min(high, low + limit)]
+    return result
+
+
+def to_strings(slots):
+    """
+    ISO 8601 UTC strings of ``datetime64[s]`` slot starts.
+    """
+    return [f'{slot}Z' for slot in np.datetime_as_string(slots).tolist()]
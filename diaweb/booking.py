@@ -0,0 +1,74 @@
+"""
+Appointment booking safe under concurrent requests.
+
+A booked slot has to start on the ``availability.SLOT_LENGTH`` grid of one of the
+physician's reception windows. Within one transaction the physician row is locked
+with ``select_for_update``, which serializes bookings of the same physician while
+bookings of other physicians proceed in parallel, the slot is checked against the
+physician's appointments, each lasting its own stored ``duration``, and the
+appointment is inserted. The unique
+(physician, date) constraint settles the race between two requests for the same
+slot on its own when the database cannot lock rows, so the losing insert fails
+instead of double booking.
+"""
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from diaweb import availability
+from diaweb.models import Appointment, Physician, Reception
+
+
+class BookingError(Exception):
+    pass
+
+
+class OutsideReception(BookingError):
+    pass
+
+
+class SlotTaken(BookingError):
+    pass
+
+
+def in_reception(physician_id, start, slot_length=availability.SLOT_LENGTH):
+    """
+    Whether a slot starting at the aware datetime ``start`` lies on the slot grid
+    of one of the physician's reception windows.
+    """
+    local = timezone.localtime(start)
+    for day, start_time, end_time in Reception.objects.filter(physician_id=physician_id) \
+            .values_list('day', 'start_time', 'end_time'):
+        if availability.parse_day(day) != local.isoweekday():
+            continue
+        opening = datetime.combine(local.date(), start_time, local.tzinfo)
+        closing = datetime.combine(local.date(), end_time, local.tzinfo)
+        if opening <= local and local + slot_length <= closing and (local - opening) % slot_length == timedelta():
+            return True
+    return False
+
+
+def book(patient, physician_id, start, slot_length=availability.SLOT_LENGTH):
+    """
+    Books the slot starting at ``start`` for ``patient``. Raises ``OutsideReception``
+    when the physician does not receive at that time and ``SlotTaken`` when the
+    slot overlaps another appointment.
+    """
+    if start < timezone.now() or not in_reception(physician_id, start, slot_length):
+        raise OutsideReception('The physician does not receive patients at that time.')
+
+    try:
+        with transaction.atomic():
+            if not Physician.objects.select_for_update().filter(pk=physician_id).exists():
+                raise OutsideReception('The physician does not exist.')
+            # The start bound lets the (physician, date) index narrow the scan
+            if Appointment.objects.filter(physician_id=physician_id, date__gt=start - availability.MAX_SLOT_LENGTH,
+                                          date__lt=start + slot_length) \
+                    .alias(end=F('date') + F('duration')).filter(end__gt=start).exists():
+                raise SlotTaken('The slot is already booked.')
+            return Appointment.objects.create(patient=patient, physician_id=physician_id, date=start,
+                                              duration=slot_length)
+    except IntegrityError:
+        raise SlotTaken('The slot is already booked.')
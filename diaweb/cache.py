@@ -0,0 +1,69 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def get_cache():
+    return caches[settings.MEASUREMENT_CACHE_ALIAS]
+
+
+def version_key(patient_id):
+    return f'measurements:{patient_id}:version'
+
+
+def get_version(patient_id):
+    """
+    Every cached entry of a patient embeds this version, so changing it invalidates
+    all of them at once. Versions are timestamps rather than counters, so a version
+    evicted from the cache can never be recreated with a value of stale entries.
+    """
+    cache = get_cache()
+    key = version_key(patient_id)
+    cache.add(key, time.time_ns(), timeout=None)
+    return cache.get(key)
+
+
+def invalidate(patient_id):
+    get_cache().set(version_key(patient_id), time.time_ns(), timeout=None)
+
+
+def invalidate_on_commit(patient_ids):
+    """
+    Invalidates the patients once the current transaction commits. A request reading
+    before the commit would otherwise cache the old readings under the new version.
+    """
+    for patient_id in set(patient_ids):
+        transaction.on_commit(lambda patient_id=patient_id: invalidate(patient_id))
+
+
+def make_key(patient_id, version, kind, series, min_date, max_date):
+    return (f'measurements:{patient_id}:{version}:{kind}:{series}:'
+            f'{int(min_date.timestamp())}:{int(max_date.timestamp())}')
+
+
+def cached_many(patient_id, kind, series, min_date, max_date, loader):
+    """
+    Returns a dict with the cached ``kind`` value of every name in ``series`` for the
+    patient and date range. ``loader`` is called once with the list of missing names
+    and must return a dict of their values, which are then stored.
+    """
+    cache = get_cache()
+    version = get_version(patient_id)
+    keys = {name: make_key(patient_id, version, kind, name, min_date, max_date) for name in series}
+
+    found = cache.get_many(keys.values())
+    result = {name: found[key] for name, key in keys.items() if key in found}
+
+    missing = [name for name in series if name not in result]
+    if missing:
+        loaded = loader(missing)
+        cache.set_many({keys[name]: loaded[name] for name in missing})
+        result.update(loaded)
+
+    return result
+
+
+def cached(patient_id, kind, series, min_date, max_date, loader):
+    return cached_many(patient_id, kind, [series], min_date, max_date, lambda missing: {series: loader()})[series]
@@ -0,0 +1,175 @@
+"""
+Batch diabetes risk classification filling ``Patient.classifier_result``.
+
+Readings of the last ``WINDOW`` are aggregated per patient and measurement type
+in the database. The features and the prediction of a whole chunk of patients
+are then computed at once with NumPy arrays, so scoring does not loop over
+patients or readings in Python.
+
+The rules follow the usual diagnostic thresholds: fasting glucose of 126 mg/dL
+or more, post meal glucose of 200 mg/dL or more, a glucose management indicator
+(estimated HbA1c) of 6.5 % or more, or over a quarter of the readings above
+180 mg/dL. Prediabetic fasting values count as well when blood pressure is
+high.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Count, Sum, Avg, F, Q
+from django.utils import timezone
+
+from diaweb.ingest import chunked
+from diaweb.models import Patient, Glucose, Blood
+
+WINDOW = timedelta(days=90)
+CHUNK_SIZE = 1000
+
+# Fewer glucose readings than this in the window leave the patient "Not Performed"
+MIN_READINGS = 14
+
+FASTING_TYPES = [1]
+PRE_MEAL_TYPES = [1, 3, 5]
+POST_MEAL_TYPES = [2, 4, 6]
+
+FASTING_LIMIT = 126
+PREDIABETES_FASTING_LIMIT = 100
+POST_MEAL_LIMIT = 200
+GMI_LIMIT = 6.5
+HIGH_GLUCOSE = 180
+HIGH_FRACTION_LIMIT = 0.25
+SYSTOLIC_LIMIT = 140
+DIASTOLIC_LIMIT = 90
+
+POSSIBLE_DIABETES = 1
+NO_DIABETES = -1
+NOT_PERFORMED = 0
+
+
+def _mean(sums, counts):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def extract_features(patient_ids, since):
+    """
+    Returns a dict of feature arrays aligned with the sorted ``patient_ids``, built
+    from one grouped Glucose query and one grouped Blood query.
+    """
+    ids = np.sort(np.asarray(patient_ids, dtype=np.int64))
+    size = len(ids)
+    types = max(Glucose.MEASUREMENT_TYPES) + 1
+
+    # Choices are not enforced by bulk_create or raw imports, unknown types are left out
+    rows = list(Glucose.objects.filter(patient_id__in=ids.tolist(), measurement_date__gte=since,
+                                       measurement_type__in=list(Glucose.MEASUREMENT_TYPES))
+                .values('patient_id', 'measurement_type')
+                .annotate(count=Count('measurement'), sum=Sum('measurement'),
+                          sum_squares=Sum(F('measurement') * F('measurement')),
+                          high=Count('measurement', filter=Q(measurement__gt=HIGH_GLUCOSE)))
+                .order_by()
+                .values_list('patient_id', 'measurement_type', 'count', 'sum', 'sum_squares', 'high'))
+    data = np.array(rows, dtype=np.float64).reshape(-1, 6)
+    index = np.searchsorted(ids, data[:, 0].astype(np.int64))
+    kind = data[:, 1].astype(np.int64)
+
+    counts, sums = np.zeros((size, types)), np.zeros((size, types))
+    np.add.at(counts, (index, kind), data[:, 2])
+    np.add.at(sums, (index, kind), data[:, 3])
+    sum_squares, high = np.zeros(size), np.zeros(size)
+    np.add.at(sum_squares, index, data[:, 4])
+    np.add.at(high, index, data[:, 5])
+
+    count = counts.sum(axis=1)
+    total = sums.sum(axis=1)
+    mean = _mean(total, count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(np.maximum(np.where(count > 1, (sum_squares - total * mean) / (count - 1), np.nan), 0))
+
+    pre_meal = _mean(sums[:, PRE_MEAL_TYPES].sum(axis=1), counts[:, PRE_MEAL_TYPES].sum(axis=1))
+    post_meal = _mean(sums[:, POST_MEAL_TYPES].sum(axis=1), counts[:, POST_MEAL_TYPES].sum(axis=1))
+
+    blood = list(Blood.objects.filter(patient_id__in=ids.tolist(), measurement_date__gte=since)
+                 .values('patient_id')
+                 .annotate(systolic=Avg('systolic_pressure'), diastolic=Avg('diastolic_pressure'))
+                 .order_by()
+                 .values_list('patient_id', 'systolic', 'diastolic'))
+    blood = np.array(blood, dtype=np.float64).reshape(-1, 3)
+    systolic, diastolic = np.full(size, np.nan), np.full(size, np.nan)
+    blood_index = np.searchsorted(ids, blood[:, 0].astype(np.int64))
+    systolic[blood_index], diastolic[blood_index] = blood[:, 1], blood[:, 2]
+
+    return {
+        'patient_id': ids,
+        'count': count,
+        'mean': mean,
+        'std': std,
+        'cv': _mean(std, mean),
+        'fasting_mean': _mean(sums[:, FASTING_TYPES].sum(axis=1), counts[:, FASTING_TYPES].sum(axis=1)),
+        'post_meal_mean': post_meal,
+        'excursion': post_meal - pre_meal,
+        'gmi': 3.31 + 0.02392 * mean,
+        'high_fraction': _mean(high, count),
+        'systolic': systolic,
+        'diastolic': diastolic,
+    }
+
+
+def score(features):
+    """
+    Returns the ``Patient.PREDICTIONS`` value of every patient in ``features``.
+    Comparisons with missing (NaN) features are false.
+    """
+    with np.errstate(invalid='ignore'):
+        hypertension = (features['systolic'] >= SYSTOLIC_LIMIT) | (features['diastolic'] >= DIASTOLIC_LIMIT)
+        risk = ((features['fasting_mean'] >= FASTING_LIMIT)
+                | (features['post_meal_mean'] >= POST_MEAL_LIMIT)
+                | (features['gmi'] >= GMI_LIMIT)
+                | (features['high_fraction'] > HIGH_FRACTION_LIMIT)
+                | ((features['fasting_mean'] >= PREDIABETES_FASTING_LIMIT) & hypertension))
+
+    result = np.where(risk, POSSIBLE_DIABETES, NO_DIABETES)
+    return np.where(features['count'] >= MIN_READINGS, result, NOT_PERFORMED)
+
+
+def stale_patients(queryset=None):
+    """
+    Patients never classified or with readings stored, changed or deleted since their
+    last classification. Backfilled readings dated before it count as well.
+    """
+    queryset = Patient.objects.all() if queryset is None else queryset
+    return queryset.filter(Q(classified_at__isnull=True) | Q(measurements_changed_at__gte=F('classified_at')))
+
+
+def classify(queryset=None, incremental=False, chunk_size=CHUNK_SIZE, window=WINDOW, progress=None):
+    """
+    Scores the patients of ``queryset`` (all by default, only stale ones when
+    ``incremental``) in chunks and stores the results with ``bulk_update``.
+    ``progress`` is called with the finished fraction after every chunk.
+    Returns the number of patients per prediction.
+    """
+    queryset = Patient.objects.all() if queryset is None else queryset
+    if incremental:
+        queryset = stale_patients(queryset)
+
+    now = timezone.now()
+    since = now - window
+    totals = dict.fromkeys(Patient.PREDICTIONS, 0)
+
+    # Materialized first, updating classified_at changes the incremental filter while iterating
+    patient_ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    for done, chunk in enumerate(chunked(patient_ids, chunk_size), start=1):
+        _classify_chunk(chunk, since, now, totals)
+        if progress is not None:
+            progress(min(done * chunk_size, len(patient_ids)) / len(patient_ids))
+
+    return totals
+
+
+def _classify_chunk(patient_ids, since, now, totals):
+    features = extract_features(patient_ids, since)
+    results = score(features)
+    Patient.objects.bulk_update([Patient(pk=patient_id, classifier_result=result, classified_at=now, updated=now)
+                                 for patient_id, result in zip(features['patient_id'].tolist(), results.tolist())],
+                                ['classifier_result', 'classified_at', 'updated'], batch_size=len(patient_ids))
+    for prediction, count in zip(*np.unique(results, return_counts=True)):
+        totals[int(prediction)] += int(count)
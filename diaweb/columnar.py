@@ -0,0 +1,162 @@
+"""
+Columnar binary format for measurement history.
+
+A file starts with the ``MAGIC`` bytes, a little endian uint64 with the length of a
+JSON header and the header itself. The header lists every column with its NumPy
+dtype and byte offset. Column data follows as contiguous arrays aligned to
+``ALIGNMENT`` bytes, so any column can be mapped with ``numpy.memmap`` without
+copying or parsing.
+
+Exports are partitioned into one file per patient and month::
+
+    <root>/<series>/patient=<id>/<YYYY-MM>.dcol
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+from diaweb.models import Glucose, Blood
+
+MAGIC = b'DIACOL1\n'
+ALIGNMENT = 64
+EXTENSION = '.dcol'
+
+# Model -> exported columns as (field, dtype)
+COLUMNS = {
+    Glucose: [('measurement_date', '<M8[us]'), ('measurement', '<f8'), ('measurement_type', '|u1')],
+    Blood: [('measurement_date', '<M8[us]'), ('systolic_pressure', '<i2'), ('diastolic_pressure', '<i2'),
+            ('pulse_rate', '<i2')],
+}
+
+SERIES_NAMES = {
+    Glucose: 'glucose',
+    Blood: 'blood',
+}
+
+
+def _padding(position):
+    return -position % ALIGNMENT
+
+
+def to_columns(model, rows):
+    """
+    Converts ``values_list`` rows of the exported fields into typed NumPy arrays.
+    """
+    fields = COLUMNS[model]
+    values = list(zip(*rows)) or [()] * len(fields)
+    columns = {}
+    for (name, dtype), column in zip(fields, values):
+        if name == 'measurement_date':
+            column = [date.replace(tzinfo=None) for date in column]
+        columns[name] = np.array(column, dtype=dtype)
+    return columns
+
+
+def write(file, columns, metadata=None):
+    """
+    Writes a dict of equally long arrays to the binary ``file`` object.
+    """
+    rows = len(next(iter(columns.values()))) if columns else 0
+    header = {'rows': rows, 'metadata': metadata or {}, 'columns': []}
+
+    # Offsets depend on the header size, so the header is sized with placeholder offsets first
+    layout = [(name, np.ascontiguousarray(array)) for name, array in columns.items()]
+    header['columns'] = [{'name': name, 'dtype': array.dtype.str, 'offset': 0} for name, array in layout]
+    encoded = json.dumps(header).encode()
+    reserved = len(encoded) + 32 * len(layout)
+
+    position = len(MAGIC) + 8 + reserved
+    position += _padding(position)
+    for column, (_, array) in zip(header['columns'], layout):
+        column['offset'] = position
+        position += array.nbytes + _padding(array.nbytes)
+
+    encoded = json.dumps(header).encode().ljust(reserved)
+    start = len(MAGIC) + 8 + reserved
+    file.write(MAGIC + struct.pack('<Q', reserved) + encoded + b'\0' * _padding(start))
+    for _, array in layout:
+        file.write(array.tobytes())
+        file.write(b'\0' * _padding(array.nbytes))
+
+
+def read_header(path):
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a columnar measurement file')
+        length, = struct.unpack('<Q', file.read(8))
+        return json.loads(file.read(length))
+
+
+def read(path):
+    """
+    Maps every column of the file at ``path`` with ``numpy.memmap``. Returns the
+    columns dict and the file metadata.
+    """
+    header = read_header(path)
+    columns = {}
+    for column in header['columns']:
+        columns[column['name']] = np.memmap(path, dtype=np.dtype(column['dtype']), mode='r',
+                                            offset=column['offset'], shape=(header['rows'],)) \
+            if header['rows'] else np.empty(0, dtype=np.dtype(column['dtype']))
+    return columns, header['metadata']
+
+
+def partition_path(root, model, patient_id, month):
+    return os.path.join(root, SERIES_NAMES[model], f'patient={patient_id}', f'{month}{EXTENSION}')
+
+
+def export_history(root, model, queryset=None, chunk_size=10000):
+    """
+    Writes the history of ``model`` into monthly partitions per patient below
+    ``root``. Rows are streamed ordered by patient and date, so only one partition
+    is kept in memory. Returns the number of written files.
+    """
+    queryset = model.objects.all() if queryset is None else queryset
+    fields = ['patient_id'] + [name for name, _ in COLUMNS[model]]
+    rows = queryset.order_by('patient_id', 'measurement_date', 'pk').values_list(*fields).iterator(chunk_size)
+
+    written = 0
+    key, partition = None, []
+    for patient_id, *row in rows:
+        row_key = (patient_id, row[0].strftime('%Y-%m'))
+        if row_key != key and partition:
+            _write_partition(root, model, key, partition)
+            written += 1
+            partition = []
+        key = row_key
+        partition.append(row)
+
+    if partition:
+        _write_partition(root, model, key, partition)
+        written += 1
+
+    return written
+
+
+def _write_partition(root, model, key, rows):
+    patient_id, month = key
+    path = partition_path(root, model, patient_id, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        write(file, to_columns(model, rows), {'series': SERIES_NAMES[model], 'patient': patient_id, 'month': month})
+
+
+def load_history(root, model, patient_id, start_month=None, end_month=None):
+    """
+    Reads the monthly partitions of one patient, optionally limited to the
+    ``YYYY-MM`` month range, into one array per column.
+    """
+    directory = os.path.join(root, SERIES_NAMES[model], f'patient={patient_id}')
+    months = sorted(name[:-len(EXTENSION)] for name in os.listdir(directory) if name.endswith(EXTENSION)) \
+        if os.path.isdir(directory) else []
+    months = [month for month in months
+              if (start_month is None or month >= start_month) and (end_month is None or month <= end_month)]
+
+    partitions = [read(os.path.join(directory, month + EXTENSION))[0] for month in months]
+    if len(partitions) == 1:
+        return partitions[0]
+    if not partitions:
+        return to_columns(model, [])
+    return {name: np.concatenate([partition[name] for partition in partitions]) for name, _ in COLUMNS[model]}
@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def _bucket_ids(x, buckets):
+    """
+    Assigns every point to one of ``buckets`` equally wide intervals of ``x``, which
+    corresponds to one horizontal pixel range of the rendered figure.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    span = x[-1] - x[0]
+    if span <= 0:
+        return np.zeros(len(x), dtype=np.int64)
+    return np.minimum(((x - x[0]) / span * buckets).astype(np.int64), buckets - 1)
+
+
+def min_max(x, y, threshold):
+    """
+    Returns sorted indices of at most ``threshold`` points keeping the minimum and the
+    maximum of every bucket, so peaks and dips stay visible. ``x`` must be sorted.
+    """
+    n = len(y)
+    if threshold <= 0 or n <= threshold:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    buckets = _bucket_ids(x, max((threshold - 2) // 2, 1))
+    order = np.lexsort((y, buckets))
+    _, first = np.unique(buckets[order], return_index=True)
+    last = np.append(first[1:], n) - 1
+
+    return np.unique(np.concatenate([order[first], order[last], [0, n - 1]]))
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: returns sorted indices of ``threshold`` points that
+    best preserve the visual shape of the line. ``x`` must be sorted.
+    """
+    n = len(y)
+    if threshold <= 2 or n <= threshold:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    result = np.empty(threshold, dtype=np.int64)
+    result[0], result[-1] = 0, n - 1
+    selected = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+
+        area = np.abs((x[selected] - next_x) * (y[start:end] - y[selected])
+                      - (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(area.argmax())
+        result[i + 1] = selected
+
+    return result
@@ -0,0 +1,60 @@
+"""
+Bounded worker pools for slow, CPU heavy work such as building Dash figures.
+
+Under ASGI Django runs every synchronous view on one shared thread, so a slow
+callback would hold up logins and API requests behind it. Views wrapped with
+``offload`` run on ``FIGURE_WORKERS`` dedicated threads instead and the event
+loop keeps serving other requests while they work.
+
+Figures themselves are rendered on the process pool of ``get_render_executor``,
+so concurrent dashboards use all cores instead of sharing one interpreter.
+"""
+import functools
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+
+@lru_cache(maxsize=None)
+def get_figure_executor():
+    return ThreadPoolExecutor(max_workers=settings.FIGURE_WORKERS, thread_name_prefix='figure')
+
+
+@lru_cache(maxsize=None)
+def get_render_executor():
+    # Spawned rather than forked, a fork of a threaded server can inherit locks held by other threads
+    return ProcessPoolExecutor(max_workers=settings.FIGURE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _with_connections(func):
+    # Pool threads outlive requests, so stale connections are dropped like at request boundaries
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """
+    Runs the synchronous ``func`` on the figure pool and awaits its result.
+    """
+    return await sync_to_async(_with_connections(func), thread_sensitive=False,
+                               executor=get_figure_executor())(*args, **kwargs)
+
+
+def offload(view):
+    """
+    Turns a synchronous view into an async one running on the figure pool.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await run_in_pool(view, request, *args, **kwargs)
+    return wrapper
@@ -1,9 +1,26 @@
+"""
+Welcome messages of the landing page.
+
+Every ``.txt`` file of the message directory holds one message, a title line
+followed by its text lines. ``ExtraContext`` keeps the parsed messages in memory
+as nested tuples and looks at the disk again at most every ``check_interval``
+seconds, rereading the files only when the directory mtime changed. A file written
+by the ``compile_extra_context`` command takes precedence over the directory, it
+is a single JSON document read in place of the directory scan.
+"""
+import json
 import os
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+
 
 def import_extra_context(directory_str):
     directory = os.fsencode(directory_str)
     result = []
-    for file in os.listdir(directory):
+    for file in sorted(os.listdir(directory)):
         filename = os.fsdecode(file)
         if filename.endswith(".txt"):
             with open(os.path.join(directory_str, filename), "r") as f:
@@ -14,3 +31,73 @@ def import_extra_context(directory_str):
 
     return result
 
+
+def freeze(messages):
+    return tuple((title, tuple(lines)) for title, lines in messages)
+
+
+def compile_extra_context(directory, output):
+    """
+    Writes the messages of ``directory`` to the ``output`` JSON file. Returns the
+    number of messages.
+    """
+    messages = import_extra_context(directory)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(messages, file)
+    return len(messages)
+
+
+class ExtraContext:
+    def __init__(self, directory, compiled=None, check_interval=5.0):
+        self.directory = str(directory)
+        self.compiled = str(compiled) if compiled else None
+        self.check_interval = check_interval
+        self._messages = ()
+        self._source = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        # (path, mtime) of the compiled file or else the directory, None without either
+        for path in [self.compiled, self.directory]:
+            if path is None:
+                continue
+            try:
+                return path, os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _load(self, source):
+        if source is None:
+            return ()
+        path, _ = source
+        if path == self.compiled:
+            with open(path) as file:
+                return freeze(json.load(file))
+        return freeze(import_extra_context(path))
+
+    def reload(self):
+        """
+        Rereads the messages if their source changed and returns them.
+        """
+        with self._lock:
+            source = self._stat()
+            if source != self._source:
+                self._messages = self._load(source)
+                self._source = source
+            self._checked_at = time.monotonic()
+        return self._messages
+
+    def get(self):
+        checked_at = self._checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.check_interval:
+            return self._messages
+        return self.reload()
+
+
+@lru_cache
+def get_extra_context():
+    return ExtraContext(settings.INDEX_PAGE_MSG_DIR, settings.INDEX_PAGE_MSG_COMPILED,
+                        settings.INDEX_PAGE_MSG_CHECK_INTERVAL)
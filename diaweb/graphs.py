@@ -1,20 +1,33 @@
+import json
 import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
 import dash
+import numpy as np
 import pandas as pd
-import plotly.express as px
 from dash import dcc, html, dash_table ,no_update
 
 
+from django.conf import settings
 from django.utils import timezone
 from django.utils.termcolors import background
 from django_plotly_dash import DjangoDash
 from six import text_type
 
+from diaweb import cache, figures, metrics, rollups, timeseries
+from diaweb.executors import get_render_executor
+from diaweb.downsampling import min_max
 from diaweb.models import Glucose, Blood
 
 
+@lru_cache
+def year_range(start_date, end_date):
+    return tuple(range(start_date, end_date + 1))
+
 def get_dates(start_date: int = 2000):
-    return [i for i in range(start_date, int(timezone.now().year) + 1)]
+    return list(year_range(start_date, timezone.now().year))
 
 def unix_time_millis(dt):
     return int(time.mktime(dt.timetuple()))
@@ -22,54 +35,121 @@ def unix_time_millis(dt):
 def unix_to_datetime(unix):
     return pd.to_datetime(unix,unit='s')
 
-def get_marks(daterange, Nth=100):
-
-    result = {}
-    for i, date in enumerate(daterange):
-        if i%Nth == 1:
-            # Append value to dict
-            result[unix_time_millis(date)] = str(date.strftime('%Y-%m-%d'))
-
-    return result
+@lru_cache
+def slider_range(start_date, end_date, marks=5):
+    """
+    Bounds and about ``marks`` evenly spaced marks of a daily slider from January 1st
+    of ``start_date`` to December 31st of ``end_date``, computed from the number of
+    days instead of building the daily range.
+    """
+    first = datetime(start_date, 1, 1)
+    days = (date(end_date, 12, 31) - first.date()).days + 1
+    step = max(days // marks, 2)
+    return (unix_time_millis(first), unix_time_millis(first + timedelta(days=days - 1)),
+            {unix_time_millis(first + timedelta(days=day)): (first + timedelta(days=day)).strftime('%Y-%m-%d')
+             for day in range(1, days, step)})
 
 app = DjangoDash('MeasurementsAnalysis')
 
-app.layout = lambda: html.Div(children=[
-    html.Fieldset(children=[
-        html.Legend('Graph Types'),
-        dcc.Checklist(id='graph-types',
-                  options={
-                      'Glucose': 'Blood Glucose',
-                      'Sys': 'Blood Systolic Pressure',
-                      'Dia': 'Blood Diastolic Pressure',
-                      'Pulse': 'Pulse Rate',
-                  }, inline=False),]
-    ),
-    html.Div(id='graph-properties', children=[
-        html.Fieldset(children=[
-          html.Legend('Graph Properties'),
-          dcc.Dropdown(id='start-date', options=get_dates(), placeholder='Start Date'),
-          dcc.Dropdown(id='end-date', options=get_dates(), placeholder='End Date', disabled=True),
-          html.Div(id='slider-container', children=[]),
-          html.Output(id='slider-output', children=[]),
-        ])
-    ]),
-    html.Div(id='data-statistics', children=[
+@lru_cache
+def build_layout(year):
+    """
+    Component tree of the dashboard, built once per year of the date options.
+    """
+    return html.Div(children=[
         html.Fieldset(children=[
-            html.Legend('Data Statistics'),
-            dash_table.DataTable(id='data-table',
-                                 columns=[{'name': i, 'id': i} for i in ['type', 'count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']],
-                                 data=[],
-                                 style_cell=dict(textAlign='center'),
-                                 style_header=dict(textAlign='center',
-                                                   text_type='italic',
-                                                   backgroundColor="cornflowerblue"),
-                                 style_as_list_view=True,
-                                 ),
-        ])
-    ]),
-    html.Div(id='graph-content', children=[]),
-])
+            html.Legend('Graph Types'),
+            dcc.Checklist(id='graph-types',
+                      options={
+                          'Glucose': 'Blood Glucose',
+                          'Sys': 'Blood Systolic Pressure',
+                          'Dia': 'Blood Diastolic Pressure',
+                          'Pulse': 'Pulse Rate',
+                      }, inline=False),]
+        ),
+        html.Div(id='graph-properties', children=[
+            html.Fieldset(children=[
+              html.Legend('Graph Properties'),
+              dcc.Dropdown(id='start-date', options=list(year_range(2000, year)), placeholder='Start Date'),
+              # Filled by update_end_date once a start year is picked
+              dcc.Dropdown(id='end-date', options=[], placeholder='End Date', disabled=True),
+              html.Div(id='slider-container', children=[]),
+              html.Output(id='slider-output', children=[]),
+            ])
+        ]),
+        html.Div(id='data-statistics', children=[
+            html.Fieldset(children=[
+                html.Legend('Data Statistics'),
+                dash_table.DataTable(id='data-table',
+                                     columns=[{'name': i, 'id': i} for i in ['type', 'count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']],
+                                     data=[],
+                                     style_cell=dict(textAlign='center'),
+                                     style_header=dict(textAlign='center',
+                                                       text_type='italic',
+                                                       backgroundColor="cornflowerblue"),
+                                     style_as_list_view=True,
+                                     ),
+            ])
+        ]),
+        html.Div(id='graph-content', children=[]),
+    ])
+
+app.layout = lambda: build_layout(timezone.now().year)
+
+
+# Dashboard series -> (model, column, label in the statistics table)
+MEASUREMENT_SERIES = {
+    'Glucose': (Glucose, 'measurement', 'GLU'),
+    'Sys': (Blood, 'systolic_pressure', 'SYS'),
+    'Dia': (Blood, 'diastolic_pressure', 'DIA'),
+    'Pulse': (Blood, 'pulse_rate', 'PUL'),
+}
+
+
+# Ranges longer than the threshold are read from the rollups of the given resolution
+ROLLUP_THRESHOLDS = [
+    (timedelta(days=365), rollups.DAY),
+    (timedelta(days=14), rollups.HOUR),
+]
+
+
+def filter_range(model, patient_id, min_date, max_date):
+    return model.objects.filter(patient_id=patient_id, measurement_date__gte=min_date, measurement_date__lte=max_date)
+
+
+def rollup_resolution(min_date, max_date):
+    for threshold, resolution in ROLLUP_THRESHOLDS:
+        if max_date - min_date > threshold:
+            return resolution
+    return None
+
+
+def load_rollup(patient_id, series, min_date, max_date, resolution):
+    _, _, label = MEASUREMENT_SERIES[series]
+    return rollups.load(patient_id, label, min_date.tz_localize('UTC'), max_date.tz_localize('UTC'), resolution)
+
+
+def load_timeseries(patient_id, series, min_date, max_date):
+    _, _, label = MEASUREMENT_SERIES[series]
+    return timeseries.get_store().range(patient_id, label, int(min_date.timestamp()), int(max_date.timestamp()))
+
+
+def describe(values):
+    """
+    Same summary as ``pandas.DataFrame.describe`` computed in one NumPy pass.
+    """
+    count = len(values)
+    q25, q50, q75 = np.percentile(values, [25, 50, 75])
+    return {
+        'count': count,
+        'mean': float(values.mean()),
+        'std': float(values.std(ddof=1)) if count > 1 else None,
+        'min': float(values.min()),
+        '25%': float(q25),
+        '50%': float(q50),
+        '75%': float(q75),
+        'max': float(values.max()),
+    }
 
 
 @app.callback(
@@ -77,6 +157,7 @@ app.layout = lambda: html.Div(children=[
     dash.dependencies.Input('date-slider', 'value'),
     dash.dependencies.Input('graph-types', 'value'),
 )
+@metrics.dash_callback
 def update_data_statistics(slider_values, graph_types, *args, **kwargs):
     if graph_types is None:
         return no_update
@@ -86,52 +167,136 @@ def update_data_statistics(slider_values, graph_types, *args, **kwargs):
     min_date = unix_to_datetime(slider_values[0])
     max_date = unix_to_datetime(slider_values[1])
 
-    result = pd.DataFrame()
+    selected = [series for series in MEASUREMENT_SERIES if series in graph_types]
+    statistics = cache.cached_many(patient_id, 'statistics', selected, min_date, max_date,
+                                   lambda missing: load_statistics(patient_id, missing, min_date, max_date))
 
-    if 'Glucose' in graph_types:
-        data = Glucose.objects.filter(patient_id=patient_id, measurement_date__gte=min_date, measurement_date__lte=max_date).values('measurement',)
-        try:
-            df = pd.DataFrame(data).describe()
-            df = df._append(pd.Series({'measurement': 'GLU'}, name="type"))
-
-            result = result._append(df['measurement'])
-        except ValueError:
-            pass
-
-    if 'Sys' in graph_types:
-        data = Blood.objects.filter(measurement_date__gte=min_date, measurement_date__lte=max_date).values('systolic_pressure')
-        try:
-            df = pd.DataFrame(data).describe()
-            df = df._append(pd.Series({'systolic_pressure': 'SYS'}, name="type"))
+    return [statistics[series] | {'type': MEASUREMENT_SERIES[series][2]}
+            for series in selected if statistics[series] is not None]
 
-            result = result._append(df['systolic_pressure'])
-        except ValueError:
-            pass
 
-    if 'Dia' in graph_types:
-        data = Blood.objects.filter(measurement_date__gte=min_date, measurement_date__lte=max_date).values('diastolic_pressure')
-        try:
-            df = pd.DataFrame(data).describe()
+def load_statistics(patient_id, selected, min_date, max_date):
+    if timeseries.is_enabled():
+        result = {}
+        for series in selected:
+            _, values, _ = load_timeseries(patient_id, series, min_date, max_date)
+            result[series] = describe(np.asarray(values, dtype=float)) if len(values) > 0 else None
+        return result
 
-            df = df._append(pd.Series({'diastolic_pressure': 'DIA'}, name="type"))
+    resolution = rollup_resolution(min_date, max_date)
+    if resolution is not None:
+        return {series: rollups.describe(load_rollup(patient_id, series, min_date, max_date, resolution))
+                for series in selected}
 
-            result = result._append(df['diastolic_pressure'])
-        except ValueError:
-            pass
+    # One fetch per model covering every requested column of it
+    columns = {}
+    for series in selected:
+        model, field, _ = MEASUREMENT_SERIES[series]
+        columns.setdefault(model, []).append(field)
 
+    arrays = {}
+    for model, fields in columns.items():
+        rows = filter_range(model, patient_id, min_date, max_date).values_list(*fields)
+        data = np.array(list(rows), dtype=float).reshape(-1, len(fields))
+        for i, field in enumerate(fields):
+            arrays[(model, field)] = data[:, i]
 
-    if 'Pulse' in graph_types:
-        data = Blood.objects.filter(measurement_date__gte=min_date, measurement_date__lte=max_date).values('pulse_rate')
-        try:
-            df = pd.DataFrame(data).describe()
+    result = {}
+    for series in selected:
+        model, field, _ = MEASUREMENT_SERIES[series]
+        values = arrays[(model, field)]
+        result[series] = describe(values) if len(values) > 0 else None
 
-            df = df._append(pd.Series({'pulse_rate': 'PUL'}, name="type"))
+    return result
 
-            result = result._append(df['pulse_rate'])
-        except ValueError:
-            pass
 
-    return result.to_dict('records')
+GRAPH_IDS = {
+    'Glucose': 'glucose-graph',
+    'Sys': 'systolic-graph',
+    'Dia': 'diastolic-graph',
+    'Pulse': 'pulse-graph',
+}
+
+# Approximate plot width in pixels, min/max downsampling keeps two points per pixel
+GRAPH_WIDTH = 1200
+
+
+def load_series(patient_id, series, min_date, max_date):
+    model, field, _ = MEASUREMENT_SERIES[series]
+    fields = ['measurement_date', field] + (['measurement_type'] if model is Glucose else [])
+
+    if timeseries.is_enabled():
+        times, values, types = load_timeseries(patient_id, series, min_date, max_date)
+        columns = {
+            'measurement_date': pd.to_datetime(np.asarray(times), unit='s', utc=True),
+            field: np.asarray(values),
+            'measurement_type': np.asarray(types),
+        }
+        return pd.DataFrame({column: columns[column] for column in fields})
+
+    resolution = rollup_resolution(min_date, max_date)
+    if resolution is not None:
+        # Both the minimum and the maximum of every bucket are plotted so extremes survive aggregation
+        rollup = load_rollup(patient_id, series, min_date, max_date, resolution)
+        columns = {
+            'measurement_date': pd.to_datetime(np.repeat(rollup['bucket'], 2), utc=True),
+            field: np.column_stack([rollup['min'], rollup['max']]).ravel(),
+            'measurement_type': np.repeat(rollup['measurement_type'], 2),
+        }
+        return pd.DataFrame({column: columns[column] for column in fields})
+
+    rows = filter_range(model, patient_id, min_date, max_date).order_by('measurement_date').values_list(*fields)
+    return pd.DataFrame(list(rows), columns=fields)
+
+
+def downsample(df, x, y, color=None, threshold=2 * GRAPH_WIDTH):
+    """
+    Reduces every line of the figure to at most ``threshold`` points before plotting.
+    """
+    if len(df) <= threshold:
+        return df
+
+    groups = [df] if color is None else [group for _, group in df.groupby(color, sort=False)]
+    parts = [group.iloc[min_max(pd.DatetimeIndex(group[x]).asi8, group[y].to_numpy(), threshold)]
+             for group in groups]
+    return pd.concat(parts).sort_values(x, kind='stable')
+
+
+def _render_in_pool(jobs):
+    executor = get_render_executor()
+    try:
+        futures = {series: executor.submit(figures.render, *job) for series, job in jobs.items()}
+        return {series: future.result() for series, future in futures.items()}
+    except BrokenProcessPool:
+        # A pool with a dead worker rejects all work, it is replaced by the next call
+        if get_render_executor() is executor:
+            get_render_executor.cache_clear()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+def render_figures(patient_id, selected, min_date, max_date):
+    """
+    Returns the figure JSON of every series in ``selected``. With the process
+    renderer all figures are built in parallel on the render pool, retried once
+    on a new pool if a worker died and rendered inline if that fails as well.
+    """
+    jobs = {}
+    for series in selected:
+        model, field, _ = MEASUREMENT_SERIES[series]
+        color = 'measurement_type' if model is Glucose else None
+        df = downsample(load_series(patient_id, series, min_date, max_date), 'measurement_date', field, color)
+        jobs[series] = (df, 'measurement_date', field, color)
+
+    if settings.FIGURE_RENDERER != 'process':
+        return {series: figures.render(*job) for series, job in jobs.items()}
+
+    for _ in range(2):
+        try:
+            return _render_in_pool(jobs)
+        except BrokenProcessPool:
+            continue
+    return {series: figures.render(*job) for series, job in jobs.items()}
 
 
 @app.callback(
@@ -139,6 +304,7 @@ def update_data_statistics(slider_values, graph_types, *args, **kwargs):
     [dash.dependencies.Input('graph-types', 'value'),
      dash.dependencies.Input('date-slider', 'value')],
 )
+@metrics.dash_callback
 def update_graph(graph_types, slider_values, *args, **kwargs):
     patient_id = kwargs['request'].session['patient_id']
 
@@ -151,45 +317,15 @@ def update_graph(graph_types, slider_values, *args, **kwargs):
     min_date = unix_to_datetime(slider_values[0])
     max_date = unix_to_datetime(slider_values[1])
 
-    if 'Glucose' in graph_types:
-        data = Glucose.objects.filter(patient_id=patient_id, measurement_date__gte=min_date, measurement_date__lte=max_date).values('measurement', 'measurement_type', 'measurement_date')
-        df = pd.DataFrame(data)
-        try:
-            figure = px.line(df, x='measurement_date', y='measurement', color='measurement_type')
-        except ValueError:
-            figure = px.line()
-        result.append(dcc.Graph(id='glucose-graph', figure=figure))
-
-    if 'Sys' in graph_types:
-        data = Blood.objects.filter(patient_id=patient_id, measurement_date__gte=min_date, measurement_date__lte=max_date).values('systolic_pressure', 'measurement_date')
-        df = pd.DataFrame(data)
-        try:
-            figure = px.line(df, x='measurement_date', y='systolic_pressure')
-        except ValueError:
-            figure = px.line()
-
-        result.append(dcc.Graph(id='systolic-graph', figure=figure))
+    selected = [series for series in GRAPH_IDS if series in graph_types]
+    resolution = 'raw' if timeseries.is_enabled() else rollup_resolution(min_date, max_date) or 'raw'
+    rendered = cache.cached_many(patient_id, f'figure:{resolution}', selected, min_date, max_date,
+                                 lambda missing: render_figures(patient_id, missing, min_date, max_date))
 
-    if 'Dia' in graph_types:
-        data = Blood.objects.filter(patient_id=patient_id, measurement_date__gte=min_date, measurement_date__lte=max_date).values('diastolic_pressure', 'measurement_date')
-        df = pd.DataFrame(data)
-
-        try:
-            figure = px.line(df, x='measurement_date', y='diastolic_pressure')
-        except ValueError:
-            figure = px.line()
-
-        result.append(dcc.Graph(id='diastolic-graph', figure=figure))
-
-    if 'Pulse' in graph_types:
-        data = Blood.objects.filter(patient_id=patient_id, measurement_date__gte=min_date, measurement_date__lte=max_date).values('pulse_rate', 'measurement_date')
-        df = pd.DataFrame(data)
-
-        try:
-            figure = px.line(df, x='measurement_date', y='pulse_rate')
-        except ValueError:
-            figure = px.line()
-        result.append(dcc.Graph(id='pulse-graph', figure=figure))
+    # Dash encodes the whole callback output itself, so the figure JSON is decoded into plain
+    # dicts and lists and encoded once more here, which is far cheaper than a plotly Figure
+    for series in selected:
+        result.append(dcc.Graph(id=GRAPH_IDS[series], figure=json.loads(rendered[series])))
 
     return html.Fieldset(children=[
         html.Legend('Graphs'),
@@ -201,6 +337,7 @@ def update_graph(graph_types, slider_values, *args, **kwargs):
     dash.dependencies.Output('end-date', 'disabled'),
     dash.dependencies.Input('start-date', 'value'),
 )
+@metrics.dash_callback
 def update_end_date(start_date, *args, **kwargs):
     if start_date is None:
         return no_update, no_update
@@ -212,6 +349,7 @@ def update_end_date(start_date, *args, **kwargs):
     dash.dependencies.Input('start-date', 'value'),
     dash.dependencies.Input('end-date', 'value'),
 )
+@metrics.dash_callback
 def update_slider(start_date, end_date, *args, **kwargs):
     if start_date is None:
         return no_update
@@ -219,15 +357,14 @@ def update_slider(start_date, end_date, *args, **kwargs):
     if end_date is None:
         end_date = timezone.now().year
 
-    daterange = pd.date_range(start= f'1-1-{start_date}', end= f'31-12-{end_date}', freq='1D')
+    minimum, maximum, marks = slider_range(start_date, end_date)
 
     return dcc.RangeSlider(
                 id='date-slider',
-                min = unix_time_millis(daterange.min()),
-                max = unix_time_millis(daterange.max()),
-                value = [unix_time_millis(daterange.min()),
-                         unix_time_millis(daterange.max())],
-                marks=get_marks(daterange, len(daterange) // 5),
+                min = minimum,
+                max = maximum,
+                value = [minimum, maximum],
+                marks=marks,
                 allowCross=False,
             )
 
@@ -236,6 +373,7 @@ def update_slider(start_date, end_date, *args, **kwargs):
     dash.dependencies.Output('slider-output', 'children'),
     dash.dependencies.Input('date-slider', 'value'),
 )
+@metrics.dash_callback
 def update_slider_output(value, *args, **kwargs):
     if value is None:
         return no_update
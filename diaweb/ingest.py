@@ -0,0 +1,140 @@
+import csv
+import math
+from datetime import datetime, time
+from itertools import islice
+from zoneinfo import ZoneInfo
+
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from diaweb.models import Glucose, Blood
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Sent with ``instances`` after every batch written by ``bulk_insert``, since
+# ``bulk_create`` does not send ``post_save``.
+measurements_created = Signal()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def bulk_insert(model, instances, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write ``instances`` with one ``bulk_create`` per chunk of ``batch_size`` rows,
+    each chunk in its own transaction. Returns the number of inserted rows.
+    """
+    created = 0
+    for chunk in chunked(instances, batch_size):
+        with transaction.atomic():
+            model.objects.bulk_create(chunk, batch_size=batch_size)
+            measurements_created.send(sender=model, instances=chunk)
+        created += len(chunk)
+
+    return created
+
+
+# Columns of the wide per-meal glucose log mapped to Glucose.MEASUREMENT_TYPES and the
+# nominal time of day used for the reading, as the log only records the day.
+GLUCOSE_LOG_COLUMNS = {
+    'Before breakfast': (1, time(7, 0)),
+    '2h after breakfast': (2, time(9, 0)),
+    'Before lunch': (3, time(12, 0)),
+    '2h after lunch': (4, time(14, 0)),
+    'Before dinner': (5, time(18, 0)),
+    '2h after dinner': (6, time(20, 0)),
+    'Extra': (0, time(22, 0)),
+}
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+GLUCOSE_LOG = 'glucose'
+BLOOD_LOG = 'bp'
+
+
+def detect_format(header):
+    if {'SYS', 'DIA', 'Pulse'}.issubset(header):
+        return BLOOD_LOG
+    if 'Date' in header and set(GLUCOSE_LOG_COLUMNS).intersection(header):
+        return GLUCOSE_LOG
+    raise ValueError(f'Unrecognized measurement log header: {", ".join(header)}')
+
+
+def parse_glucose_log_date(value, year):
+    """
+    Parses dates like ``Wed. 9/Feb.`` used by the per-meal glucose log.
+    """
+    day, month = value.split(' ')[-1].split('/')
+    return datetime(year, MONTHS[month.strip('.').lower()[:3]], int(day))
+
+
+def read_glucose_log(rows, patient_id, year, stats=None):
+    """
+    Yields a Glucose instance for every filled measurement cell of the wide glucose log.
+    """
+    stats = stats if stats is not None else {}
+    for row in rows:
+        try:
+            day = parse_glucose_log_date(row['Date'], year)
+        except (KeyError, ValueError, AttributeError):
+            stats['skipped'] = stats.get('skipped', 0) + 1
+            continue
+
+        for column, (measurement_type, at) in GLUCOSE_LOG_COLUMNS.items():
+            value = row.get(column)
+            if not value:
+                continue
+            try:
+                measurement = float(value)
+            except ValueError:
+                measurement = None
+            # Rejected by the Glucose_positive_number constraint, which would abort the whole batch
+            if measurement is None or not math.isfinite(measurement) or measurement < 0:
+                stats['skipped'] = stats.get('skipped', 0) + 1
+                continue
+            yield Glucose(patient_id=patient_id, measurement=measurement, measurement_type=measurement_type,
+                          measurement_date=timezone.make_aware(datetime.combine(day, at)))
+
+
+def read_blood_log(rows, patient_id, stats=None):
+    """
+    Yields a Blood instance for every row of an Omron style
+    ``Measurement Date,Time Zone,SYS,DIA,Pulse`` log.
+    """
+    stats = stats if stats is not None else {}
+    for row in rows:
+        try:
+            measured = datetime.strptime(row['Measurement Date'].strip(), '%Y-%m-%d %H:%M')
+            zone = row.get('Time Zone')
+            measured = measured.replace(tzinfo=ZoneInfo(zone)) if zone else timezone.make_aware(measured)
+            blood = Blood(patient_id=patient_id, systolic_pressure=int(row['SYS']),
+                          diastolic_pressure=int(row['DIA']), pulse_rate=int(row['Pulse']),
+                          measurement_date=measured)
+        except (KeyError, ValueError, TypeError):
+            stats['skipped'] = stats.get('skipped', 0) + 1
+            continue
+        if min(blood.systolic_pressure, blood.diastolic_pressure, blood.pulse_rate) < 0:
+            stats['skipped'] = stats.get('skipped', 0) + 1
+            continue
+        yield blood
+
+
+def import_measurement_log(file, patient_id, log_format=None, year=None, batch_size=DEFAULT_BATCH_SIZE, stats=None):
+    """
+    Streams a measurement CSV log from ``file`` into the database in batches and returns
+    the number of imported readings. Only one batch is kept in memory at a time.
+    """
+    reader = csv.DictReader(file)
+    log_format = log_format or detect_format(reader.fieldnames or [])
+
+    if log_format == GLUCOSE_LOG:
+        return bulk_insert(Glucose, read_glucose_log(reader, patient_id, year or timezone.now().year, stats),
+                           batch_size)
+    return bulk_insert(Blood, read_blood_log(reader, patient_id, stats), batch_size)
@@ -0,0 +1,209 @@
+"""
+Database backed job queue.
+
+Tasks are plain functions registered with ``@task``. ``enqueue`` stores a ``Job``
+row and returns at once; ``manage.py run_worker`` processes claim queued jobs
+with a conditional UPDATE, so a job runs in exactly one worker without a lock
+table or an outside broker. Failed jobs are retried with exponential backoff
+until ``max_attempts`` and running tasks report progress with ``set_progress``.
+
+Job arguments are checked against the task signature when the job is queued.
+Arguments naming files are confined to ``settings.JOB_FILES_ROOT``, tasks list
+them in ``paths`` and open them through ``resolve_path``.
+"""
+import inspect
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+
+from diaweb.models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+RETRY_DELAY = timedelta(seconds=30)
+
+# Running jobs without a heartbeat for this long belong to a dead worker
+STALE_AFTER = timedelta(minutes=10)
+HEARTBEAT_INTERVAL = 60
+
+_current_job = ContextVar('diaweb_job', default=None)
+
+
+def task(func=None, *, name=None, max_attempts=3, paths=()):
+    """
+    Registers ``func`` as a task, under its function name unless ``name`` is given.
+    ``paths`` names the arguments holding file paths.
+    """
+    def register(func):
+        func.task_name = name or func.__name__
+        func.max_attempts = max_attempts
+        func.paths = tuple(paths)
+        TASKS[func.task_name] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def resolve_path(path):
+    """
+    Absolute path of ``path`` relative to ``settings.JOB_FILES_ROOT``. Raises
+    ``ValueError`` when it leads outside of the root, through symlinks as well.
+    """
+    root = os.path.realpath(settings.JOB_FILES_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f'{path} is outside of the job files directory')
+    return resolved
+
+
+def check_arguments(func, kwargs):
+    """
+    Raises ``TypeError`` when ``kwargs`` do not fit the signature of the task
+    ``func`` and ``ValueError`` when a path argument leads outside of the root.
+    """
+    inspect.signature(func).bind(**kwargs)
+    for name in func.paths:
+        if kwargs.get(name) is not None:
+            resolve_path(kwargs[name])
+
+
+def enqueue(task_name, priority=0, run_after=None, max_attempts=None, **kwargs):
+    if task_name not in TASKS:
+        raise KeyError(f'Unknown task {task_name}')
+    check_arguments(TASKS[task_name], kwargs)
+    return Job.objects.create(task=task_name, kwargs=kwargs, priority=priority,
+                              run_after=run_after or timezone.now(),
+                              max_attempts=max_attempts or TASKS[task_name].max_attempts)
+
+
+def set_progress(fraction, message=''):
+    """
+    Stores the progress of the running job, a no-op outside of jobs.
+    """
+    job = _current_job.get()
+    if job is None:
+        return
+    job.progress = min(max(fraction, 0.0), 1.0)
+    Job.objects.filter(pk=job.pk).update(progress=job.progress, message=message[:200], heartbeat_at=timezone.now())
+
+
+def claim(worker):
+    """
+    Marks the most urgent due job as running for ``worker`` and returns it, or
+    None when the queue is empty. A lost race for a job moves on to the next one.
+    """
+    while True:
+        now = timezone.now()
+        candidate = (Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+                     .order_by('-priority', 'run_after', 'pk').values_list('pk', flat=True).first())
+        if candidate is None:
+            return None
+        claimed = Job.objects.filter(pk=candidate, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            return Job.objects.get(pk=candidate)
+
+
+def _owned(job):
+    # A job requeued as stale meanwhile may run on another worker, its state is left alone
+    return Job.objects.filter(pk=job.pk, worker=job.worker, status=Job.RUNNING)
+
+
+def execute(job):
+    """
+    Runs a claimed job and records its result, or schedules a retry on failure.
+    """
+    func = TASKS.get(job.task)
+    token = _current_job.set(job)
+    try:
+        if func is None:
+            raise KeyError(f'Unknown task {job.task}')
+        result = func(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s failed on attempt %s', job, job.attempts)
+        if func is not None and job.attempts < job.max_attempts:
+            _owned(job).update(status=Job.QUEUED, error=error,
+                               run_after=timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1))
+        else:
+            _owned(job).update(status=Job.FAILED, error=error, finished_at=timezone.now())
+    else:
+        _owned(job).update(status=Job.SUCCEEDED, result=result, progress=1, error='', finished_at=timezone.now())
+    finally:
+        _current_job.reset(token)
+
+
+class Heartbeat(threading.Thread):
+    """
+    Refreshes ``heartbeat_at`` of a running job until stopped, so long tasks that
+    never report progress are not mistaken for abandoned ones.
+    """
+
+    def __init__(self, job, interval=HEARTBEAT_INTERVAL):
+        super().__init__(daemon=True)
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                _owned(self.job).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def requeue_stale(stale_after=STALE_AFTER):
+    """
+    Returns jobs of workers that stopped sending heartbeats to the queue, or fails
+    them when they used up their attempts. Returns the number of requeued jobs.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=now - stale_after)
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, error='The worker stopped sending heartbeats', finished_at=now)
+    return stale.filter(attempts__lt=F('max_attempts')).update(status=Job.QUEUED)
+
+
+def worker_name(index=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def work(worker, poll_interval=1.0, once=False):
+    """
+    Claims and runs jobs until stopped, or until the queue is empty with ``once``.
+    Returns the number of executed jobs.
+    """
+    executed = 0
+    while True:
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if once:
+                return executed
+            requeue_stale()
+            time.sleep(poll_interval)
+            continue
+        heartbeat = Heartbeat(job)
+        heartbeat.start()
+        try:
+            execute(job)
+        finally:
+            heartbeat.stop()
+        executed += 1
+
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from diaweb import classifier
+from diaweb.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Scores the diabetes risk of patients from their recent readings and stores it as classifier_result.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only rescore patients with readings added, changed or deleted since their last '
+                                 'classification, whatever the reading dates')
+        parser.add_argument('--patient', type=int, action='append', dest='patients', default=None,
+                            help='Only score this patient, may be repeated')
+        parser.add_argument('--days', type=int, default=classifier.WINDOW.days, help='Days of readings to use')
+        parser.add_argument('--chunk-size', type=int, default=classifier.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        queryset = Patient.objects.all()
+        if options['patients']:
+            queryset = queryset.filter(pk__in=options['patients'])
+
+        totals = classifier.classify(queryset, incremental=options['incremental'],
+                                     chunk_size=options['chunk_size'], window=timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(
+            'Classified {} patients: '.format(sum(totals.values()))
+            + ', '.join(f'{count} {Patient.PREDICTIONS[prediction]}' for prediction, count in totals.items())))
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from diaweb.extra_context import compile_extra_context
+
+
+class Command(BaseCommand):
+    help = ('Precompiles the landing page messages into one JSON file, which is read instead of the message '
+            'directory until it is removed or compiled again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=settings.INDEX_PAGE_MSG_DIR,
+                            help='Directory of the message .txt files')
+        parser.add_argument('--output', default=settings.INDEX_PAGE_MSG_COMPILED,
+                            help='Compiled JSON file')
+
+    def handle(self, *args, **options):
+        count = compile_extra_context(options['source'], options['output'])
+        self.stdout.write(self.style.SUCCESS(f'Compiled {count} messages into {options["output"]}'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from diaweb import columnar
+from diaweb.models import Glucose, Blood
+
+MODELS = {
+    'glucose': Glucose,
+    'blood': Blood,
+}
+
+
+class Command(BaseCommand):
+    help = 'Exports measurement history as columnar files partitioned by patient and month.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Root directory of the export')
+        parser.add_argument('--series', choices=list(MODELS), action='append', dest='series', default=None,
+                            help='Only export this series, may be repeated')
+        parser.add_argument('--patient', type=int, action='append', dest='patients', default=None,
+                            help='Only export this patient, may be repeated')
+
+    def handle(self, *args, **options):
+        for name in options['series'] or MODELS:
+            model = MODELS[name]
+            queryset = model.objects.all()
+            if options['patients']:
+                queryset = queryset.filter(patient_id__in=options['patients'])
+
+            written = columnar.export_history(options['directory'], model, queryset)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {written} {name} partitions'))
@@ -0,0 +1,42 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from diaweb import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with synthetic patients, physicians, appointments and measurement histories.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=100)
+        parser.add_argument('--physicians', type=int, default=None, help='Defaults to one per 20 patients')
+        parser.add_argument('--days', type=int, default=365, help='Days of readings per patient')
+        parser.add_argument('--glucose-per-day', type=int, default=288,
+                            help='Glucose readings per day, 288 matches a 5 minute CGM')
+        parser.add_argument('--blood-per-day', type=int, default=2)
+        parser.add_argument('--end', default=None, help='Last day of readings as YYYY-MM-DD, defaults to now')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synthetic', help='Prefix of the generated user names')
+        parser.add_argument('--batch-size', type=int, default=synthetic.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        end = None
+        if options['end']:
+            try:
+                end = datetime.strptime(options['end'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+            except ValueError as exc:
+                raise CommandError(exc)
+
+        started = time.perf_counter()
+        created = synthetic.generate(options['patients'], physicians=options['physicians'], days=options['days'],
+                                     glucose_per_day=options['glucose_per_day'],
+                                     blood_per_day=options['blood_per_day'], end=end, seed=options['seed'],
+                                     prefix=options['prefix'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+
+        readings = created['glucose'] + created['blood']
+        self.stdout.write(', '.join(f'{count} {name}' for name, count in created.items()))
+        self.stdout.write(self.style.SUCCESS(f'Generated {readings} readings in {elapsed:.1f}s '
+                                             f'({readings / max(elapsed, 1e-9):.0f} readings/s)'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from diaweb.ingest import import_measurement_log, GLUCOSE_LOG, BLOOD_LOG, DEFAULT_BATCH_SIZE
+from diaweb.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Streams a glucose or blood pressure CSV log into the database in batched transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import')
+        parser.add_argument('--patient', type=int, required=True, help='ID of the patient owning the readings')
+        parser.add_argument('--format', choices=[GLUCOSE_LOG, BLOOD_LOG], default=None,
+                            help='Log layout, detected from the header when omitted')
+        parser.add_argument('--year', type=int, default=None,
+                            help='Year of the readings in glucose logs, which only store day and month')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not Patient.objects.filter(pk=options['patient']).exists():
+            raise CommandError(f'Patient {options["patient"]} does not exist')
+
+        stats = {}
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as file:
+                imported = import_measurement_log(file, options['patient'], log_format=options['format'],
+                                                  year=options['year'], batch_size=options['batch_size'],
+                                                  stats=stats)
+        except (OSError, ValueError, IntegrityError) as exc:
+            raise CommandError(exc)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} readings, skipped {stats.get("skipped", 0)} invalid entries'))
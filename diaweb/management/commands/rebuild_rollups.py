@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from diaweb import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the hourly and daily measurement rollups from the raw Glucose and Blood rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, action='append', dest='patients', default=None,
+                            help='Only rebuild the rollups of this patient, may be repeated')
+
+    def handle(self, *args, **options):
+        created = rollups.rebuild(options['patients'])
+        self.stdout.write(self.style.SUCCESS(f'Created {created} rollup rows'))
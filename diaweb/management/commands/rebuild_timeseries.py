@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from diaweb import timeseries
+
+
+class Command(BaseCommand):
+    help = 'Rewrites the memory-mapped time series store from the Glucose and Blood tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, action='append', dest='patients', default=None,
+                            help='Only rebuild the series of this patient, may be repeated')
+
+    def handle(self, *args, **options):
+        written = timeseries.rebuild(options['patients'])
+        self.stdout.write(self.style.SUCCESS(f'Stored {written} readings in {timeseries.get_store().root}'))
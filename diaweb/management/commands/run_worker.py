@@ -0,0 +1,36 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from diaweb import jobs, workers
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between polls of an empty queue')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['processes'] == 1:
+            executed = jobs.work(jobs.worker_name(), options['poll'], options['once'])
+            self.stdout.write(self.style.SUCCESS(f'Executed {executed} jobs'))
+            return
+
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=workers.run_process, args=(index, options['poll'], options['once']))
+                     for index in range(options['processes'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
+        self.stdout.write(self.style.SUCCESS(f'Stopped {len(processes)} worker processes'))
@@ -0,0 +1,290 @@
+"""
+Lightweight request profiling exposed as Prometheus text.
+
+``MetricsMiddleware`` starts a ``Profile`` for every request, which collects the
+ORM query count and SQL time (through a database execute wrapper), serializer
+time, template/renderer time and the Dash callback served. When the request ends
+the profile is added to histograms labelled with the URL name, and with the name
+of the Dash callback for Dash update requests; Dash callbacks decorated with
+``dash_callback`` get histograms labelled with their name.
+
+Outside of requests the same numbers are available from ``profile()``::
+
+    with metrics.profile() as result:
+        ...
+    result.queries, result.sql_seconds
+
+Histograms are kept per process, every worker of a multi-process server exposes
+its own at ``/metrics``. Scrapes need the ``METRICS_TOKEN`` bearer token, a staff
+user, or without a token a ``REMOTE_ADDR`` in ``METRICS_ALLOWED_IPS``.
+"""
+import bisect
+import functools
+import hmac
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        """
+        Adds ``value`` to the series of the tuple of ``label_values``, in the order of
+        ``labels``. Labels valued None are left out of the series.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        with self._lock:
+            snapshot = {label_values: (list(counts), total) for label_values, (counts, total) in self._series.items()}
+
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total) in sorted(snapshot.items(), key=lambda item: str(item[0])):
+            label = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values)
+                             if value is not None)
+            cumulative = 0
+            for bound, count in zip(self.buckets + [math.inf], counts):
+                cumulative += count
+                bound = '+Inf' if bound == math.inf else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total:g}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_LABELS = ('view', 'callback')
+REQUEST_SECONDS = Histogram('diaweb_request_seconds', 'Request wall time.', REQUEST_LABELS, SECONDS_BUCKETS)
+REQUEST_QUERIES = Histogram('diaweb_request_queries', 'ORM queries per request.', REQUEST_LABELS, QUERY_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram('diaweb_request_sql_seconds', 'SQL time per request.', REQUEST_LABELS,
+                                SECONDS_BUCKETS)
+REQUEST_SERIALIZER_SECONDS = Histogram('diaweb_request_serializer_seconds',
+                                       'Serializer time per request, including lazy queries.', REQUEST_LABELS,
+                                       SECONDS_BUCKETS)
+REQUEST_RENDER_SECONDS = Histogram('diaweb_request_render_seconds', 'Template and renderer time per request.',
+                                   REQUEST_LABELS, SECONDS_BUCKETS)
+CALLBACK_SECONDS = Histogram('diaweb_dash_callback_seconds', 'Dash callback wall time.', ('callback',),
+                             SECONDS_BUCKETS)
+CALLBACK_QUERIES = Histogram('diaweb_dash_callback_queries', 'ORM queries per Dash callback.', ('callback',),
+                             QUERY_BUCKETS)
+
+HISTOGRAMS = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_SQL_SECONDS, REQUEST_SERIALIZER_SECONDS,
+              REQUEST_RENDER_SECONDS, CALLBACK_SECONDS, CALLBACK_QUERIES]
+
+
+class Profile:
+    __slots__ = ['queries', 'sql_seconds', 'serializer_seconds', 'render_seconds', 'callback', 'active']
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.render_seconds = 0.0
+        self.callback = None
+        self.active = set()
+
+
+_profile = ContextVar('diaweb_profile', default=None)
+
+
+def current():
+    return _profile.get()
+
+
+@contextmanager
+def profile():
+    """
+    Collects a ``Profile`` of everything run inside the block.
+    """
+    result = Profile()
+    token = _profile.set(result)
+    try:
+        yield result
+    finally:
+        _profile.reset(token)
+
+
+@contextmanager
+def timer(kind):
+    """
+    Adds the time spent in the block to the ``<kind>_seconds`` of the current
+    profile. Nested timers of the same kind only count the outermost one.
+    """
+    result = _profile.get()
+    if result is None or kind in result.active:
+        yield
+        return
+
+    result.active.add(kind)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        result.active.discard(kind)
+        setattr(result, f'{kind}_seconds', getattr(result, f'{kind}_seconds') + time.perf_counter() - start)
+
+
+def _count_queries(execute, sql, params, many, context):
+    result = _profile.get()
+    if result is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        result.queries += 1
+        result.sql_seconds += time.perf_counter() - start
+
+
+def instrument(connection, **kwargs):
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+connection_created.connect(instrument)
+
+
+def dash_callback(func):
+    """
+    Records the time and queries of a Dash callback under its function name.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        result = _profile.get()
+        token = None
+        if result is None:
+            result = Profile()
+            token = _profile.set(result)
+
+        result.callback = func.__name__
+        queries = result.queries
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            CALLBACK_SECONDS.observe((func.__name__,), time.perf_counter() - start)
+            CALLBACK_QUERIES.observe((func.__name__,), result.queries - queries)
+            if token is not None:
+                _profile.reset(token)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    Profiles every request and records it in the request histograms.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        self.instrument_connections()
+        start = time.perf_counter()
+        with profile() as result:
+            response = self.get_response(request)
+        self.record(request, result, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        self.instrument_connections()
+        start = time.perf_counter()
+        with profile() as result:
+            response = await self.get_response(request)
+        self.record(request, result, time.perf_counter() - start)
+        return response
+
+    def process_template_response(self, request, response):
+        result = _profile.get()
+        if result is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                result.render_seconds += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def instrument_connections():
+        # Connections opened before the signal receiver was connected
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+
+    @staticmethod
+    def record(request, result, seconds):
+        match = request.resolver_match
+        # Dash serves all callbacks from one URL, the callback tells its requests apart
+        labels = (match.view_name if match is not None else 'unresolved', result.callback)
+        REQUEST_SECONDS.observe(labels, seconds)
+        REQUEST_QUERIES.observe(labels, result.queries)
+        REQUEST_SQL_SECONDS.observe(labels, result.sql_seconds)
+        REQUEST_SERIALIZER_SECONDS.observe(labels, result.serializer_seconds)
+        REQUEST_RENDER_SECONDS.observe(labels, result.render_seconds)
+
+
+def expose():
+    return '\n'.join(line for histogram in HISTOGRAMS for line in histogram.expose()) + '\n'
+
+
+def scrape_allowed(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    if settings.METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                   f'Bearer {settings.METRICS_TOKEN}'.encode())
+    # Only meaningful without a reverse proxy in front, which makes every client local
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    if not scrape_allowed(request):
+        raise PermissionDenied
+    return HttpResponse(expose(), content_type=CONTENT_TYPE)
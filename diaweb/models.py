@@ -1,5 +1,5 @@
 import json
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
 from django.db import models, IntegrityError
 from django.contrib.auth.models import User
@@ -49,8 +49,12 @@ class Patient(models.Model):
     sex = models.CharField(max_length=1, choices=(('M', 'Male'), ('F', 'Female')))
     confirmed_diabetes = models.BooleanField(default=False)
     classifier_result = models.IntegerField(choices=PREDICTIONS, default=0)
+    classified_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Last commit adding, changing or deleting readings, whatever their measurement_date
+    measurements_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
     last_appointment = models.DateField(null=True, blank=True)
     address = models.OneToOneField(Address, on_delete=models.CASCADE, null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'{self.user.first_name} {self.user.last_name}'
@@ -97,6 +101,7 @@ class Physician(models.Model):
     phone = models.CharField(max_length=20)
     patient = models.ManyToManyField(Patient)
     address = models.ForeignKey(Address, on_delete=models.CASCADE, null=True, blank=True, unique=False)
+    updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'{self.user.first_name} {self.user.last_name} - {self.specialty}'
@@ -142,6 +147,13 @@ class Glucose(models.Model):
         constraints = [
             models.CheckConstraint(check=models.Q(measurement__gte=0), name='Glucose_positive_number'),
         ]
+        indexes = [
+            # Covers the per-patient date range scans of the dashboard without touching the table.
+            models.Index(fields=['patient', 'measurement_date', 'measurement_type', 'measurement'],
+                         name='Glucose_patient_date_idx'),
+            models.Index(fields=['patient', 'measurement_type', 'measurement_date'],
+                         name='Glucose_patient_type_date_idx'),
+        ]
 
 
 class Blood(models.Model):
@@ -158,12 +170,25 @@ class Blood(models.Model):
                                    name='Diastolic_pressure_positive_number'),
             models.CheckConstraint(check=models.Q(pulse_rate__gte=0), name='Pulse_rate_positive_number'),
         ]
+        indexes = [
+            models.Index(fields=['patient', 'measurement_date', 'systolic_pressure', 'diastolic_pressure',
+                                 'pulse_rate'],
+                         name='Blood_patient_date_idx'),
+        ]
 
 
 class Appointment(models.Model):
+    DEFAULT_DURATION = timedelta(minutes=30)
+
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
     physician = models.ForeignKey(Physician, on_delete=models.SET_NULL, null=True)
     date = models.DateTimeField()
+    duration = models.DurationField(default=DEFAULT_DURATION)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['physician', 'date'], name='Appointment_unique_physician_date'),
+        ]
 
 
 class Reception(models.Model):
@@ -181,3 +206,72 @@ class Reception(models.Model):
     start_time = models.TimeField()
     end_time = models.TimeField()
     physician = models.ForeignKey(Physician, on_delete=models.SET_NULL, null=True, blank=True)
+
+
+class MeasurementRollup(models.Model):
+    SERIES = {
+        'GLU': 'Glucose',
+        'SYS': 'Systolic pressure',
+        'DIA': 'Diastolic pressure',
+        'PUL': 'Pulse rate',
+    }
+    RESOLUTIONS = {
+        'hour': 'Hourly',
+        'day': 'Daily',
+    }
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
+    series = models.CharField(max_length=3, choices=SERIES)
+    resolution = models.CharField(max_length=4, choices=RESOLUTIONS)
+    bucket = models.DateTimeField()
+    measurement_type = models.IntegerField(choices=Glucose.MEASUREMENT_TYPES, default=0)
+    count = models.IntegerField()
+    sum = models.FloatField()
+    sum_squares = models.FloatField()
+    min = models.FloatField()
+    max = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'series', 'resolution', 'bucket', 'measurement_type'],
+                                    name='MeasurementRollup_unique_bucket'),
+        ]
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = {
+        QUEUED: 'Queued',
+        RUNNING: 'Running',
+        SUCCEEDED: 'Succeeded',
+        FAILED: 'Failed',
+    }
+
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    priority = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    progress = models.FloatField(default=0)
+    message = models.CharField(max_length=200, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
+
+    class Meta:
+        indexes = [
+            # Serves the claim query of the worker, highest priority first
+            models.Index(fields=['status', '-priority', 'run_after'], name='Job_claim_idx'),
+        ]
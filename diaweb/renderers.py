@@ -1,4 +1,4 @@
-from rest_framework.renderers import TemplateHTMLRenderer
+from rest_framework.renderers import TemplateHTMLRenderer, JSONRenderer, BaseRenderer
 
 class WebUserTemplateHTMLRenderer(TemplateHTMLRenderer):
 
@@ -7,4 +7,53 @@ class WebUserTemplateHTMLRenderer(TemplateHTMLRenderer):
         if not data:
             return {}
         else:
-            return {'data': data}
\ No newline at end of file
+            return {'data': data}
+
+
+class JSONStreamRenderer(JSONRenderer):
+    """
+    Renders an iterable of items lazily as one JSON array, one item at a time.
+    """
+
+    def render_stream(self, items):
+        separator = b'['
+        for item in items:
+            yield separator + self.render(item)
+            separator = b','
+        yield b'[]' if separator == b'[' else b']'
+
+    async def arender_stream(self, items):
+        separator = b'['
+        async for item in items:
+            yield separator + self.render(item)
+            separator = b','
+        yield b'[]' if separator == b'[' else b']'
+
+
+class NDJSONStreamRenderer(JSONStreamRenderer):
+    """
+    Renders an iterable of items lazily as newline delimited JSON.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render_stream(self, items):
+        for item in items:
+            yield self.render(item) + b'\n'
+
+    async def arender_stream(self, items):
+        async for item in items:
+            yield self.render(item) + b'\n'
+
+
+class ColumnarRenderer(BaseRenderer):
+    """
+    Passes through files already encoded in the ``diaweb.columnar`` format.
+    """
+    media_type = 'application/octet-stream'
+    format = 'dcol'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import chain
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Sum, Min, Max, F
+from django.db.models.functions import TruncHour, TruncDay
+
+from diaweb.models import Glucose, Blood, MeasurementRollup
+
+HOUR = 'hour'
+DAY = 'day'
+
+RESOLUTION_STEPS = {
+    HOUR: timedelta(hours=1),
+    DAY: timedelta(days=1),
+}
+
+RESOLUTION_TRUNC = {
+    HOUR: TruncHour,
+    DAY: TruncDay,
+}
+
+# Model -> rolled up series as (series, column)
+MODEL_SERIES = {
+    Glucose: [('GLU', 'measurement')],
+    Blood: [('SYS', 'systolic_pressure'), ('DIA', 'diastolic_pressure'), ('PUL', 'pulse_rate')],
+}
+
+SERIES_FIELDS = {series: (model, field) for model, fields in MODEL_SERIES.items() for series, field in fields}
+
+BATCH_SIZE = 1000
+
+
+def floor_bucket(moment, resolution):
+    moment = moment.astimezone(dt_timezone.utc)
+    if resolution == DAY:
+        return datetime(moment.year, moment.month, moment.day, tzinfo=dt_timezone.utc)
+    return datetime(moment.year, moment.month, moment.day, moment.hour, tzinfo=dt_timezone.utc)
+
+
+def ceil_bucket(moment, resolution):
+    floor = floor_bucket(moment, resolution)
+    return floor if floor == moment else floor + RESOLUTION_STEPS[resolution]
+
+
+def aggregate(model, queryset, resolution):
+    """
+    Yields unsaved MeasurementRollup rows for ``queryset`` grouped into ``resolution``
+    buckets, computed with one aggregate query for all series of ``model``.
+    """
+    group = ['patient_id', 'bucket'] + (['measurement_type'] if model is Glucose else [])
+    annotations = {}
+    for series, field in MODEL_SERIES[model]:
+        annotations[f'{series}_count'] = Count(field)
+        annotations[f'{series}_sum'] = Sum(field)
+        annotations[f'{series}_sum_squares'] = Sum(F(field) * F(field))
+        annotations[f'{series}_min'] = Min(field)
+        annotations[f'{series}_max'] = Max(field)
+
+    rows = (queryset.annotate(bucket=RESOLUTION_TRUNC[resolution]('measurement_date', tzinfo=dt_timezone.utc))
+            .values(*group).annotate(**annotations).order_by())
+
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        for series, _ in MODEL_SERIES[model]:
+            yield MeasurementRollup(patient_id=row['patient_id'], series=series, resolution=resolution,
+                                    bucket=row['bucket'], measurement_type=row.get('measurement_type', 0),
+                                    count=row[f'{series}_count'], sum=row[f'{series}_sum'],
+                                    sum_squares=row[f'{series}_sum_squares'],
+                                    min=row[f'{series}_min'], max=row[f'{series}_max'])
+
+
+def refresh(model, patient_id, start, end):
+    """
+    Recomputes the hourly and daily rollups of ``model`` for every day touched by
+    the ``start`` - ``end`` range of one patient.
+    """
+    day_start = floor_bucket(start, DAY)
+    day_end = floor_bucket(end, DAY) + RESOLUTION_STEPS[DAY]
+    series = [name for name, _ in MODEL_SERIES[model]]
+
+    with transaction.atomic():
+        MeasurementRollup.objects.filter(patient_id=patient_id, series__in=series,
+                                         bucket__gte=day_start, bucket__lt=day_end).delete()
+        queryset = model.objects.filter(patient_id=patient_id, measurement_date__gte=day_start,
+                                        measurement_date__lt=day_end)
+        MeasurementRollup.objects.bulk_create(chain(aggregate(model, queryset, HOUR), aggregate(model, queryset, DAY)),
+                                              batch_size=BATCH_SIZE)
+
+
+def refresh_instances(model, instances):
+    """
+    Refreshes the rollups covering a batch of new or changed measurements.
+    """
+    ranges = {}
+    for instance in instances:
+        start, end = ranges.get(instance.patient_id, (instance.measurement_date, instance.measurement_date))
+        ranges[instance.patient_id] = (min(start, instance.measurement_date), max(end, instance.measurement_date))
+
+    for patient_id, (start, end) in ranges.items():
+        refresh(model, patient_id, start, end)
+
+
+def rebuild(patient_ids=None):
+    """
+    Drops and recomputes all rollups, or only those of ``patient_ids``.
+    Returns the number of created rollup rows.
+    """
+    created = 0
+    with transaction.atomic():
+        rollups = MeasurementRollup.objects.all()
+        if patient_ids is not None:
+            rollups = rollups.filter(patient_id__in=patient_ids)
+        rollups.delete()
+
+        for model in MODEL_SERIES:
+            queryset = model.objects.all()
+            if patient_ids is not None:
+                queryset = queryset.filter(patient_id__in=patient_ids)
+            for resolution in RESOLUTION_STEPS:
+                created += len(MeasurementRollup.objects.bulk_create(aggregate(model, queryset, resolution),
+                                                                     batch_size=BATCH_SIZE))
+
+    return created
+
+
+def load(patient_id, series, start, end, resolution):
+    """
+    Returns the buckets of ``series`` fully inside ``start`` - ``end`` and the raw
+    measurements of the partial buckets at both edges, as arrays in rollup form
+    (``count``, ``sum``, ``sum_squares``, ``min``, ``max``). Every raw measurement
+    becomes a bucket of its own.
+    """
+    inner_start = ceil_bucket(start, resolution)
+    inner_end = floor_bucket(end, resolution)
+
+    rows = list(MeasurementRollup.objects.filter(patient_id=patient_id, series=series, resolution=resolution,
+                                                 bucket__gte=inner_start, bucket__lt=inner_end)
+                .values_list('bucket', 'measurement_type', 'count', 'sum', 'sum_squares', 'min', 'max'))
+
+    model, field = SERIES_FIELDS[series]
+    fields = ['measurement_date', field] + (['measurement_type'] if model is Glucose else [])
+    edges = model.objects.filter(patient_id=patient_id, measurement_date__gte=start, measurement_date__lte=end) \
+        .exclude(measurement_date__gte=inner_start, measurement_date__lt=inner_end)
+    for date, value, *measurement_type in edges.values_list(*fields):
+        value = float(value)
+        rows.append((date, measurement_type[0] if measurement_type else 0, 1, value, value * value, value, value))
+
+    rows.sort(key=lambda row: row[0])
+    dates = np.array([row[0].astimezone(dt_timezone.utc).replace(tzinfo=None) for row in rows], dtype='datetime64[us]')
+    data = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, 6)
+
+    return {
+        'bucket': dates,
+        'measurement_type': data[:, 0].astype(np.int64),
+        'count': data[:, 1],
+        'sum': data[:, 2],
+        'sum_squares': data[:, 3],
+        'min': data[:, 4],
+        'max': data[:, 5],
+    }
+
+
+def describe(rollup):
+    """
+    Summary statistics of rolled up buckets. Count, mean, std, min and max are exact,
+    quartiles are estimated from the bucket means weighted by their counts.
+    """
+    counts = rollup['count']
+    count = counts.sum()
+    if count == 0:
+        return None
+
+    total = rollup['sum'].sum()
+    mean = total / count
+    variance = (rollup['sum_squares'].sum() - total * mean) / (count - 1) if count > 1 else None
+
+    # Every bucket is placed at the centre of the ranks it spans, which makes the
+    # estimate match numpy/pandas linear quartiles when buckets hold single readings.
+    means = rollup['sum'] / counts
+    order = np.argsort(means)
+    sorted_counts = counts[order]
+    ranks = np.cumsum(sorted_counts) - sorted_counts + (sorted_counts - 1) / 2
+    q25, q50, q75 = np.interp(np.array([0.25, 0.5, 0.75]) * (count - 1), ranks, means[order])
+
+    return {
+        'count': int(count),
+        'mean': float(mean),
+        'std': float(np.sqrt(max(variance, 0))) if variance is not None else None,
+        'min': float(rollup['min'].min()),
+        '25%': float(q25),
+        '50%': float(q50),
+        '75%': float(q75),
+        'max': float(rollup['max'].max()),
+    }
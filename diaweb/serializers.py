@@ -1,22 +1,92 @@
-from rest_framework import serializers
-from rest_framework.relations import PrimaryKeyRelatedField
-
-from .models import Address, Patient, Physician, Glucose, Blood, Appointment, Reception, User
+from datetime import timedelta
+from functools import lru_cache
 
-
-class AddressSerializer(serializers.ModelSerializer):
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField, ManyRelatedField, RelatedField
+
+from . import availability, jobs, metrics
+from .models import Address, Patient, Physician, Glucose, Blood, Appointment, Reception, User, Job
+
+
+def _collect_related_lookups(serializer, prefix, prefetching, select, prefetch):
+    model = serializer.Meta.model
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.is_relation:
+            continue
+
+        lookup = prefix + field.source
+        if isinstance(field, serializers.ListSerializer):
+            prefetch.append(lookup)
+            _collect_related_lookups(field.child, lookup + '__', True, select, prefetch)
+        elif isinstance(field, serializers.BaseSerializer):
+            (prefetch if prefetching else select).append(lookup)
+            _collect_related_lookups(field, lookup + '__', prefetching, select, prefetch)
+        elif isinstance(field, ManyRelatedField):
+            # Primary keys as well, the field calls .all() on the manager of every instance
+            prefetch.append(lookup)
+        elif isinstance(field, RelatedField) and not isinstance(field, PrimaryKeyRelatedField):
+            (prefetch if prefetching else select).append(lookup)
+
+
+@lru_cache(maxsize=None)
+def get_related_lookups(serializer_class):
+    """
+    Returns the ``select_related`` and ``prefetch_related`` lookups needed to render
+    ``serializer_class`` without a query per nested object. To-one relations are
+    joined, to-many relations and everything below them are prefetched.
+    """
+    select, prefetch = [], []
+    _collect_related_lookups(serializer_class(), '', False, select, prefetch)
+    return tuple(select), tuple(prefetch)
+
+
+class CachedPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """
+    Resolves primary keys from the ``related_cache`` serializer context entry before
+    falling back to a database lookup, so bulk validation does not query once per row.
+    """
+
+    def to_internal_value(self, data):
+        cache = self.context.get('related_cache', {}).get(self.field_name)
+        if cache is not None:
+            try:
+                return cache[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class ProfiledSerializerMixin:
+    """
+    Adds the time spent in ``to_representation`` to the request profile of
+    ``diaweb.metrics``.
+    """
+
+    def to_representation(self, instance):
+        with metrics.timer('serializer'):
+            return super().to_representation(instance)
+
+
+class AddressSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Address
         fields = '__all__'
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['username', 'email', 'password', 'first_name', 'last_name']
 
 
-class PatientSerializer(serializers.ModelSerializer):
+class PatientSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer()
     address = AddressSerializer()
 
@@ -58,7 +128,7 @@ class PatientSerializer(serializers.ModelSerializer):
         return instance
 
 
-class PhysicianSerializer(serializers.ModelSerializer):
+class PhysicianSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer()
     address = AddressSerializer(allow_null=True, required=False)
 
@@ -103,23 +173,23 @@ class PhysicianSerializer(serializers.ModelSerializer):
         return instance
 
 
-class GlucoseSerializer(serializers.ModelSerializer):
-    patient = PrimaryKeyRelatedField(queryset=Patient.objects.all())
+class GlucoseSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    patient = CachedPrimaryKeyRelatedField(queryset=Patient.objects.all())
 
     class Meta:
         model = Glucose
         fields = '__all__'
 
 
-class BloodSerializer(serializers.ModelSerializer):
-    patient = PrimaryKeyRelatedField(queryset=Patient.objects.all())
+class BloodSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    patient = CachedPrimaryKeyRelatedField(queryset=Patient.objects.all())
 
     class Meta:
         model = Blood
         fields = '__all__'
 
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     patient = PatientSerializer(read_only=True)
     physician = PhysicianSerializer(read_only=True, allow_null=True, required=False)
 
@@ -128,9 +198,47 @@ class AppointmentSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ReceptionSerializer(serializers.ModelSerializer):
+class BookingSerializer(serializers.Serializer):
+    physician = PrimaryKeyRelatedField(queryset=Physician.objects.all())
+    date = serializers.DateTimeField()
+    patient = PrimaryKeyRelatedField(queryset=Patient.objects.all(), required=False)
+    # Minutes, as the slot parameter of the physician availability
+    slot = serializers.IntegerField(min_value=availability.MIN_SLOT_LENGTH // timedelta(minutes=1),
+                                    max_value=availability.MAX_SLOT_LENGTH // timedelta(minutes=1), required=False)
+
+
+class ReceptionSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     physician = PrimaryKeyRelatedField(queryset=Physician.objects.all(), allow_null=True, required=False)
 
     class Meta:
         model = Reception
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+class JobSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = '__all__'
+        read_only_fields = ['status', 'attempts', 'progress', 'message', 'result', 'error', 'worker', 'created_at',
+                            'started_at', 'heartbeat_at', 'finished_at']
+
+    def validate_task(self, value):
+        if value not in jobs.TASKS:
+            raise serializers.ValidationError(f'Unknown task, expected one of {", ".join(sorted(jobs.TASKS))}')
+        return value
+
+    def validate(self, attrs):
+        # Arguments failing the task would only fail once the retries ran out
+        kwargs = attrs.get('kwargs', {})
+        if not isinstance(kwargs, dict):
+            raise serializers.ValidationError({'kwargs': 'An object of task arguments is required.'})
+        try:
+            jobs.check_arguments(jobs.TASKS[attrs['task']], kwargs)
+        except (TypeError, ValueError) as error:
+            raise serializers.ValidationError({'kwargs': str(error)})
+        return attrs
+
+    def create(self, validated_data):
+        return jobs.enqueue(validated_data['task'], priority=validated_data.get('priority', 0),
+                            run_after=validated_data.get('run_after'),
+                            max_attempts=validated_data.get('max_attempts'), **validated_data.get('kwargs', {}))
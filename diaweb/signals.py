@@ -0,0 +1,125 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from diaweb import cache, rollups, timeseries
+from diaweb.ingest import measurements_created
+from diaweb.models import Glucose, Blood, Address, Patient, Physician
+
+
+@receiver(pre_save, sender=Glucose)
+@receiver(pre_save, sender=Blood)
+def remember_previous_measurement(sender, instance, **kwargs):
+    # Updates may move a reading to another patient or bucket, which must be refreshed as well
+    instance._previous_measurement = None
+    if instance.pk is not None:
+        instance._previous_measurement = sender.objects.filter(pk=instance.pk) \
+            .values_list('patient_id', 'measurement_date').first()
+
+
+@receiver(post_save, sender=Glucose)
+@receiver(post_save, sender=Blood)
+def refresh_rollups_on_save(sender, instance, **kwargs):
+    rollups.refresh(sender, instance.patient_id, instance.measurement_date, instance.measurement_date)
+
+    previous = getattr(instance, '_previous_measurement', None)
+    if previous is not None and previous != (instance.patient_id, instance.measurement_date):
+        rollups.refresh(sender, previous[0], previous[1], previous[1])
+
+
+@receiver(post_delete, sender=Glucose)
+@receiver(post_delete, sender=Blood)
+def refresh_rollups_on_delete(sender, instance, **kwargs):
+    rollups.refresh(sender, instance.patient_id, instance.measurement_date, instance.measurement_date)
+
+
+@receiver(measurements_created, sender=Glucose)
+@receiver(measurements_created, sender=Blood)
+def refresh_rollups_on_bulk_create(sender, instances, **kwargs):
+    rollups.refresh_instances(sender, instances)
+
+
+@receiver(post_save, sender=Glucose)
+@receiver(post_save, sender=Blood)
+@receiver(post_delete, sender=Glucose)
+@receiver(post_delete, sender=Blood)
+def invalidate_measurement_cache(sender, instance, **kwargs):
+    patients = [instance.patient_id]
+    previous = getattr(instance, '_previous_measurement', None)
+    if previous is not None:
+        patients.append(previous[0])
+    cache.invalidate_on_commit(patients)
+
+
+@receiver(measurements_created, sender=Glucose)
+@receiver(measurements_created, sender=Blood)
+def invalidate_measurement_cache_on_bulk_create(sender, instances, **kwargs):
+    cache.invalidate_on_commit(instance.patient_id for instance in instances)
+
+
+def mark_measurements_changed(patient_ids):
+    # Stamped at commit time, a classification started before the commit cannot have seen the readings
+    patient_ids = set(patient_ids)
+    transaction.on_commit(lambda: Patient.objects.filter(pk__in=patient_ids)
+                          .update(measurements_changed_at=timezone.now()))
+
+
+@receiver(post_save, sender=Glucose)
+@receiver(post_save, sender=Blood)
+@receiver(post_delete, sender=Glucose)
+@receiver(post_delete, sender=Blood)
+def mark_patient_measurements_changed(sender, instance, **kwargs):
+    patients = [instance.patient_id]
+    previous = getattr(instance, '_previous_measurement', None)
+    if previous is not None:
+        patients.append(previous[0])
+    mark_measurements_changed(patients)
+
+
+@receiver(measurements_created, sender=Glucose)
+@receiver(measurements_created, sender=Blood)
+def mark_patient_measurements_changed_on_bulk_create(sender, instances, **kwargs):
+    mark_measurements_changed(instance.patient_id for instance in instances)
+
+
+@receiver(post_save, sender=Glucose)
+@receiver(post_save, sender=Blood)
+@receiver(post_delete, sender=Glucose)
+@receiver(post_delete, sender=Blood)
+def mirror_to_timeseries(sender, instance, created=False, **kwargs):
+    # The store is not transactional, it only ever sees committed readings
+    if not timeseries.is_enabled():
+        return
+
+    if created:
+        transaction.on_commit(lambda: timeseries.append_instances(sender, [instance]))
+        return
+
+    # Updates and deletes cannot be applied to append-only files, the patient's series are rewritten
+    patients = {instance.patient_id}
+    previous = getattr(instance, '_previous_measurement', None)
+    if previous is not None:
+        patients.add(previous[0])
+    transaction.on_commit(lambda: timeseries.rebuild(sorted(patients)))
+
+
+@receiver(measurements_created, sender=Glucose)
+@receiver(measurements_created, sender=Blood)
+def mirror_to_timeseries_on_bulk_create(sender, instances, **kwargs):
+    if timeseries.is_enabled():
+        instances = list(instances)
+        transaction.on_commit(lambda: timeseries.append_instances(sender, instances))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Address)
+def touch_web_users(sender, instance, created=False, update_fields=None, **kwargs):
+    # Cached web pages of patients and physicians are keyed by ``updated`` and show their user and address
+    if created or (update_fields is not None and set(update_fields) <= {'last_login', 'password'}):
+        return
+    field = 'user' if sender is User else 'address'
+    now = timezone.now()
+    for model in (Patient, Physician):
+        model.objects.filter(**{field: instance}).update(updated=now)
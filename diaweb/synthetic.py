@@ -0,0 +1,198 @@
+"""
+Synthetic patients, physicians and measurement histories for scale testing.
+
+Readings are generated per patient with vectorized NumPy and written with raw
+``executemany`` inserts in large transactions, which skips model instances and
+signals entirely. Rollups, the time series store and the measurement cache are
+rebuilt for the new patients afterwards.
+"""
+from datetime import datetime, timedelta, time, timezone as dt_timezone
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from diaweb import cache, rollups, timeseries
+from diaweb.models import Address, Patient, Physician, Reception, Appointment, Glucose, Blood
+
+DEFAULT_BATCH_SIZE = 50000
+
+# Minutes after midnight of breakfast, lunch and dinner
+MEAL_MINUTES = np.array([450, 780, 1140])
+
+# Glucose.MEASUREMENT_TYPES by time of day: [start of range in minutes] -> type
+TYPE_EDGES = np.array([360, 450, 630, 690, 780, 960, 1050, 1140, 1320])
+TYPE_VALUES = np.array([0, 1, 2, 0, 3, 4, 0, 5, 6, 0])
+
+BLOOD_MINUTES = np.array([420, 1260])
+
+FIRST_NAMES = ['Anna', 'Jan', 'Maria', 'Piotr', 'Katarzyna', 'Tomasz', 'Ewa', 'Marek', 'Zofia', 'Adam']
+LAST_NAMES = ['Nowak', 'Kowalski', 'Wisniewski', 'Wojcik', 'Kaminski', 'Lewandowski', 'Zielinski', 'Mazur']
+CITIES = ['Warszawa', 'Krakow', 'Gdansk', 'Poznan', 'Wroclaw', 'Lodz']
+SPECIALTIES = ['Diabetology', 'Endocrinology', 'General Physician', 'Cardiology']
+
+
+def glucose_series(rng, start, days, per_day):
+    """
+    Returns epoch seconds, values and measurement types of a CGM-like series with a
+    dawn rise and a post meal peak after every meal.
+    """
+    count = days * per_day
+    step = 86400 / per_day
+    offsets = np.arange(count) * step + rng.uniform(0, step / 5, count)
+    minutes = (offsets % 86400) / 60
+
+    values = rng.normal(110, 15) + rng.normal(0, 10, days).repeat(per_day)
+    values += 15 * np.exp(-((minutes - 360) / 90) ** 2)
+    for meal, amplitude in zip(MEAL_MINUTES, rng.uniform(30, 90, len(MEAL_MINUTES))):
+        since = np.maximum(minutes - meal, 0) / 45
+        values += amplitude * since * np.exp(1 - since)
+    values += np.convolve(rng.normal(0, 6, count), np.ones(6) / 6, mode='same')
+
+    types = TYPE_VALUES[np.searchsorted(TYPE_EDGES, minutes, side='right')]
+    return start + offsets.astype(np.int64), np.clip(values, 40, 400).round(1), types
+
+
+def blood_series(rng, start, days, per_day):
+    """
+    Returns epoch seconds and systolic, diastolic and pulse values of blood pressure
+    readings spread around the morning and the evening.
+    """
+    count = days * per_day
+    slots = BLOOD_MINUTES[np.arange(count) % len(BLOOD_MINUTES)] if per_day <= len(BLOOD_MINUTES) \
+        else np.tile(np.linspace(420, 1260, per_day), days)
+    offsets = (np.arange(count) // per_day) * 86400 + slots * 60 + rng.normal(0, 1200, count)
+
+    systolic = rng.normal(rng.normal(128, 12), 8, count)
+    diastolic = systolic * 0.62 + rng.normal(0, 5, count)
+    pulse = rng.normal(rng.normal(72, 8), 6, count)
+    return (start + offsets.astype(np.int64), systolic.round().astype(int), diastolic.round().astype(int),
+            pulse.round().astype(int))
+
+
+def _date_strings(epoch_seconds):
+    # Database format of aware datetimes, SQLite stores them as naive UTC text
+    text = np.char.replace(np.datetime_as_string(epoch_seconds.astype('datetime64[s]')), 'T', ' ')
+    return text if connection.vendor == 'sqlite' else np.char.add(text, '+00:00')
+
+
+def _insert(model, fields, columns, batch_size):
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+    sql = f'INSERT INTO {table} ({names}) VALUES ({", ".join(["%s"] * len(fields))})'
+
+    columns = [column.tolist() if isinstance(column, np.ndarray) else column for column in columns]
+    rows = list(zip(*columns))
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), batch_size):
+            with transaction.atomic():
+                cursor.executemany(sql, rows[offset:offset + batch_size])
+    return len(rows)
+
+
+def _people(rng, prefix, count, start):
+    first = rng.choice(FIRST_NAMES, count)
+    last = rng.choice(LAST_NAMES, count)
+    password = make_password(None)
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}{start + i}', first_name=first[i], last_name=last[i],
+             email=f'{prefix}{start + i}@example.com', password=password)
+        for i in range(count)])
+    addresses = Address.objects.bulk_create([
+        Address(country='Poland', state='-', city=rng.choice(CITIES), zip_code=f'{rng.integers(10, 99)}-'
+                f'{rng.integers(100, 999)}', street='Synthetic', number=str(rng.integers(1, 200)))
+        for _ in range(count)])
+    return users, addresses
+
+
+def generate(patients, physicians=None, days=365, glucose_per_day=288, blood_per_day=2, end=None, seed=0,
+             prefix='synthetic', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Creates ``patients`` patients and ``physicians`` physicians, with addresses,
+    users, weekly receptions, quarterly appointments and ``days`` of readings
+    ending at ``end``. Returns the number of created rows per model.
+    """
+    rng = np.random.default_rng(seed)
+    physicians = physicians if physicians is not None else max(1, patients // 20)
+    end = end or datetime.now(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    start = int((end - timedelta(days=days)).timestamp())
+    first = User.objects.filter(username__startswith=prefix).count()
+
+    users, addresses = _people(rng, prefix, physicians, first)
+    physician_list = Physician.objects.bulk_create([
+        Physician(user=user, address=address, specialty=rng.choice(SPECIALTIES),
+                  phone=str(rng.integers(100_000_000, 999_999_999)))
+        for user, address in zip(users, addresses)])
+
+    receptions = []
+    schedule = {}
+    for physician in physician_list:
+        week_days = sorted(rng.choice(np.arange(1, 6), rng.integers(3, 6), replace=False).tolist())
+        hour = int(rng.integers(8, 11))
+        schedule[physician.id] = (week_days, hour)
+        receptions += [Reception(physician=physician, day=str(day), start_time=time(hour),
+                                 end_time=time(hour + 6)) for day in week_days]
+    Reception.objects.bulk_create(receptions)
+
+    # Appointments roughly every quarter with one of the linked physicians, on one of its reception days
+    links, appointments, last_appointments, booked = [], [], [], set()
+    for index in range(patients):
+        linked = rng.choice(physician_list, min(len(physician_list), int(rng.integers(1, 3))), replace=False)
+        links.append(linked)
+        moment, visits = end - timedelta(days=days) + timedelta(days=int(rng.integers(0, 90))), []
+        while moment < end:
+            physician = linked[int(rng.integers(len(linked)))]
+            week_days, hour = schedule[physician.id]
+            while moment.isoweekday() not in week_days:
+                moment += timedelta(days=1)
+            # Next free hour of the reception, physicians see one patient at a time
+            first_hour = int(rng.integers(0, 6))
+            for offset in range(6):
+                date = datetime.combine(moment.date(), time(hour + (first_hour + offset) % 6), dt_timezone.utc)
+                if (physician.id, date) not in booked:
+                    booked.add((physician.id, date))
+                    visits.append((physician, date))
+                    break
+            moment += timedelta(days=int(rng.integers(70, 110)))
+        visits = [visit for visit in visits if visit[1] < end]
+        appointments.append(visits)
+        last_appointments.append(visits[-1][1].date() if visits else None)
+
+    users, addresses = _people(rng, prefix, patients, first + physicians)
+    birthdates = end.date() - (rng.uniform(18, 90, patients) * 365.25).astype(int) * timedelta(days=1)
+    patient_list = Patient.objects.bulk_create([
+        Patient(user=user, address=address, birthdate=birthdate, sex=rng.choice(['M', 'F']),
+                last_appointment=last_appointment)
+        for user, address, birthdate, last_appointment in zip(users, addresses, birthdates, last_appointments)])
+
+    Physician.patient.through.objects.bulk_create([
+        Physician.patient.through(physician_id=physician.id, patient_id=patient.id)
+        for patient, linked in zip(patient_list, links) for physician in linked])
+    Appointment.objects.bulk_create([
+        Appointment(patient=patient, physician=physician, date=date)
+        for patient, visits in zip(patient_list, appointments) for physician, date in visits], batch_size=batch_size)
+
+    created = {'physicians': physicians, 'patients': patients, 'receptions': len(receptions),
+               'appointments': sum(len(visits) for visits in appointments), 'glucose': 0, 'blood': 0}
+    for patient in patient_list:
+        if glucose_per_day:
+            times, values, types = glucose_series(rng, start, days, glucose_per_day)
+            created['glucose'] += _insert(Glucose, ['patient', 'measurement', 'measurement_type', 'measurement_date'],
+                                          [[patient.id] * len(times), values, types, _date_strings(times)],
+                                          batch_size)
+        if blood_per_day:
+            times, systolic, diastolic, pulse = blood_series(rng, start, days, blood_per_day)
+            created['blood'] += _insert(Blood, ['patient', 'systolic_pressure', 'diastolic_pressure', 'pulse_rate',
+                                                'measurement_date'],
+                                        [[patient.id] * len(times), systolic, diastolic, pulse,
+                                         _date_strings(times)], batch_size)
+
+    patient_ids = [patient.id for patient in patient_list]
+    created['rollups'] = rollups.rebuild(patient_ids)
+    if timeseries.is_enabled():
+        timeseries.rebuild(patient_ids)
+    for patient_id in patient_ids:
+        cache.invalidate(patient_id)
+
+    return created
@@ -0,0 +1,52 @@
+"""
+Long running work available to the job queue of ``diaweb.jobs``.
+"""
+from datetime import timedelta
+
+from diaweb import classifier, columnar, jobs, rollups, timeseries
+from diaweb.ingest import import_measurement_log, DEFAULT_BATCH_SIZE
+from diaweb.models import Patient, Glucose, Blood
+
+EXPORT_MODELS = {
+    'glucose': Glucose,
+    'blood': Blood,
+}
+
+
+@jobs.task
+def classify_patients(patients=None, incremental=False, days=classifier.WINDOW.days):
+    queryset = Patient.objects.all() if patients is None else Patient.objects.filter(pk__in=patients)
+    totals = classifier.classify(queryset, incremental=incremental, window=timedelta(days=days),
+                                 progress=jobs.set_progress)
+    return {Patient.PREDICTIONS[prediction]: count for prediction, count in totals.items()}
+
+
+@jobs.task
+def rebuild_rollups(patients=None):
+    return {'rollups': rollups.rebuild(patients)}
+
+
+@jobs.task
+def rebuild_timeseries(patients=None):
+    return {'readings': timeseries.rebuild(patients)}
+
+
+@jobs.task(paths=['directory'])
+def export_columnar(directory, series=None, patients=None):
+    directory = jobs.resolve_path(directory)
+    written = {}
+    for number, name in enumerate(series or EXPORT_MODELS, start=1):
+        model = EXPORT_MODELS[name]
+        queryset = model.objects.all() if patients is None else model.objects.filter(patient_id__in=patients)
+        written[name] = columnar.export_history(directory, model, queryset)
+        jobs.set_progress(number / len(series or EXPORT_MODELS), f'Exported {name}')
+    return written
+
+
+@jobs.task(max_attempts=1, paths=['path'])
+def import_measurements(path, patient, log_format=None, year=None, batch_size=DEFAULT_BATCH_SIZE):
+    stats = {}
+    with open(jobs.resolve_path(path), newline='', encoding='utf-8-sig') as file:
+        imported = import_measurement_log(file, patient, log_format=log_format, year=year, batch_size=batch_size,
+                                          stats=stats)
+    return {'imported': imported, 'skipped': stats.get('skipped', 0)}
@@ -0,0 +1,136 @@
+import threading
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from diaweb import booking
+from diaweb.models import Appointment, Patient, Reception
+from diaweb.tests.tests_models import DataProvider
+
+# Monday
+MONDAY = date(2030, 1, 7)
+
+
+def slot(hour, minute=0):
+    return datetime.combine(MONDAY, time(hour, minute), dt_timezone.utc)
+
+
+class TestBookingEndpoint(APITestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.url = reverse('appointment-book')
+        Reception.objects.create(physician=self.data.physician, day='1', start_time=time(9), end_time=time(11))
+        self.client.force_authenticate(user=self.data.patient.user)
+
+    def book(self, moment, **data):
+        return self.client.post(self.url, {'physician': self.data.physician.id, 'date': moment.isoformat(), **data},
+                                format='json')
+
+    def test_patient_books_free_slot(self):
+        response = self.book(slot(9, 30))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        appointment = Appointment.objects.get()
+        self.assertEqual((appointment.patient, appointment.physician, appointment.date),
+                         (self.data.patient, self.data.physician, slot(9, 30)))
+
+    def test_taken_and_overlapping_slots_conflict(self):
+        Appointment.objects.create(patient=self.data.patient, physician=self.data.physician, date=slot(9, 45))
+        for moment in [slot(9, 30), slot(10)]:
+            self.assertEqual(self.book(moment).status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.book(slot(9)).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.book(slot(9)).status_code, status.HTTP_409_CONFLICT)
+
+    def test_slot_outside_reception_grid(self):
+        for moment in [slot(8, 30), slot(9, 10), slot(10, 45), slot(11), datetime(2030, 1, 8, 9, tzinfo=dt_timezone.utc),
+                       datetime(2020, 1, 6, 9, tzinfo=dt_timezone.utc)]:
+            response = self.book(moment)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, moment)
+            self.assertIn('date', response.data)
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_slot_length(self):
+        # 09:45 only lies on the grid of 15 minute slots, which then fit between 09:30 and 10:00
+        self.assertEqual(self.book(slot(9, 45)).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.book(slot(9, 45), slot=15).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.book(slot(9, 30), slot=15).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.book(slot(10, 15), slot=15).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.book(slot(9), slot=60).status_code, status.HTTP_409_CONFLICT)
+
+        for length in [4, 481, 'long']:
+            response = self.book(slot(9), slot=length)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('slot', response.data)
+
+    def test_mixed_slot_lengths_do_not_overlap(self):
+        self.assertEqual(self.book(slot(9), slot=60).status_code, status.HTTP_201_CREATED)
+        for moment, length in [(slot(9, 30), 30), (slot(9, 45), 15), (slot(9), 15)]:
+            self.assertEqual(self.book(moment, slot=length).status_code, status.HTTP_409_CONFLICT, (moment, length))
+        self.assertEqual(self.book(slot(10), slot=30).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.book(slot(10, 30), slot=15).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(Appointment.objects.values_list('date', 'duration')),
+                         [(slot(9), timedelta(hours=1)), (slot(10), timedelta(minutes=30)),
+                          (slot(10, 30), timedelta(minutes=15))])
+
+    def test_staff_books_for_patient(self):
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        self.assertEqual(self.book(slot(9)).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.book(slot(9), patient=self.data.patient.id).status_code, status.HTTP_201_CREATED)
+
+    def test_other_users_cannot_book(self):
+        self.client.force_authenticate(user=self.data.user1)
+        self.assertEqual(self.book(slot(9)).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestConcurrentBooking(TransactionTestCase):
+    """
+    Patients racing for the same slots from separate connections end with exactly
+    one appointment per slot.
+    """
+    threads = 8
+
+    def setUp(self):
+        self.data = DataProvider()
+        Reception.objects.create(physician=self.data.physician, day='1', start_time=time(9), end_time=time(10))
+        self.patients = [Patient.objects.create(user=User.objects.create_user(username=f'racer{i}'),
+                                                birthdate=date(1990, 1, 1), sex='F')
+                         for i in range(self.threads)]
+
+    def race(self, moments):
+        barrier = threading.Barrier(self.threads)
+        results = [None] * self.threads
+
+        def run(index):
+            try:
+                barrier.wait()
+                booking.book(self.patients[index], self.data.physician.id, moments[index % len(moments)])
+                results[index] = 'booked'
+            except booking.SlotTaken:
+                results[index] = 'taken'
+            except Exception as error:
+                results[index] = error
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run, args=(index,)) for index in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def test_same_slot_is_booked_once(self):
+        results = self.race([slot(9)])
+        self.assertEqual(sorted(results), ['booked'] + ['taken'] * (self.threads - 1))
+        self.assertEqual(Appointment.objects.filter(physician=self.data.physician).count(), 1)
+
+    def test_each_slot_is_booked_once(self):
+        results = self.race([slot(9), slot(9, 30)])
+        self.assertEqual(results.count('booked'), 2)
+        self.assertEqual(results.count('taken'), self.threads - 2)
+        self.assertEqual(sorted(Appointment.objects.values_list('date', flat=True)), [slot(9), slot(9, 30)])
@@ -0,0 +1,106 @@
+import io
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from diaweb import classifier
+from diaweb.ingest import bulk_insert
+from diaweb.models import Patient, Glucose, Blood
+from diaweb.tests.tests_models import DataProvider
+
+
+class TestClassifier(TestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.now = timezone.now()
+        self.healthy = self.data.patient
+        self.diabetic = self.create_patient('diabetic')
+        self.prediabetic = self.create_patient('prediabetic')
+        self.unknown = self.create_patient('unknown')
+
+        self.add_days(self.healthy, fasting=90, post_meal=130)
+        self.add_days(self.diabetic, fasting=140, post_meal=190)
+        self.add_days(self.prediabetic, fasting=110, post_meal=150)
+        bulk_insert(Blood, [Blood(patient=self.prediabetic, systolic_pressure=150, diastolic_pressure=95, pulse_rate=70,
+                                  measurement_date=self.now - timedelta(days=day)) for day in range(1, 10)])
+        bulk_insert(Glucose, [Glucose(patient=self.unknown, measurement=300, measurement_type=2,
+                                      measurement_date=self.now - timedelta(days=1))])
+
+    def create_patient(self, name):
+        user = User.objects.create_user(username=name, email=f'{name}@test.com', password='<PASSWORD>')
+        return Patient.objects.create(user=user, birthdate=self.data.patient.birthdate, sex='F')
+
+    def add_days(self, patient, fasting, post_meal, days=20, ago=1):
+        readings = []
+        for day in range(days):
+            moment = self.now - timedelta(days=ago + day)
+            readings.append(Glucose(patient=patient, measurement=fasting, measurement_type=1,
+                                    measurement_date=moment - timedelta(hours=2)))
+            readings.append(Glucose(patient=patient, measurement=post_meal, measurement_type=2,
+                                    measurement_date=moment))
+        # Readings older than the window are ignored
+        readings.append(Glucose(patient=patient, measurement=400, measurement_type=1,
+                                measurement_date=self.now - classifier.WINDOW - timedelta(days=5)))
+        bulk_insert(Glucose, readings)
+
+    def results(self):
+        return {patient.pk: patient.classifier_result for patient in Patient.objects.all()}
+
+    def test_features(self):
+        features = classifier.extract_features([self.diabetic.pk, self.healthy.pk], self.now - classifier.WINDOW)
+        self.assertEqual(features['patient_id'].tolist(), sorted([self.diabetic.pk, self.healthy.pk]))
+        row = features['patient_id'].tolist().index(self.diabetic.pk)
+        self.assertEqual(features['count'][row], 40)
+        self.assertAlmostEqual(features['fasting_mean'][row], 140)
+        self.assertAlmostEqual(features['excursion'][row], 50)
+        self.assertAlmostEqual(features['std'][row], np.std([140] * 20 + [190] * 20, ddof=1))
+        self.assertTrue(np.isnan(features['systolic']).all())
+
+    def test_unknown_measurement_types_are_ignored(self):
+        bulk_insert(Glucose, [Glucose(patient=self.healthy, measurement=400, measurement_type=42,
+                                      measurement_date=self.now - timedelta(days=1))])
+        features = classifier.extract_features([self.healthy.pk], self.now - classifier.WINDOW)
+        self.assertEqual(features['count'].tolist(), [40])
+        self.assertEqual(classifier.classify()[1], 2)
+
+    def test_classify(self):
+        totals = classifier.classify(chunk_size=2)
+        self.assertEqual(self.results(), {self.healthy.pk: -1, self.diabetic.pk: 1, self.prediabetic.pk: 1,
+                                          self.unknown.pk: 0})
+        self.assertEqual(totals, {-1: 1, 0: 1, 1: 2})
+        self.assertFalse(Patient.objects.filter(classified_at__isnull=True).exists())
+
+    def test_incremental(self):
+        classifier.classify()
+        self.assertEqual(sum(classifier.classify(incremental=True).values()), 0)
+
+        # New readings after the last run make the patient stale again
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_days(self.healthy, fasting=150, post_meal=250, days=30, ago=-1)
+        with self.assertNumQueries(4):
+            totals = classifier.classify(incremental=True)
+        self.assertEqual(totals, {-1: 0, 0: 0, 1: 1})
+        self.assertEqual(Patient.objects.get(pk=self.healthy.pk).classifier_result, 1)
+
+    def test_incremental_picks_up_backfilled_readings(self):
+        classifier.classify()
+        # Uploaded after the run but taken before it
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_days(self.healthy, fasting=150, post_meal=250, days=30, ago=5)
+        self.assertEqual(list(classifier.stale_patients().values_list('pk', flat=True)), [self.healthy.pk])
+        self.assertEqual(classifier.classify(incremental=True), {-1: 0, 0: 0, 1: 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Glucose.objects.filter(patient=self.healthy).delete()
+        self.assertEqual(classifier.classify(incremental=True), {-1: 0, 0: 1, 1: 0})
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('classify_patients', patients=[self.diabetic.pk], stdout=out)
+        self.assertIn('Classified 1 patients', out.getvalue())
+        self.assertEqual(self.results()[self.diabetic.pk], 1)
+        self.assertEqual(self.results()[self.healthy.pk], 0)
@@ -0,0 +1,82 @@
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from diaweb import columnar
+from diaweb.models import Glucose, Blood
+from diaweb.tests.tests_models import DataProvider
+
+START = datetime(2023, 1, 30, tzinfo=dt_timezone.utc)
+
+
+class TestColumnarFormat(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.data = DataProvider()
+        Glucose.objects.bulk_create([Glucose(patient=self.data.patient, measurement=80 + i, measurement_type=i % 7,
+                                             measurement_date=START + timedelta(hours=12 * i)) for i in range(10)])
+
+    def test_round_trip_is_memory_mapped(self):
+        path = os.path.join(self.directory.name, 'test.dcol')
+        columns = {'a': np.arange(5, dtype='<i8'), 'b': np.linspace(0, 1, 5).astype('<f4')}
+        with open(path, 'wb') as file:
+            columnar.write(file, columns, {'patient': 1})
+
+        loaded, metadata = columnar.read(path)
+        self.assertEqual(metadata, {'patient': 1})
+        self.assertIsInstance(loaded['a'], np.memmap)
+        for name, array in columns.items():
+            np.testing.assert_array_equal(loaded[name], array)
+            self.assertEqual(columnar.read_header(path)['columns'][list(columns).index(name)]['offset']
+                             % columnar.ALIGNMENT, 0)
+
+    def test_export_partitions_by_month(self):
+        self.assertEqual(columnar.export_history(self.directory.name, Glucose), 2)
+        january = columnar.read(columnar.partition_path(self.directory.name, Glucose, self.data.patient.id,
+                                                        '2023-01'))[0]
+        self.assertEqual(len(january['measurement']), 4)
+
+        history = columnar.load_history(self.directory.name, Glucose, self.data.patient.id)
+        np.testing.assert_array_equal(history['measurement'], np.arange(80, 90))
+        np.testing.assert_array_equal(history['measurement_type'], np.arange(10) % 7)
+        self.assertEqual(history['measurement_date'][0], np.datetime64('2023-01-30T00:00:00'))
+
+        february = columnar.load_history(self.directory.name, Glucose, self.data.patient.id, start_month='2023-02')
+        self.assertEqual(len(february['measurement']), 6)
+
+    def test_command(self):
+        Blood.objects.create(patient=self.data.patient, systolic_pressure=120, diastolic_pressure=80, pulse_rate=60,
+                             measurement_date=START)
+        call_command('export_columnar', self.directory.name, stdout=io.StringIO())
+
+        blood = columnar.load_history(self.directory.name, Blood, self.data.patient.id)
+        self.assertEqual(blood['systolic_pressure'].tolist(), [120])
+        self.assertEqual(len(columnar.load_history(self.directory.name, Blood, 999)['pulse_rate']), 0)
+
+
+class TestColumnarEndpoint(APITestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.client.force_authenticate(user=self.data.user1)
+        Glucose.objects.bulk_create([Glucose(patient=self.data.patient, measurement=100 + i,
+                                             measurement_date=START + timedelta(days=i)) for i in range(3)])
+
+    def test_download(self):
+        response = self.client.get(reverse('glucose-columnar'), {'patient': self.data.patient.id})
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+
+        with tempfile.NamedTemporaryFile(suffix=columnar.EXTENSION, delete=False) as file:
+            file.write(response.content)
+        self.addCleanup(os.remove, file.name)
+
+        columns, metadata = columnar.read(file.name)
+        self.assertEqual(metadata['series'], 'glucose')
+        self.assertEqual(columns['measurement'].tolist(), [100, 101, 102])
@@ -0,0 +1,99 @@
+import io
+import os
+import tempfile
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from diaweb.models import Glucose, Blood, Patient, Physician, Reception, MeasurementRollup
+from diaweb.tests.tests_models import DataProvider
+
+
+class TestImportMeasurementsCommand(TestCase):
+    def setUp(self):
+        self.data = DataProvider()
+
+    def write_csv(self, content):
+        file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        file.write(content)
+        file.close()
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    def test_import_glucose_log(self):
+        path = self.write_csv('Date,Before breakfast,2h after breakfast,Before lunch,2h after lunch,'
+                              'Before dinner,2h after dinner,Extra,Comment\n'
+                              'Thu. 10/Feb.,105,177,,107,182,208,,overnight\n'
+                              'Fri. 11/Feb.,101,abc,,,,,,\n'
+                              'Sat. 12/Feb.,-5,nan,,,,,,\n')
+        out = io.StringIO()
+        call_command('import_measurements', path, patient=self.data.patient.id, year=2022, batch_size=2, stdout=out)
+
+        self.assertEqual(Glucose.objects.count(), 6)
+        self.assertIn('skipped 3', out.getvalue())
+        reading = Glucose.objects.get(measurement_type=2)
+        self.assertEqual(reading.measurement, 177)
+        self.assertEqual((reading.measurement_date.year, reading.measurement_date.month,
+                          reading.measurement_date.day), (2022, 2, 10))
+
+    def test_import_blood_log(self):
+        path = self.write_csv('﻿Measurement Date,Time Zone,SYS,DIA,Pulse,Device Model Name\n'
+                              '2021-05-07 11:04,Europe/Rome,135,81,77,HEM-7361T_ESL\n'
+                              '2021-05-08 9:17,Europe/Rome,125,72,63,HEM-7361T_ESL\n'
+                              '2021-05-09 8:00,Europe/Rome,120,-70,60,HEM-7361T_ESL\n')
+        out = io.StringIO()
+        call_command('import_measurements', path, patient=self.data.patient.id, stdout=out)
+
+        self.assertEqual(Blood.objects.count(), 2)
+        self.assertIn('skipped 1', out.getvalue())
+        blood = Blood.objects.order_by('measurement_date').first()
+        self.assertEqual((blood.systolic_pressure, blood.diastolic_pressure, blood.pulse_rate), (135, 81, 77))
+        self.assertEqual(blood.measurement_date, datetime(2021, 5, 7, 11, 4, tzinfo=ZoneInfo('Europe/Rome')))
+
+    def test_import_repository_logs(self):
+        for name in ['glucose.csv', 'bp_log.csv']:
+            call_command('import_measurements', os.path.join(settings.BASE_DIR, name),
+                         patient=self.data.patient.id, year=2023, stdout=io.StringIO())
+        self.assertTrue(Glucose.objects.exists())
+        self.assertTrue(Blood.objects.exists())
+
+    def test_unknown_patient(self):
+        path = self.write_csv('Measurement Date,Time Zone,SYS,DIA,Pulse\n')
+        with self.assertRaises(CommandError):
+            call_command('import_measurements', path, patient=999)
+
+    def test_unknown_format(self):
+        path = self.write_csv('a,b,c\n1,2,3\n')
+        with self.assertRaises(CommandError):
+            call_command('import_measurements', path, patient=self.data.patient.id)
+
+
+class TestGenerateSyntheticCommand(TestCase):
+    def test_generate(self):
+        out = io.StringIO()
+        call_command('generate_synthetic', patients=3, physicians=2, days=10, glucose_per_day=96, blood_per_day=2,
+                     end='2024-01-01', stdout=out)
+        self.assertIn('Generated 2940 readings', out.getvalue())
+
+        patients = Patient.objects.filter(user__username__startswith='synthetic')
+        self.assertEqual(patients.count(), 3)
+        self.assertEqual(Physician.objects.count(), 2)
+        self.assertTrue(all(patient.address_id and patient.physician_set.exists() for patient in patients))
+        self.assertEqual(Reception.objects.count(), Reception.objects.filter(physician__isnull=False).count())
+
+        patient = patients.first()
+        glucose = Glucose.objects.filter(patient=patient)
+        self.assertEqual(glucose.count(), 960)
+        self.assertEqual(set(glucose.values_list('measurement_type', flat=True)), set(range(7)))
+        self.assertLess(glucose.latest('measurement_date').measurement_date,
+                        datetime(2024, 1, 1, tzinfo=ZoneInfo('UTC')))
+        self.assertEqual(Blood.objects.filter(patient=patient).count(), 20)
+        self.assertTrue(MeasurementRollup.objects.filter(patient=patient, series='GLU').exists())
+
+    def test_repeated_runs_add_users(self):
+        call_command('generate_synthetic', patients=1, physicians=1, days=1, stdout=io.StringIO())
+        call_command('generate_synthetic', patients=1, physicians=1, days=1, stdout=io.StringIO())
+        self.assertEqual(Patient.objects.count(), 2)
@@ -0,0 +1,37 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from diaweb.downsampling import min_max, lttb
+
+
+class TestDownsampling(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = np.arange(50_000) * 300
+        self.y = 120 + 40 * np.sin(self.x / 40_000) + rng.normal(0, 5, len(self.x))
+        self.y[12_345] = 35
+        self.y[40_000] = 420
+
+    def test_min_max_keeps_extremes(self):
+        indices = min_max(self.x, self.y, 1000)
+        self.assertLessEqual(len(indices), 1000)
+        self.assertIn(12_345, indices)
+        self.assertIn(40_000, indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertEqual((indices[0], indices[-1]), (0, len(self.x) - 1))
+
+    def test_lttb_size_and_order(self):
+        indices = lttb(self.x, self.y, 500)
+        self.assertEqual(len(indices), 500)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertIn(12_345, indices)
+
+    def test_small_series_untouched(self):
+        np.testing.assert_array_equal(min_max(self.x[:10], self.y[:10], 100), np.arange(10))
+        np.testing.assert_array_equal(lttb(self.x[:10], self.y[:10], 100), np.arange(10))
+
+    def test_constant_x(self):
+        indices = min_max(np.zeros(100), self.y[:100], 10)
+        self.assertIn(self.y[:100].argmin(), indices)
+        self.assertIn(self.y[:100].argmax(), indices)
+        self.assertLessEqual(len(indices), 4)
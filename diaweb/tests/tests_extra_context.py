@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from diaweb.extra_context import ExtraContext, import_extra_context
+
+SOURCE = os.path.join(settings.BASE_DIR, 'diaweb', 'static', 'diaweb', 'files', 'index_page_msg')
+
+
+class TestExtraContext(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.directory = os.path.join(root, 'messages')
+        shutil.copytree(SOURCE, self.directory)
+        self.compiled = os.path.join(root, 'compiled', 'messages.json')
+
+    def touch(self, path, offset):
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + offset))
+
+    def test_messages_are_frozen(self):
+        messages = ExtraContext(self.directory).get()
+        self.assertEqual(messages, tuple((title, tuple(lines)) for title, lines in import_extra_context(SOURCE)))
+        self.assertEqual(messages[0][0], 'Welcome')
+
+    def test_disk_is_checked_once_per_interval(self):
+        extra_context = ExtraContext(self.directory, check_interval=3600)
+        messages = extra_context.get()
+        with mock.patch('diaweb.extra_context.os.stat') as stat, \
+                mock.patch('diaweb.extra_context.os.listdir') as listdir:
+            for _ in range(10):
+                self.assertIs(extra_context.get(), messages)
+        stat.assert_not_called()
+        listdir.assert_not_called()
+
+    def test_reloads_when_directory_changes(self):
+        extra_context = ExtraContext(self.directory, check_interval=0)
+        messages = extra_context.get()
+        with mock.patch('diaweb.extra_context.import_extra_context', wraps=import_extra_context) as scan:
+            self.assertIs(extra_context.get(), messages)
+            scan.assert_not_called()
+
+            with open(os.path.join(self.directory, '9.txt'), 'w') as file:
+                file.write('News\nFirst line\nSecond line\n')
+            self.touch(self.directory, 10 ** 9)
+            messages = extra_context.get()
+        scan.assert_called_once()
+        self.assertEqual(messages[-1], ('News', ('First line', 'Second line')))
+
+    def test_compiled_file_takes_precedence(self):
+        call_command('compile_extra_context', source=self.directory, output=self.compiled, stdout=io.StringIO())
+        with open(self.compiled) as file:
+            self.assertEqual(json.load(file), import_extra_context(SOURCE))
+
+        shutil.rmtree(self.directory)
+        extra_context = ExtraContext(self.directory, self.compiled, check_interval=0)
+        self.assertEqual(extra_context.get(), ExtraContext(SOURCE).get())
+
+        os.remove(self.compiled)
+        self.assertEqual(extra_context.get(), ())
+
+
+class TestIndexPage(TestCase):
+    def test_index_page_serves_messages_from_memory(self):
+        extra_context = ExtraContext(SOURCE, check_interval=3600)
+        extra_context.reload()
+        with mock.patch('diaweb.views.get_extra_context', return_value=extra_context), \
+                mock.patch.object(extra_context, 'reload') as reload:
+            response = self.client.get(reverse('index'))
+        reload.assert_not_called()
+        self.assertContains(response, '<legend>Welcome</legend>', html=True)
@@ -0,0 +1,202 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+
+import pandas as pd
+from dash import no_update
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from diaweb import cache
+from diaweb.executors import get_render_executor
+from diaweb.graphs import update_data_statistics, update_graph, update_slider, update_end_date, slider_range, \
+    get_dates, unix_time_millis, app, GRAPH_WIDTH
+from diaweb.ingest import bulk_insert
+from diaweb.models import Glucose, Blood
+from diaweb.tests.tests_models import DataProvider
+
+
+def slider(start, end):
+    return [int(start.timestamp()), int(end.timestamp())]
+
+
+class TestUpdateDataStatistics(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.data = DataProvider()
+        self.request = SimpleNamespace(session={'patient_id': self.data.patient.id})
+        self.slider = slider(datetime(2023, 3, 1, tzinfo=dt_timezone.utc), datetime(2023, 3, 10, tzinfo=dt_timezone.utc))
+        self.glucose = [90, 110, 135, 180, 72, 240]
+        for day, value in enumerate(self.glucose, start=1):
+            Glucose.objects.create(patient=self.data.patient, measurement=value,
+                                   measurement_date=datetime(2023, 3, day, tzinfo=dt_timezone.utc))
+            Blood.objects.create(patient=self.data.patient, systolic_pressure=110 + day, diastolic_pressure=70 + day,
+                                 pulse_rate=60 + 2 * day, measurement_date=datetime(2023, 3, day, tzinfo=dt_timezone.utc))
+        Blood.objects.create(patient=self.data.patient, systolic_pressure=500, diastolic_pressure=500, pulse_rate=500,
+                             measurement_date=datetime(2022, 3, 1, tzinfo=dt_timezone.utc))
+
+    def test_matches_pandas_describe(self):
+        result = update_data_statistics(self.slider, ['Glucose'], request=self.request)
+        expected = pd.Series(self.glucose, dtype=float).describe()
+        self.assertEqual(result[0]['type'], 'GLU')
+        for key, value in expected.items():
+            self.assertAlmostEqual(result[0][key], value)
+
+    def test_one_query_per_model(self):
+        with self.assertNumQueries(2):
+            result = update_data_statistics(self.slider, ['Pulse', 'Glucose', 'Sys', 'Dia'], request=self.request)
+        self.assertEqual([row['type'] for row in result], ['GLU', 'SYS', 'DIA', 'PUL'])
+        self.assertEqual(result[1]['max'], 116)
+
+    def test_long_range_reads_rollups(self):
+        long_slider = slider(datetime(2023, 1, 1, 12, 30, tzinfo=dt_timezone.utc),
+                             datetime(2023, 12, 31, tzinfo=dt_timezone.utc))
+        exact = update_data_statistics(self.slider, ['Glucose', 'Sys'], request=self.request)
+        with self.assertNumQueries(4):
+            result = update_data_statistics(long_slider, ['Glucose', 'Sys'], request=self.request)
+
+        self.assertEqual([row['type'] for row in result], ['GLU', 'SYS'])
+        for expected, row in zip(exact, result):
+            for key in expected:
+                self.assertAlmostEqual(expected[key], row[key])
+
+    def test_empty_range(self):
+        result = update_data_statistics(slider(datetime(2010, 1, 1, tzinfo=dt_timezone.utc), datetime(2010, 12, 31, tzinfo=dt_timezone.utc)), ['Glucose', 'Sys'],
+                                        request=self.request)
+        self.assertEqual(result, [])
+
+
+class TestUpdateGraph(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.data = DataProvider()
+        self.request = SimpleNamespace(session={'patient_id': self.data.patient.id})
+        start = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        readings = [Glucose(patient=self.data.patient, measurement=100 + i % 50, measurement_type=i % 2,
+                            measurement_date=start + timedelta(minutes=5 * i)) for i in range(12_000)]
+        readings[7_001].measurement = 30
+        bulk_insert(Glucose, readings)
+        self.slider = slider(start, datetime(2023, 12, 31, tzinfo=dt_timezone.utc))
+
+    def test_no_graph_types(self):
+        self.assertEqual(update_graph(None, self.slider, request=self.request), [])
+
+    def test_glucose_graph_is_downsampled(self):
+        fieldset = update_graph(['Glucose'], self.slider, request=self.request)
+        graph = fieldset.children[1].children[0]
+        self.assertEqual(graph.id, 'glucose-graph')
+        traces = graph.figure['data']
+        self.assertEqual(len(traces), 2)
+        for trace in traces:
+            self.assertLessEqual(len(trace['y']), 2 * GRAPH_WIDTH)
+        self.assertIn(30, traces[1]['y'])
+
+    def test_short_range_reads_raw_rows(self):
+        short_slider = slider(datetime(2023, 1, 1, tzinfo=dt_timezone.utc), datetime(2023, 1, 8, tzinfo=dt_timezone.utc))
+        fieldset = update_graph(['Glucose'], short_slider, request=self.request)
+        traces = fieldset.children[1].children[0].figure['data']
+        self.assertEqual(sum(len(trace['y']) for trace in traces), 7 * 288 + 1)
+
+    def test_blood_graphs(self):
+        Blood.objects.create(patient=self.data.patient, systolic_pressure=120, diastolic_pressure=80, pulse_rate=60,
+                             measurement_date=datetime(2023, 2, 1, tzinfo=dt_timezone.utc))
+        fieldset = update_graph(['Sys', 'Dia', 'Pulse'], self.slider, request=self.request)
+        self.assertEqual([graph.id for graph in fieldset.children[1].children],
+                         ['systolic-graph', 'diastolic-graph', 'pulse-graph'])
+
+    def test_process_and_inline_renderers_match(self):
+        figures = {}
+        for renderer in ['process', 'inline']:
+            cache.get_cache().clear()
+            with override_settings(FIGURE_RENDERER=renderer):
+                fieldset = update_graph(['Glucose', 'Pulse'], self.slider, request=self.request)
+            figures[renderer] = [graph.figure for graph in fieldset.children[1].children]
+        self.assertEqual(figures['process'], figures['inline'])
+
+    def test_broken_render_pool_is_replaced(self):
+        broken = get_render_executor()
+        with self.assertRaises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+
+        with override_settings(FIGURE_RENDERER='process'):
+            fieldset = update_graph(['Glucose'], self.slider, request=self.request)
+        self.assertEqual([graph.id for graph in fieldset.children[1].children], ['glucose-graph'])
+        self.assertIsNot(get_render_executor(), broken)
+
+
+class TestMeasurementCache(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.data = DataProvider()
+        self.request = SimpleNamespace(session={'patient_id': self.data.patient.id})
+        self.slider = slider(datetime(2023, 3, 1, tzinfo=dt_timezone.utc), datetime(2023, 3, 10, tzinfo=dt_timezone.utc))
+        self.glucose = Glucose.objects.create(patient=self.data.patient, measurement=100,
+                                              measurement_date=datetime(2023, 3, 2, tzinfo=dt_timezone.utc))
+
+    def test_repeated_callbacks_skip_database(self):
+        update_data_statistics(self.slider, ['Glucose', 'Sys'], request=self.request)
+        update_graph(['Glucose'], self.slider, request=self.request)
+        with self.assertNumQueries(0):
+            result = update_data_statistics(self.slider, ['Glucose', 'Sys'], request=self.request)
+            update_graph(['Glucose'], self.slider, request=self.request)
+        self.assertEqual(result[0]['mean'], 100)
+
+    def test_only_missing_series_are_loaded(self):
+        update_data_statistics(self.slider, ['Glucose'], request=self.request)
+        with self.assertNumQueries(1):
+            result = update_data_statistics(self.slider, ['Glucose', 'Pulse'], request=self.request)
+        self.assertEqual([row['type'] for row in result], ['GLU'])
+
+    def test_save_and_delete_invalidate(self):
+        update_data_statistics(self.slider, ['Glucose'], request=self.request)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Glucose.objects.create(patient=self.data.patient, measurement=200,
+                                   measurement_date=datetime(2023, 3, 3, tzinfo=dt_timezone.utc))
+        self.assertEqual(update_data_statistics(self.slider, ['Glucose'], request=self.request)[0]['mean'], 150)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.glucose.delete()
+        self.assertEqual(update_data_statistics(self.slider, ['Glucose'], request=self.request)[0]['mean'], 200)
+
+    def test_bulk_insert_invalidates(self):
+        update_data_statistics(self.slider, ['Sys'], request=self.request)
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_insert(Blood, [Blood(patient=self.data.patient, systolic_pressure=130, diastolic_pressure=80,
+                                      pulse_rate=60, measurement_date=datetime(2023, 3, 4, tzinfo=dt_timezone.utc))])
+        self.assertEqual(update_data_statistics(self.slider, ['Sys'], request=self.request)[0]['max'], 130)
+
+    def test_invalidation_waits_for_commit(self):
+        update_data_statistics(self.slider, ['Glucose'], request=self.request)
+        with self.captureOnCommitCallbacks(execute=True):
+            Glucose.objects.create(patient=self.data.patient, measurement=200,
+                                   measurement_date=datetime(2023, 3, 3, tzinfo=dt_timezone.utc))
+            # Nothing read inside the transaction survives the commit
+            version = cache.get_version(self.data.patient.id)
+            update_data_statistics(self.slider, ['Glucose'], request=self.request)
+        self.assertNotEqual(cache.get_version(self.data.patient.id), version)
+
+
+class TestDateControls(SimpleTestCase):
+    def test_slider_range_matches_daily_range(self):
+        for start, end in [(2000, 2000), (2003, 2004), (2000, 2024)]:
+            daterange = pd.date_range(start=f'1-1-{start}', end=f'31-12-{end}', freq='1D')
+            step = len(daterange) // 5
+            marks = {unix_time_millis(day): day.strftime('%Y-%m-%d')
+                     for i, day in enumerate(daterange) if i % step == 1}
+            minimum, maximum, result = slider_range(start, end)
+            self.assertEqual((minimum, maximum), (unix_time_millis(daterange.min()), unix_time_millis(daterange.max())))
+            self.assertEqual(result, marks)
+
+    def test_update_slider(self):
+        self.assertIs(update_slider(None, None), no_update)
+        slider = update_slider(2010, 2012)
+        self.assertEqual(slider.value, [slider.min, slider.max])
+        self.assertEqual(list(slider.marks.values())[0], '2010-01-02')
+        self.assertEqual(update_slider(2010, None).max, slider_range(2010, timezone.now().year)[1])
+
+    def test_layout_and_dates_are_memoized(self):
+        self.assertIs(app.layout(), app.layout())
+        self.assertEqual(get_dates(2020), list(range(2020, timezone.now().year + 1)))
+        self.assertEqual(update_end_date(2020), (get_dates(2020), False))
@@ -0,0 +1,197 @@
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from diaweb import jobs
+from diaweb.models import Job
+from diaweb.tests.tests_models import DataProvider
+
+calls = []
+
+
+def record(value):
+    calls.append(value)
+    jobs.set_progress(0.5, 'halfway')
+    return {'value': value, 'progress': Job.objects.get(task='record').progress}
+
+
+def flaky():
+    raise RuntimeError('flaky')
+
+
+class JobTestMixin:
+    def setUp(self):
+        super().setUp()
+        calls.clear()
+        jobs.task(record)
+        jobs.task(flaky, max_attempts=2)
+        self.addCleanup(jobs.TASKS.pop, 'record')
+        self.addCleanup(jobs.TASKS.pop, 'flaky')
+        # Closing obsolete connections would end the transaction wrapping every test
+        patcher = mock.patch('diaweb.jobs.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestJobQueue(JobTestMixin, TestCase):
+    def test_work_runs_jobs(self):
+        job = jobs.enqueue('record', value=3)
+        self.assertEqual(jobs.work('test', once=True), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'value': 3, 'progress': 0.5})
+        self.assertEqual((job.progress, job.message, job.attempts, job.worker), (1, 'halfway', 1, 'test'))
+        self.assertEqual(calls, [3])
+
+    def test_claim_order(self):
+        low = jobs.enqueue('record', value=1)
+        high = jobs.enqueue('record', priority=5, value=2)
+        later = jobs.enqueue('record', priority=9, run_after=timezone.now() + timedelta(hours=1), value=3)
+
+        self.assertEqual(jobs.claim('test'), high)
+        self.assertEqual(jobs.claim('test'), low)
+        self.assertIsNone(jobs.claim('test'))
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.QUEUED)
+
+    def test_claimed_job_is_not_claimed_again(self):
+        job = jobs.enqueue('record', value=1)
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING)
+        self.assertIsNone(jobs.claim('test'))
+
+    def test_retries_with_backoff(self):
+        job = jobs.enqueue('flaky')
+        jobs.work('test', once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('RuntimeError: flaky', job.error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.work('test', once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            jobs.enqueue('missing')
+
+    def test_arguments_are_checked_when_queued(self):
+        with self.assertRaises(TypeError):
+            jobs.enqueue('record', valu=1)
+        with self.assertRaises(ValueError):
+            jobs.enqueue('export_columnar', directory='../outside')
+        self.assertFalse(Job.objects.exists())
+
+    def test_paths_are_confined_to_root(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        os.symlink('/', os.path.join(root.name, 'escape'))
+        with override_settings(JOB_FILES_ROOT=root.name):
+            resolved = os.path.realpath(root.name)
+            self.assertEqual(jobs.resolve_path('logs/bp.csv'), os.path.join(resolved, 'logs', 'bp.csv'))
+            self.assertEqual(jobs.resolve_path(os.path.join(root.name, 'bp.csv')), os.path.join(resolved, 'bp.csv'))
+            for path in ['/etc/passwd', '../bp.csv', 'logs/../../bp.csv', 'escape/etc/passwd']:
+                with self.assertRaises(ValueError, msg=path):
+                    jobs.resolve_path(path)
+
+            with open(os.path.join(root.name, 'bp.csv'), 'w') as file:
+                file.write('Measurement Date,Time Zone,SYS,DIA,Pulse\n2021-05-07 11:04,UTC,135,81,77\n')
+            job = jobs.enqueue('import_measurements', path='bp.csv', patient=DataProvider().patient.pk)
+            jobs.work('test', once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.SUCCEEDED, {'imported': 1, 'skipped': 0}))
+
+    def test_requeue_stale(self):
+        job = jobs.enqueue('record', value=1)
+        jobs.claim('dead')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - jobs.STALE_AFTER * 2)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim('test'), job)
+
+    def test_stale_job_without_attempts_left_fails(self):
+        job = jobs.enqueue('record', max_attempts=1, value=1)
+        jobs.claim('dead')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - jobs.STALE_AFTER * 2)
+        self.assertEqual(jobs.requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(jobs.claim('test'))
+
+    def test_requeued_job_is_not_finished_by_previous_worker(self):
+        job = jobs.enqueue('record', value=1)
+        stale = jobs.claim('slow')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - jobs.STALE_AFTER * 2)
+        jobs.requeue_stale()
+        jobs.claim('test')
+
+        jobs.execute(stale)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (Job.RUNNING, 'test'))
+
+    def test_run_worker_command(self):
+        jobs.enqueue('record', value=1)
+        jobs.enqueue('classify_patients')
+        out = io.StringIO()
+        call_command('run_worker', once=True, stdout=out)
+        self.assertIn('Executed 2 jobs', out.getvalue())
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 2)
+
+
+class TestJobViewSet(JobTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = DataProvider()
+        self.admin = User.objects.create_superuser('admin', 'admin@test.com', '<PASSWORD>')
+
+    def test_create_returns_job_at_once(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(reverse('job-list'), {'task': 'record', 'kwargs': {'value': 7}, 'priority': 2},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], Job.QUEUED)
+        self.assertEqual(calls, [])
+
+        jobs.work('test', once=True)
+        response = self.client.get(reverse('job-detail', args=[response.data['id']]))
+        self.assertEqual(response.data['result']['value'], 7)
+
+    def test_unknown_task(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(reverse('job-list'), {'task': 'missing'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_arguments(self):
+        self.client.force_authenticate(user=self.admin)
+        for task, kwargs in [('record', {'valu': 7}), ('record', {}), ('record', [7]),
+                             ('export_columnar', {'directory': '/etc'}), ('import_measurements',
+                                                                         {'path': '../../etc/passwd', 'patient': 1})]:
+            response = self.client.post(reverse('job-list'), {'task': task, 'kwargs': kwargs}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, kwargs)
+            self.assertIn('kwargs', response.data)
+        self.assertFalse(Job.objects.exists())
+
+    def test_admin_only(self):
+        self.client.force_authenticate(user=self.data.user1)
+        response = self.client.post(reverse('job-list'), {'task': 'record'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_classify_patient(self):
+        self.client.force_authenticate(user=self.data.user1)
+        response = self.client.post(reverse('patient-classify', args=[self.data.patient.pk]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertEqual((job.task, job.kwargs), ('classify_patients', {'patients': [self.data.patient.pk]}))
@@ -0,0 +1,100 @@
+from datetime import datetime, timezone as dt_timezone
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from diaweb import metrics
+from diaweb.graphs import update_slider_output
+from diaweb.models import Patient
+from diaweb.tests.tests_models import DataProvider
+
+
+class MetricsTestMixin:
+    def setUp(self):
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode().splitlines()
+
+
+class TestMetricsMiddleware(MetricsTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = DataProvider()
+        self.client.force_authenticate(user=self.data.user1)
+
+    def test_request_profile(self):
+        self.client.get(reverse('patient-list'))
+        self.client.get(reverse('patient-list'))
+        lines = self.scrape()
+
+        self.assertIn('diaweb_request_seconds_count{view="patient-list"} 2', lines)
+        queries = [line for line in lines if line.startswith('diaweb_request_queries_sum{view="patient-list"}')]
+        self.assertEqual(len(queries), 1)
+        self.assertGreater(float(queries[0].split()[-1]), 0)
+        for name in ['sql', 'serializer', 'render']:
+            self.assertIn(f'diaweb_request_{name}_seconds_count{{view="patient-list"}} 2', lines)
+        self.assertIn('diaweb_request_queries_bucket{view="patient-list",le="+Inf"} 2', lines)
+
+    def test_disabled(self):
+        with override_settings(METRICS_ENABLED=False):
+            self.client.get(reverse('patient-list'))
+        self.assertFalse(any('view="patient-list"' in line for line in self.scrape()))
+
+    def test_only_local_scrapes(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_token_replaces_address_check(self):
+        self.client.force_authenticate(user=None)
+        url = reverse('metrics')
+        with override_settings(METRICS_TOKEN='secret'):
+            # Behind a reverse proxy every client is local
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code,
+                             status.HTTP_403_FORBIDDEN)
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret', REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            self.client.force_login(User.objects.create_user('staff', is_staff=True))
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+
+class TestProfile(MetricsTestMixin, TestCase):
+    def test_counts_queries(self):
+        DataProvider()
+        with metrics.profile() as result:
+            list(Patient.objects.all())
+            Patient.objects.count()
+        self.assertEqual(result.queries, 2)
+        self.assertGreater(result.sql_seconds, 0)
+
+    def test_dash_callback_histograms(self):
+        moment = int(datetime(2023, 1, 1, tzinfo=dt_timezone.utc).timestamp())
+        update_slider_output([moment, moment])
+        lines = self.scrape()
+        self.assertIn('diaweb_dash_callback_seconds_count{callback="update_slider_output"} 1', lines)
+        self.assertIn('diaweb_dash_callback_queries_bucket{callback="update_slider_output",le="0"} 1', lines)
+
+    def test_request_labelled_with_dash_callback(self):
+        moment = int(datetime(2023, 1, 1, tzinfo=dt_timezone.utc).timestamp())
+
+        def view(request):
+            request.resolver_match = SimpleNamespace(view_name='update-component')
+            update_slider_output([moment, moment])
+            return HttpResponse()
+
+        metrics.MetricsMiddleware(view)(RequestFactory().post('/'))
+        lines = self.scrape()
+        self.assertIn('diaweb_request_seconds_count{view="update-component",callback="update_slider_output"} 1',
+                      lines)
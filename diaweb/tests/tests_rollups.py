@@ -0,0 +1,80 @@
+import io
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.core.management import call_command
+from django.test import TestCase
+
+from diaweb import rollups
+from diaweb.ingest import bulk_insert
+from diaweb.models import Glucose, Blood, MeasurementRollup
+from diaweb.tests.tests_models import DataProvider
+
+START = datetime(2023, 5, 1, tzinfo=dt_timezone.utc)
+
+
+class TestMeasurementRollups(TestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.patient = self.data.patient
+
+    def rollup(self, series='GLU', resolution=rollups.DAY, bucket=START, measurement_type=0):
+        return MeasurementRollup.objects.get(patient=self.patient, series=series, resolution=resolution,
+                                             bucket=bucket, measurement_type=measurement_type)
+
+    def test_save_updates_rollups(self):
+        Glucose.objects.create(patient=self.patient, measurement=100, measurement_date=START + timedelta(hours=1))
+        Glucose.objects.create(patient=self.patient, measurement=140, measurement_date=START + timedelta(hours=2))
+
+        daily = self.rollup()
+        self.assertEqual((daily.count, daily.sum, daily.sum_squares, daily.min, daily.max),
+                         (2, 240, 100 ** 2 + 140 ** 2, 100, 140))
+        self.assertEqual(self.rollup(resolution=rollups.HOUR, bucket=START + timedelta(hours=2)).count, 1)
+
+    def test_update_moves_reading(self):
+        glucose = Glucose.objects.create(patient=self.patient, measurement=100, measurement_date=START)
+        glucose.measurement_date = START + timedelta(days=3)
+        glucose.save()
+
+        self.assertFalse(MeasurementRollup.objects.filter(bucket=START).exists())
+        self.assertEqual(self.rollup(bucket=START + timedelta(days=3)).count, 1)
+
+    def test_delete_updates_rollups(self):
+        Glucose.objects.create(patient=self.patient, measurement=100, measurement_date=START)
+        glucose = Glucose.objects.create(patient=self.patient, measurement=300, measurement_date=START)
+        glucose.delete()
+
+        self.assertEqual(self.rollup().max, 100)
+
+    def test_blood_series_and_bulk_insert(self):
+        bulk_insert(Blood, [Blood(patient=self.patient, systolic_pressure=120 + i, diastolic_pressure=80,
+                                  pulse_rate=60, measurement_date=START + timedelta(hours=i)) for i in range(30)],
+                    batch_size=7)
+
+        self.assertEqual(self.rollup(series='SYS').count, 24)
+        self.assertEqual(self.rollup(series='SYS', bucket=START + timedelta(days=1)).max, 149)
+        self.assertEqual(self.rollup(series='PUL').sum, 24 * 60)
+
+    def test_rebuild_command(self):
+        Glucose.objects.create(patient=self.patient, measurement=100, measurement_type=2, measurement_date=START)
+        MeasurementRollup.objects.all().delete()
+
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollup(measurement_type=2).sum, 100)
+        self.assertEqual(MeasurementRollup.objects.count(), 2)
+
+    def test_load_uses_raw_edges(self):
+        for i in range(48):
+            Glucose.objects.create(patient=self.patient, measurement=i, measurement_date=START + timedelta(hours=i))
+
+        loaded = rollups.load(self.patient.id, 'GLU', START + timedelta(hours=12), START + timedelta(hours=48),
+                              rollups.DAY)
+        # 12 raw readings of day one, the full second day as one bucket
+        self.assertEqual(len(loaded['count']), 12 + 1)
+        self.assertEqual(loaded['count'].sum(), 36)
+
+        statistics = rollups.describe(loaded)
+        values = np.arange(12, 48, dtype=float)
+        self.assertAlmostEqual(statistics['mean'], values.mean())
+        self.assertAlmostEqual(statistics['std'], values.std(ddof=1))
+        self.assertEqual((statistics['min'], statistics['max']), (12, 47))
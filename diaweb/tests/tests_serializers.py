@@ -6,7 +6,8 @@ from django.utils import timezone
 
 from diaweb.models import Address, Patient, Physician, Glucose, Blood
 from diaweb.serializers import AddressSerializer, UserSerializer, PatientSerializer, PhysicianSerializer, \
-    GlucoseSerializer, BloodSerializer
+    GlucoseSerializer, BloodSerializer, get_related_lookups
+from rest_framework import serializers
 from django.test import TestCase
 from rest_framework.exceptions import ValidationError as DRFValidationError
 
@@ -191,6 +192,8 @@ class TestPatientSerializer(TestCase):
         for field in tmp:
             if field == 'birthdate':
                 self.assertEqual(data[field], self.patient.__dict__[field].strftime('%Y-%m-%d'))
+            elif field == 'updated':
+                self.assertEqual(data[field], self.patient.__dict__[field].isoformat().replace('+00:00', 'Z'))
             else:
                 self.assertEqual(data[field], self.patient.__dict__[field])
 
@@ -369,4 +372,28 @@ class TestBloodSerializer(TestCase):
         }
         serializer = BloodSerializer(data=data)
         with self.assertRaises(DRFValidationError):
-            serializer.is_valid(raise_exception=True)
\ No newline at end of file
+            serializer.is_valid(raise_exception=True)
+
+
+class PhysicianPatientsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Physician
+        fields = ['id', 'patient']
+
+
+class TestRelatedLookups(TestCase):
+    def test_primary_key_many_field_is_prefetched(self):
+        self.assertEqual(get_related_lookups(PhysicianPatientsSerializer), ((), ('patient',)))
+
+        data = DataProvider()
+        for i in range(5):
+            physician = Physician.objects.create(user=User.objects.create(username=f'physician{i}'),
+                                                 specialty='General', phone='123')
+            physician.patient.add(data.patient)
+
+        select, prefetch = get_related_lookups(PhysicianPatientsSerializer)
+        with self.assertNumQueries(2):
+            rows = PhysicianPatientsSerializer(Physician.objects.select_related(*select).prefetch_related(*prefetch),
+                                               many=True).data
+        self.assertEqual(len(rows), Physician.objects.count())
+        self.assertTrue(all(data.patient.pk in row['patient'] for row in rows[-5:]))
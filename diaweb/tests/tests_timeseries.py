@@ -0,0 +1,155 @@
+import io
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from diaweb import cache, timeseries
+from diaweb.graphs import update_data_statistics, update_graph
+from diaweb.ingest import bulk_insert
+from diaweb.models import Glucose, Blood
+from diaweb.tests.tests_models import DataProvider
+
+START = datetime(2023, 6, 1, tzinfo=dt_timezone.utc)
+
+
+class TestTimeSeriesStore(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = timeseries.TimeSeriesStore(directory.name)
+        patcher = mock.patch('diaweb.timeseries.BLOCK_SIZE', 16)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_range_over_many_blocks(self):
+        times = np.arange(0, 1000, 3)
+        for chunk in np.array_split(np.arange(len(times)), 7):
+            self.store.append(1, 'GLU', times[chunk], times[chunk] / 10, chunk % 7)
+
+        self.assertEqual(self.store.count(1, 'GLU'), len(times))
+        index = self.store._index(self.store._resolve(1, 'GLU'), len(times))
+        self.assertEqual(len(index), -(-len(times) // 16))
+        for start, end in [(0, 999), (100, 200), (101, 101), (-50, 5), (998, 5000), (400, 300)]:
+            found, values, types = self.store.range(1, 'GLU', start, end)
+            expected = times[(times >= start) & (times <= end)]
+            np.testing.assert_array_equal(found, expected)
+            np.testing.assert_allclose(values, expected / 10, rtol=1e-6)
+
+        self.assertIsInstance(self.store.range(1, 'GLU', 0, 100)[0], np.memmap)
+
+    def test_duplicate_timestamps_across_blocks(self):
+        times = np.repeat(np.arange(10), 5)
+        self.store.append(1, 'SYS', times, np.arange(len(times)))
+        found, _, _ = self.store.range(1, 'SYS', 3, 6)
+        self.assertEqual(len(found), 20)
+
+    def test_out_of_order_append_is_merged(self):
+        self.store.append(1, 'GLU', [10, 20, 30], [1, 2, 3])
+        self.store.append(1, 'GLU', [15, 40], [4, 5])
+        found, values, _ = self.store.range(1, 'GLU')
+        self.assertEqual(found.tolist(), [10, 15, 20, 30, 40])
+        self.assertEqual(values.tolist(), [1, 4, 2, 3, 5])
+
+    def test_partial_append_is_not_visible(self):
+        self.store.append(1, 'GLU', np.arange(20), np.arange(20))
+        # An append interrupted after its first column
+        with open(self.store.path(1, 'GLU', 'times'), 'ab') as file:
+            file.write(np.arange(20, 30, dtype='<i8').tobytes())
+        self.assertEqual(self.store.count(1, 'GLU'), 20)
+        self.assertEqual(len(self.store.range(1, 'GLU', 0, 100)[1]), 20)
+
+        self.store.append(1, 'GLU', [40], [40])
+        found, values, _ = self.store.range(1, 'GLU')
+        self.assertEqual(found.tolist(), list(range(20)) + [40])
+        self.assertEqual(values.tolist(), list(range(20)) + [40])
+
+    def test_rewrite_keeps_readers_on_previous_version(self):
+        self.store.append(1, 'GLU', [10, 20], [1, 2])
+        _, before, _ = self.store.range(1, 'GLU')
+        self.store.write(1, 'GLU', [5], [9])
+        self.store.delete(1, 'GLU')
+        self.assertEqual(before.tolist(), [1, 2])
+        self.assertEqual(self.store.count(1, 'GLU'), 0)
+
+        # Only the current and previous versions are kept
+        self.store.write(1, 'GLU', [7], [3])
+        generations = [name for name in os.listdir(os.path.join(self.store.root, '1')) if '.gen-' in name]
+        self.assertEqual(len(generations), 2)
+        self.assertEqual(self.store.range(1, 'GLU')[1].tolist(), [3])
+
+    def test_writers_of_a_series_are_serialized(self):
+        writer = threading.Thread(target=self.store.append, args=(1, 'GLU', [10], [1]))
+        with self.store.lock(1, 'GLU'):
+            writer.start()
+            writer.join(0.2)
+            self.assertTrue(writer.is_alive())
+            self.assertEqual(self.store.count(1, 'GLU'), 0)
+        writer.join()
+        self.assertEqual(self.store.count(1, 'GLU'), 1)
+
+    def test_missing_series(self):
+        found, values, types = self.store.range(5, 'PUL', 0, 10)
+        self.assertEqual((len(found), len(values), len(types)), (0, 0, 0))
+
+
+class TestTimeSeriesAdapter(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(MEASUREMENT_STORE='timeseries', TIMESERIES_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        cache.get_cache().clear()
+        self.data = DataProvider()
+        self.request = SimpleNamespace(session={'patient_id': self.data.patient.id})
+        self.slider = [int(START.timestamp()), int((START + timedelta(days=3)).timestamp())]
+
+    def test_writes_are_mirrored_and_read_back(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_insert(Glucose, [Glucose(patient=self.data.patient, measurement=100 + i, measurement_type=1,
+                                          measurement_date=START + timedelta(minutes=5 * i)) for i in range(500)])
+            Blood.objects.create(patient=self.data.patient, systolic_pressure=125, diastolic_pressure=85,
+                                 pulse_rate=70, measurement_date=START)
+
+        store = timeseries.get_store()
+        self.assertEqual(store.count(self.data.patient.id, 'GLU'), 500)
+        self.assertEqual(store.range(self.data.patient.id, 'DIA')[1].tolist(), [85])
+
+        # Nothing is read from the relational tables
+        with self.assertNumQueries(0):
+            result = update_data_statistics(self.slider, ['Glucose', 'Sys'], request=self.request)
+            update_graph(['Glucose'], self.slider, request=self.request)
+        self.assertEqual([row['count'] for row in result], [500, 1])
+        self.assertAlmostEqual(result[0]['mean'], 349.5)
+
+    def test_delete_rewrites_series(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            glucose = Glucose.objects.create(patient=self.data.patient, measurement=100, measurement_date=START)
+            Glucose.objects.create(patient=self.data.patient, measurement=200, measurement_date=START)
+            glucose.delete()
+        self.assertEqual(timeseries.get_store().range(self.data.patient.id, 'GLU')[1].tolist(), [200])
+
+    def test_rolled_back_writes_are_not_mirrored(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                bulk_insert(Glucose, [Glucose(patient=self.data.patient, measurement=100, measurement_date=START)])
+                raise RuntimeError
+            Glucose.objects.create(patient=self.data.patient, measurement=200, measurement_date=START)
+        self.assertEqual(timeseries.get_store().range(self.data.patient.id, 'GLU')[1].tolist(), [200])
+
+    def test_rebuild_command(self):
+        with override_settings(MEASUREMENT_STORE='relational'):
+            Glucose.objects.create(patient=self.data.patient, measurement=150, measurement_date=START)
+        self.assertEqual(timeseries.get_store().count(self.data.patient.id, 'GLU'), 0)
+
+        call_command('rebuild_timeseries', stdout=io.StringIO())
+        self.assertEqual(timeseries.get_store().range(self.data.patient.id, 'GLU')[1].tolist(), [150])
@@ -0,0 +1,344 @@
+import json
+import threading
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, resolve
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from diaweb.models import Glucose, Blood, Patient, Physician, Address, Appointment, Reception
+from diaweb.tests.tests_models import DataProvider
+
+
+class TestMeasurementBulkCreate(APITestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.client.force_authenticate(user=self.data.user1)
+        self.glucose_url = reverse('glucose-bulk')
+        self.blood_url = reverse('blood-bulk')
+
+    def glucose_rows(self, count):
+        return [{'patient': self.data.patient.id, 'measurement': 100 + i, 'measurement_type': i % 7,
+                 'measurement_date': f'2023-01-01T{i % 24:02d}:00'} for i in range(count)]
+
+    def test_bulk_create_json_array(self):
+        response = self.client.post(self.glucose_url, self.glucose_rows(50), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 50)
+        self.assertEqual(response.data['errors'], [])
+        self.assertEqual(Glucose.objects.filter(patient=self.data.patient).count(), 50)
+
+    def test_bulk_create_ndjson(self):
+        body = '\n'.join(json.dumps(row) for row in self.glucose_rows(5))
+        response = self.client.post(self.glucose_url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Glucose.objects.count(), 5)
+
+    def test_bulk_create_reports_row_errors(self):
+        rows = self.glucose_rows(3)
+        rows[1]['measurement'] = -5
+        rows[2]['patient'] = 999
+        response = self.client.post(self.glucose_url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('measurement', response.data['errors'][0]['errors'])
+        self.assertIn('patient', response.data['errors'][1]['errors'])
+
+    def test_bulk_create_all_invalid(self):
+        response = self.client.post(self.glucose_url, [{'measurement': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Glucose.objects.count(), 0)
+
+    def test_bulk_create_requires_list(self):
+        response = self.client.post(self.glucose_url, self.glucose_rows(1)[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_resolves_patients_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.blood_url, [{'patient': self.data.patient.id, 'systolic_pressure': 120,
+                                               'diastolic_pressure': 80, 'pulse_rate': 60}] * 20, format='json')
+        self.assertEqual(Blood.objects.count(), 20)
+        self.assertEqual(len([query for query in queries if 'FROM "diaweb_patient"' in query['sql']]), 1)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT INTO "diaweb_blood"')]), 1)
+
+
+class TestMeasurementPagination(APITestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.client.force_authenticate(user=self.data.user1)
+        self.other = Patient.objects.create(user=self.data.user2, birthdate=date(1990, 1, 1), sex='F')
+        start = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        # pairs of readings share a timestamp so the id breaks ties between pages
+        Glucose.objects.bulk_create([Glucose(patient=self.data.patient, measurement=i,
+                                             measurement_date=start + timedelta(hours=i // 2)) for i in range(25)])
+        Glucose.objects.create(patient=self.other, measurement=1, measurement_date=start)
+        self.url = reverse('glucose-list')
+
+    def fetch_all(self, url):
+        results, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results.extend(response.data['results'])
+            url, pages = response.data['next'], pages + 1
+        return results, pages
+
+    def test_pages_cover_all_rows_in_order(self):
+        results, pages = self.fetch_all(f'{self.url}?patient={self.data.patient.id}&page_size=4')
+        self.assertEqual(pages, 7)
+        self.assertEqual([row['measurement'] for row in results], list(range(25)))
+
+    def test_date_range_filter(self):
+        response = self.client.get(self.url, {'patient': self.data.patient.id, 'page_size': 100,
+                                              'start': '2023-01-01T02:00:00Z', 'end': '2023-01-01T03:00:00'})
+        self.assertEqual([row['measurement'] for row in response.data['results']], [4, 5, 6, 7])
+        self.assertIsNone(response.data['next'])
+
+    def test_page_size_is_capped(self):
+        response = self.client.get(self.url, {'page_size': 10_000})
+        self.assertEqual(len(response.data['results']), 26)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(self.url, {'start': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'patient': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_deep_page_uses_keyset(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'cursor': 'MjAyMy0wMS0wMVQxMDowMDowMCswMDowMHwyMA=='})
+        sql = next(query['sql'] for query in queries if 'FROM "diaweb_glucose"' in query['sql'])
+        self.assertNotIn('OFFSET', sql)
+
+
+class TestListQueryCounts(APITestCase):
+    """
+    List endpoints must not issue a query per nested object.
+    """
+    count = 15
+
+    def setUp(self):
+        self.data = DataProvider()
+        self.client.force_authenticate(user=self.data.user1)
+        for i in range(self.count):
+            address = Address.objects.create(country='Country', state='State', city='City', zip_code='00000',
+                                             street='Street', number=str(i))
+            patient = Patient.objects.create(user=User.objects.create(username=f'patient{i}', email=f'p{i}@test.com'),
+                                             birthdate=date(1990, 1, 1), sex='F', address=address)
+            physician = Physician.objects.create(user=User.objects.create(username=f'physician{i}',
+                                                                          email=f'd{i}@test.com'),
+                                                 specialty='General', phone='123', address=address)
+            Appointment.objects.create(patient=patient, physician=physician,
+                                       date=datetime(2024, 1, 1 + i, tzinfo=dt_timezone.utc))
+
+    def assertListQueries(self, url, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_api_list_endpoints(self):
+        for name in ['patient-list', 'physician-list', 'appointment-list']:
+            with self.subTest(name=name):
+                self.assertListQueries(reverse(name), 1)
+
+    def test_web_list_endpoints(self):
+        for name in ['web-patient-list', 'web-physician-list']:
+            with self.subTest(name=name):
+                self.assertListQueries(reverse(name), 1)
+
+
+class TestWebUserPages(APITestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.client.force_authenticate(user=self.data.user1)
+        self.url = reverse('web-patient-detail', kwargs={'pk': self.data.patient.pk})
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content.decode(), len(queries)
+
+    def test_detail_loads_object_once(self):
+        _, queries = self.get(self.url)
+        self.assertEqual(queries, 1)
+
+    def test_detail_fragment_is_cached_until_save(self):
+        with mock.patch.object(Patient, 'get_details', autospec=True, return_value='first details') as get_details:
+            first, _ = self.get(self.url)
+            get_details.return_value = 'second details'
+            cached, _ = self.get(self.url)
+            self.assertEqual(get_details.call_count, 1)
+            self.assertIn('first details', cached)
+
+            self.data.patient.save()
+            refreshed, _ = self.get(self.url)
+        self.assertIn('second details', refreshed)
+
+    def test_user_and_address_saves_refresh_pages(self):
+        first, _ = self.get(self.url)
+        user = self.data.patient.user
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertIn('Renamed', self.get(self.url)[0])
+
+        address = Address.objects.create(country='Country', state='State', city='City', zip_code='00000',
+                                          street='Street', number='1')
+        self.data.patient.address = address
+        self.data.patient.save()
+        address.city = 'Elsewhere'
+        address.save()
+        self.assertIn('Elsewhere', self.get(self.url)[0])
+
+    def test_list_items_are_cached_until_save(self):
+        url = reverse('web-physician-list')
+        self.assertIn('General Physician', self.get(url)[0])
+        Physician.objects.filter(pk=self.data.physician.pk).update(specialty='Diabetology')
+        self.assertIn('General Physician', self.get(url)[0])
+        self.data.physician.refresh_from_db()
+        self.data.physician.save()
+        self.assertIn('Diabetology', self.get(url)[0])
+
+
+class TestMeasurementExport(APITestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.client.force_authenticate(user=self.data.user1)
+        start = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        Blood.objects.bulk_create([Blood(patient=self.data.patient, systolic_pressure=100 + i, diastolic_pressure=70,
+                                         pulse_rate=60, measurement_date=start + timedelta(hours=i)) for i in range(30)])
+        self.url = reverse('blood-export')
+
+    def test_json_array_export(self):
+        response = self.client.get(self.url, {'patient': self.data.patient.id})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([row['systolic_pressure'] for row in rows], list(range(100, 130)))
+
+    def test_ndjson_export(self):
+        response = self.client.get(self.url, {'format': 'ndjson', 'end': '2023-01-01T04:00:00Z'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['systolic_pressure'] for line in lines], [100, 101, 102, 103, 104])
+
+    def test_empty_export(self):
+        response = self.client.get(self.url, {'patient': 999})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+    async def test_async_export(self):
+        await self.async_client.aforce_login(self.data.user1)
+        response = await self.async_client.get(self.url, {'format': 'ndjson', 'end': '2023-01-01T02:00:00Z'})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([json.loads(line)['systolic_pressure'] for line in content.decode().splitlines()],
+                         [100, 101, 102])
+
+
+class TestDashUpdateOffload(TransactionTestCase):
+    # The callback reads the session from a pool thread, which cannot see into the
+    # write transaction a TestCase wraps around every test
+    def test_callback_runs_on_figure_pool(self):
+        url = '/django_plotly_dash/app/MeasurementsAnalysis/_dash-update-component'
+        self.assertTrue(iscoroutinefunction(resolve(url).func))
+
+        threads = []
+        def record_thread(value):
+            threads.append(threading.current_thread().name)
+            return datetime.fromtimestamp(value / 1000, dt_timezone.utc).date()
+
+        body = {'output': 'slider-output.children', 'outputs': {'id': 'slider-output', 'property': 'children'},
+                'inputs': [{'id': 'date-slider', 'property': 'value', 'value': [0, 86400000]}],
+                'changedPropIds': ['date-slider.value']}
+        with mock.patch('diaweb.graphs.unix_to_datetime', side_effect=record_thread):
+            response = self.client.post(url, body, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('End date: 1970-01-02', response.content.decode())
+        self.assertTrue(threads and all(name.startswith('figure') for name in threads))
+
+
+class TestPhysicianAvailability(APITestCase):
+    def setUp(self):
+        self.data = DataProvider()
+        self.client.force_authenticate(user=self.data.user1)
+        self.url = reverse('physician-availability')
+        # Monday
+        self.monday = date(2030, 1, 7)
+        Reception.objects.create(physician=self.data.physician, day='1', start_time=time(9), end_time=time(11))
+        Reception.objects.create(physician=self.data.physician, day='3', start_time=time(12), end_time=time(13))
+
+    def get(self, **params):
+        return self.client.get(self.url, {'start': self.monday.isoformat(), 'end': self.monday.isoformat(), **params})
+
+    def test_slots_of_reception_window(self):
+        response = self.get(physician=self.data.physician.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['slot_minutes'], 30)
+        self.assertEqual(response.data['physicians'][0]['slots'], ['2030-01-07T09:00:00Z', '2030-01-07T09:30:00Z',
+                                                                   '2030-01-07T10:00:00Z', '2030-01-07T10:30:00Z'])
+
+    def test_booked_appointments_block_overlapping_slots(self):
+        Appointment.objects.create(patient=self.data.patient, physician=self.data.physician,
+                                   date=datetime(2030, 1, 7, 9, 45, tzinfo=dt_timezone.utc))
+        response = self.get(physician=self.data.physician.id)
+        self.assertEqual(response.data['physicians'][0]['slots'], ['2030-01-07T09:00:00Z', '2030-01-07T10:30:00Z'])
+
+    def test_appointments_block_slots_for_their_own_duration(self):
+        Appointment.objects.create(patient=self.data.patient, physician=self.data.physician,
+                                   date=datetime(2030, 1, 7, 9, tzinfo=dt_timezone.utc), duration=timedelta(hours=1))
+        Appointment.objects.create(patient=self.data.patient, physician=self.data.physician,
+                                   date=datetime(2030, 1, 7, 10, 15, tzinfo=dt_timezone.utc),
+                                   duration=timedelta(minutes=15))
+        response = self.get(physician=self.data.physician.id, slot=15)
+        self.assertEqual(response.data['physicians'][0]['slots'], ['2030-01-07T10:00:00Z', '2030-01-07T10:30:00Z',
+                                                                   '2030-01-07T10:45:00Z'])
+        response = self.get(physician=self.data.physician.id, slot=60)
+        self.assertEqual(response.data['physicians'][0]['slots'], [])
+
+    def test_range_slot_length_and_limit(self):
+        response = self.get(physician=self.data.physician.id, end=(self.monday + timedelta(days=9)).isoformat(),
+                            slot=60)
+        self.assertEqual(response.data['physicians'][0]['slots'], [
+            '2030-01-07T09:00:00Z', '2030-01-07T10:00:00Z', '2030-01-09T12:00:00Z',
+            '2030-01-14T09:00:00Z', '2030-01-14T10:00:00Z', '2030-01-16T12:00:00Z'])
+
+        response = self.get(physician=self.data.physician.id, limit=1)
+        self.assertEqual(response.data['physicians'][0]['slots'], ['2030-01-07T09:00:00Z'])
+
+    def test_past_slots_are_excluded(self):
+        with mock.patch('django.utils.timezone.now',
+                        return_value=datetime(2030, 1, 7, 10, 15, tzinfo=dt_timezone.utc)):
+            response = self.get(physician=self.data.physician.id)
+        self.assertEqual(response.data['physicians'][0]['slots'], ['2030-01-07T10:30:00Z'])
+
+    def test_specialty_searches_many_physicians_in_constant_queries(self):
+        for index in range(20):
+            physician = Physician.objects.create(
+                user=User.objects.create_user(username=f'physician{index}'), specialty='Diabetology', phone='1')
+            Reception.objects.create(physician=physician, day='1', start_time=time(8), end_time=time(9))
+            Appointment.objects.create(patient=self.data.patient, physician=physician,
+                                       date=datetime(2030, 1, 7, 8, tzinfo=dt_timezone.utc))
+
+        with self.assertNumQueries(3):
+            response = self.get(specialty='diabetology')
+        self.assertEqual(len(response.data['physicians']), 20)
+        self.assertTrue(all(entry['slots'] == ['2030-01-07T08:30:00Z'] for entry in response.data['physicians']))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        for params in [{'physician': 'x'}, {'start': '2030-13-01'}, {'end': '2029-12-31'},
+                       {'end': '2030-12-31'}, {'slot': '1'}, {'limit': '0'}]:
+            response = self.get(**{'physician': self.data.physician.id, **params})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.get(physician=self.data.physician.id).status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,316 @@
+"""
+Append-only, memory-mapped time series store for high frequency measurements.
+
+Every patient and series has a directory of fixed width column files::
+
+    <root>/<patient_id>/<series>/times.i64    int64 epoch seconds, sorted
+                                 values.f32   float32 measurement value
+                                 types.u8     uint8 Glucose measurement_type
+                                 index.i64    first timestamp of every BLOCK_SIZE rows
+
+Range lookups binary search the small index file first and then only the single
+block of ``times`` it points to, and return ``numpy.memmap`` slices of the columns.
+
+Writers of a series hold an exclusive ``flock`` on ``<patient_id>/.<series>.lock``
+and append the columns before the index, readers take no lock and only see the
+rows present in every column and covered by the index. ``<series>`` is a symlink
+to a ``.<series>.gen-*`` directory, rewrites fill a new one and replace the link
+so readers never see a partial series. The previous directory is kept for readers
+still mapping it and removed by the next rewrite.
+"""
+import fcntl
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from diaweb.models import Glucose, Blood
+
+BLOCK_SIZE = 4096
+
+FILES = {
+    'times': ('times.i64', np.dtype('<i8')),
+    'values': ('values.f32', np.dtype('<f4')),
+    'types': ('types.u8', np.dtype('u1')),
+}
+INDEX_FILE = 'index.i64'
+
+# Series -> (model, field)
+SERIES_FIELDS = {
+    'GLU': (Glucose, 'measurement'),
+    'SYS': (Blood, 'systolic_pressure'),
+    'DIA': (Blood, 'diastolic_pressure'),
+    'PUL': (Blood, 'pulse_rate'),
+}
+
+
+def _columns(times, values, types=None):
+    times = np.asarray(times, dtype=FILES['times'][1])
+    values = np.asarray(values, dtype=FILES['values'][1])
+    types = np.zeros(len(times), dtype=FILES['types'][1]) if types is None \
+        else np.asarray(types, dtype=FILES['types'][1])
+    order = np.argsort(times, kind='stable')
+    return times[order], values[order], types[order]
+
+
+def _blocks(rows):
+    return -(-rows // BLOCK_SIZE)
+
+
+class TimeSeriesStore:
+    def __init__(self, root):
+        self.root = str(root)
+
+    def directory(self, patient_id, series):
+        return os.path.join(self.root, str(patient_id), series)
+
+    def path(self, patient_id, series, column):
+        return os.path.join(self.directory(patient_id, series), FILES[column][0])
+
+    def patients(self, series):
+        """
+        Patients with a stored ``series``.
+        """
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name) for name in names
+                      if name.isdigit() and os.path.lexists(self.directory(name, series)))
+
+    @contextmanager
+    def lock(self, patient_id, series):
+        """
+        Exclusive lock of one series, across threads and processes.
+        """
+        directory = os.path.join(self.root, str(patient_id))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'.{series}.lock'), 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _resolve(self, patient_id, series):
+        # Readers stay on one generation even if a rewrite replaces the link meanwhile
+        return os.path.realpath(self.directory(patient_id, series))
+
+    def _rows(self, directory):
+        try:
+            sizes = [os.path.getsize(os.path.join(directory, name)) // dtype.itemsize
+                     for name, dtype in FILES.values()]
+            indexed = os.path.getsize(os.path.join(directory, INDEX_FILE)) // FILES['times'][1].itemsize
+        except FileNotFoundError:
+            return 0
+        return min(sizes + [indexed * BLOCK_SIZE])
+
+    def count(self, patient_id, series):
+        return self._rows(self._resolve(patient_id, series))
+
+    def _column(self, directory, column, rows):
+        name, dtype = FILES[column]
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(directory, name), dtype=dtype, mode='r', shape=(rows,))
+
+    def _index(self, directory, rows):
+        dtype = FILES['times'][1]
+        if rows == 0:
+            return np.empty(0, dtype=dtype)
+        return np.fromfile(os.path.join(directory, INDEX_FILE), dtype=dtype, count=_blocks(rows))
+
+    def _write(self, directory, rows, times, values, types):
+        """
+        Appends sorted columns after the first ``rows`` of ``directory``. Leftovers of
+        an interrupted append beyond ``rows`` are cut off first.
+        """
+        for column, array in [('times', times), ('values', values), ('types', types)]:
+            name, dtype = FILES[column]
+            with open(os.path.join(directory, name), 'ab') as file:
+                file.truncate(rows * dtype.itemsize)
+                file.write(array.tobytes())
+
+        # First timestamp of every block started by the appended rows, written last
+        starts = np.arange(-rows % BLOCK_SIZE, len(times), BLOCK_SIZE)
+        with open(os.path.join(directory, INDEX_FILE), 'ab') as file:
+            file.truncate(_blocks(rows) * FILES['times'][1].itemsize)
+            file.write(times[starts].tobytes())
+
+    def append(self, patient_id, series, times, values, types=None):
+        """
+        Appends readings sorted by time. Readings older than the last stored one are
+        merged into place with a rewrite of the series, which is the slow path.
+        """
+        times, values, types = _columns(times, values, types)
+        if len(times) == 0:
+            return
+
+        with self.lock(patient_id, series):
+            directory = self._resolve(patient_id, series)
+            rows = self._rows(directory)
+            if rows and times[0] >= self._column(directory, 'times', rows)[-1]:
+                self._write(directory, rows, times, values, types)
+                return
+
+            stored = [np.array(self._column(directory, column, rows)) for column in FILES]
+            with self._rewrite(patient_id, series) as write:
+                write(np.concatenate([stored[0], times]), np.concatenate([stored[1], values]),
+                      np.concatenate([stored[2], types]))
+
+    @contextmanager
+    def _rewrite(self, patient_id, series):
+        parent = os.path.join(self.root, str(patient_id))
+        generation = os.path.join(parent, f'.{series}.gen-{uuid.uuid4().hex}')
+        os.makedirs(generation)
+        self._write(generation, 0, *_columns([], []))
+        rows = 0
+
+        def write(times, values, types=None):
+            nonlocal rows
+            times, values, types = _columns(times, values, types)
+            self._write(generation, rows, times, values, types)
+            rows += len(times)
+
+        try:
+            yield write
+        except BaseException:
+            shutil.rmtree(generation, ignore_errors=True)
+            raise
+
+        link = self.directory(patient_id, series)
+        previous = os.path.realpath(link) if os.path.lexists(link) else None
+        if os.path.isdir(link) and not os.path.islink(link):
+            # A plain directory cannot be replaced atomically, it becomes the previous generation
+            previous = os.path.join(parent, f'.{series}.gen-{uuid.uuid4().hex}')
+            os.rename(link, previous)
+        temporary = f'{generation}.link'
+        os.symlink(os.path.basename(generation), temporary)
+        os.replace(temporary, link)
+
+        keep = {generation, previous}
+        for name in os.listdir(parent):
+            path = os.path.join(parent, name)
+            if name.startswith(f'.{series}.gen-') and path not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+    @contextmanager
+    def rewrite(self, patient_id, series):
+        """
+        Replaces the whole series with the readings passed to the yielded
+        ``write(times, values, types=None)`` in time order, once the block exits.
+        Readers keep seeing the current readings until then.
+        """
+        with self.lock(patient_id, series), self._rewrite(patient_id, series) as write:
+            yield write
+
+    def write(self, patient_id, series, times, values, types=None):
+        """
+        Replaces the whole series.
+        """
+        with self.rewrite(patient_id, series) as write:
+            write(times, values, types)
+
+    def delete(self, patient_id, series=None):
+        for name in [series] if series else SERIES_FIELDS:
+            if os.path.lexists(self.directory(patient_id, name)):
+                self.write(patient_id, name, [], [])
+
+    def _lower_bound(self, index, times, moment, side):
+        """
+        Row of the first reading after ``moment`` (``side='right'``) or not before it
+        (``side='left'``), found within the one block the index points to.
+        """
+        block = max(int(np.searchsorted(index, moment, side)) - 1, 0)
+        start = block * BLOCK_SIZE
+        end = min(start + BLOCK_SIZE, len(times))
+        return start + int(np.searchsorted(times[start:end], moment, side))
+
+    def range(self, patient_id, series, start=None, end=None):
+        """
+        Returns ``(times, values, types)`` memmap slices of readings with
+        ``start <= time <= end``, given as epoch seconds.
+        """
+        directory = self._resolve(patient_id, series)
+        rows = self._rows(directory)
+        times = self._column(directory, 'times', rows)
+        index = self._index(directory, rows)
+
+        first = 0 if start is None or rows == 0 else self._lower_bound(index, times, start, 'left')
+        last = rows if end is None or rows == 0 else self._lower_bound(index, times, end, 'right')
+
+        return tuple(self._column(directory, column, rows)[first:last] for column in FILES)
+
+
+def get_store():
+    return TimeSeriesStore(settings.TIMESERIES_ROOT)
+
+
+def is_enabled():
+    return settings.MEASUREMENT_STORE == 'timeseries'
+
+
+def epoch_seconds(dates):
+    return np.array([int(date.timestamp()) for date in dates], dtype='<i8')
+
+
+def append_instances(model, instances, store=None):
+    """
+    Mirrors Glucose or Blood instances into the store.
+    """
+    store = store or get_store()
+    by_patient = {}
+    for instance in instances:
+        by_patient.setdefault(instance.patient_id, []).append(instance)
+
+    for patient_id, readings in by_patient.items():
+        times = epoch_seconds(reading.measurement_date for reading in readings)
+        types = [getattr(reading, 'measurement_type', 0) for reading in readings]
+        for series, (series_model, field) in SERIES_FIELDS.items():
+            if series_model is model:
+                store.append(patient_id, series, times, [getattr(reading, field) for reading in readings], types)
+
+
+def rebuild(patient_ids=None, store=None, chunk_size=10000):
+    """
+    Rewrites the store from the relational tables, all patients or ``patient_ids``.
+    Returns the number of stored readings.
+    """
+    store = store or get_store()
+    written = 0
+    for series, (model, field) in SERIES_FIELDS.items():
+        queryset = model.objects.all()
+        if patient_ids is not None:
+            queryset = queryset.filter(patient_id__in=patient_ids)
+        type_field = 'measurement_type' if model is Glucose else None
+
+        # Stored series without readings left are emptied
+        stored = store.patients(series)
+        if patient_ids is not None:
+            stored = set(stored) & set(patient_ids)
+        patients = set(queryset.values_list('patient_id', flat=True).distinct().order_by()) | set(stored)
+
+        for patient_id in sorted(patients):
+            rows = queryset.filter(patient_id=patient_id).order_by('measurement_date') \
+                .values_list('measurement_date', field, *([type_field] if type_field else []))
+            with store.rewrite(patient_id, series) as write:
+                batch = []
+                for row in rows.iterator(chunk_size):
+                    batch.append(row)
+                    if len(batch) == chunk_size:
+                        written += _write_rows(write, batch)
+                        batch = []
+                written += _write_rows(write, batch)
+
+    return written
+
+
+def _write_rows(write, rows):
+    if not rows:
+        return 0
+    columns = list(zip(*rows))
+    write(epoch_seconds(columns[0]), columns[1], columns[2] if len(columns) > 2 else None)
+    return len(rows)
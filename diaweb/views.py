@@ -1,33 +1,44 @@
+import io
 import json
-import os
 
 import diaweb.graphs
 
 from abc import ABCMeta, abstractmethod
+from datetime import timedelta
 from http import HTTPMethod
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.middleware import csrf
 from django.views.decorators.csrf import csrf_exempt
 
 from django.views.generic import TemplateView
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, mixins
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.decorators import api_view, renderer_classes, action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.renderers import TemplateHTMLRenderer, JSONRenderer
 
-from diaweb.models import Patient, Physician, Address, Glucose, Blood, Appointment, Reception
+from diaweb.models import Patient, Physician, Address, Glucose, Blood, Appointment, Reception, Job
 from diaweb.serializers import PatientSerializer, PhysicianSerializer, AddressSerializer, \
-    GlucoseSerializer, BloodSerializer, AppointmentSerializer, ReceptionSerializer, UserSerializer
-
-from diaweb.renderers import WebUserTemplateHTMLRenderer
+    GlucoseSerializer, BloodSerializer, AppointmentSerializer, ReceptionSerializer, UserSerializer, \
+    JobSerializer, BookingSerializer, get_related_lookups
+
+from diaweb.ingest import bulk_insert, DEFAULT_BATCH_SIZE
+from diaweb.pagination import MeasurementKeysetPagination
+from diaweb.parsers import NDJSONParser
+from diaweb import availability, booking, columnar, jobs
+from diaweb.renderers import WebUserTemplateHTMLRenderer, JSONStreamRenderer, NDJSONStreamRenderer, ColumnarRenderer
 from diaweb.authentication import IsAuthenticatedPostLeak
-from diaweb.extra_context import import_extra_context
+from diaweb.extra_context import get_extra_context
 
 
 
@@ -37,7 +48,7 @@ class BasicPageView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['welcome_msg'] = import_extra_context(os.path.join(settings.STATIC_ROOT, 'diaweb/files/index_page_msg'))
+        context['welcome_msg'] = get_extra_context().get()
         return context
 
 
@@ -46,13 +57,23 @@ class MainPageView(LoginRequiredMixin, TemplateView):
     login_url = settings.LOGIN_URL
 
 
+class RelatedQuerysetMixin:
+    """
+    Loads the relations rendered by nested serializers together with the queryset.
+    """
+
+    def get_queryset(self):
+        select, prefetch = get_related_lookups(self.get_serializer_class())
+        return super().get_queryset().select_related(*select).prefetch_related(*prefetch)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
 
 # Create your views here
-class PatientViewSet(viewsets.ModelViewSet):
+class PatientViewSet(RelatedQuerysetMixin, viewsets.ModelViewSet):
     authentication_classes = [SessionAuthentication, BasicAuthentication]
     permission_classes = [IsAuthenticated]
     queryset = Patient.objects.all()
@@ -64,18 +85,203 @@ class PatientViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_200_OK, data={'patient_id': request.user.patient.id})
         return Response(status=status.HTTP_200_OK, data={'patient_id': None})
 
+    @action(detail=True, methods=[HTTPMethod.POST])
+    def classify(self, request, pk=None):
+        patient = self.get_object()
+        job = jobs.enqueue('classify_patients', priority=10, patients=[patient.pk])
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
 
-class PhysicianViewSet(viewsets.ModelViewSet):
+class PhysicianViewSet(RelatedQuerysetMixin, viewsets.ModelViewSet):
     queryset = Physician.objects.all()
     serializer_class = PhysicianSerializer
 
+    @action(detail=False, methods=[HTTPMethod.GET], authentication_classes=[SessionAuthentication, BasicAuthentication],
+            permission_classes=[IsAuthenticated])
+    def availability(self, request):
+        """
+        Free appointment slots of the ``physician`` (repeatable) or ``specialty``
+        physicians on the dates ``start`` to ``end``, ``slot`` minutes long.
+        """
+        params = request.query_params
+        physicians = Physician.objects.select_related('user').order_by('pk')
+        if 'physician' in params:
+            try:
+                physicians = physicians.filter(pk__in=[int(value) for value in params.getlist('physician')])
+            except ValueError:
+                raise ValidationError({'physician': 'A valid integer is required.'})
+        elif 'specialty' in params:
+            physicians = physicians.filter(specialty__iexact=params['specialty'])
+        else:
+            raise ValidationError({'physician': 'A physician or a specialty is required.'})
+
+        dates = {}
+        for param, default in [('start', timezone.localdate()), ('end', None)]:
+            try:
+                dates[param] = parse_date(params[param]) if param in params else default
+            except ValueError:
+                dates[param] = None
+            if param in params and dates[param] is None:
+                raise ValidationError({param: 'A valid ISO 8601 date is required.'})
+        start = dates['start']
+        end = dates['end'] or start + availability.DEFAULT_RANGE
+        if end < start or end - start > availability.MAX_RANGE:
+            raise ValidationError({'end': f'The range must end after start and span at most '
+                                          f'{availability.MAX_RANGE.days} days.'})
+
+        try:
+            slot = int(params.get('slot', availability.SLOT_LENGTH.total_seconds() // 60))
+            limit = int(params['limit']) if 'limit' in params else None
+        except ValueError:
+            raise ValidationError({'slot': 'Slot length and limit must be integers.'})
+        minimum, maximum = (length // timedelta(minutes=1)
+                            for length in [availability.MIN_SLOT_LENGTH, availability.MAX_SLOT_LENGTH])
+        if not minimum <= slot <= maximum or (limit is not None and limit < 1):
+            raise ValidationError({'slot': f'Slot length must be between {minimum} and {maximum} minutes and limit '
+                                           f'positive.'})
+
+        physicians = list(physicians)
+        slots = availability.find([physician.pk for physician in physicians], start, end,
+                                  timedelta(minutes=slot), limit)
+        return Response({
+            'start': start, 'end': end, 'slot_minutes': slot,
+            'physicians': [{'physician': physician.pk, 'name': str(physician), 'specialty': physician.specialty,
+                            'slots': availability.to_strings(slots[physician.pk])}
+                           for physician in physicians],
+        })
+
 
 class AddressViewSet(viewsets.ModelViewSet):
     queryset = Address.objects.all()
     serializer_class = AddressSerializer
 
 
-class GlucoseViewSet(viewsets.ModelViewSet):
+class BulkCreateMixin:
+    """
+    Adds a ``bulk`` route accepting a JSON array or NDJSON body of items. Valid items
+    are written with chunked ``bulk_create`` calls, invalid ones are reported by index.
+    """
+    bulk_batch_size = DEFAULT_BATCH_SIZE
+    bulk_related_fields = ['patient']
+
+    def get_related_cache(self, rows):
+        cache = {}
+        model = self.get_serializer_class().Meta.model
+        for field_name in self.bulk_related_fields:
+            keys = set()
+            for row in rows:
+                try:
+                    keys.add(int(row[field_name]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            related_model = model._meta.get_field(field_name).related_model
+            cache[field_name] = related_model.objects.in_bulk(keys)
+
+        return cache
+
+    @action(detail=False, methods=[HTTPMethod.POST], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request, *args, **kwargs):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': 'Expected a list of items.'})
+
+        context = self.get_serializer_context()
+        context['related_cache'] = self.get_related_cache(rows)
+        serializer = self.get_serializer(context=context)
+
+        valid, errors = [], []
+        for index, row in enumerate(rows):
+            try:
+                valid.append(serializer.run_validation(row))
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+
+        model = serializer.Meta.model
+        created = bulk_insert(model, (model(**item) for item in valid), batch_size=self.bulk_batch_size)
+
+        if not errors:
+            return_status = status.HTTP_201_CREATED
+        elif created:
+            return_status = status.HTTP_207_MULTI_STATUS
+        else:
+            return_status = status.HTTP_400_BAD_REQUEST
+
+        return Response(status=return_status, data={'created': created, 'errors': errors})
+
+
+class MeasurementFilterMixin:
+    """
+    Filters measurements by the ``patient``, ``start`` and ``end`` query parameters
+    and pages them by (measurement_date, id).
+    """
+    pagination_class = MeasurementKeysetPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+
+        if 'patient' in params:
+            try:
+                queryset = queryset.filter(patient_id=int(params['patient']))
+            except ValueError:
+                raise ValidationError({'patient': 'A valid integer is required.'})
+
+        for param, lookup in [('start', 'measurement_date__gte'), ('end', 'measurement_date__lte')]:
+            if param in params:
+                try:
+                    date = parse_datetime(params[param])
+                except ValueError:
+                    date = None
+                if date is None:
+                    raise ValidationError({param: 'A valid ISO 8601 datetime is required.'})
+                if timezone.is_naive(date):
+                    date = timezone.make_aware(date)
+                queryset = queryset.filter(**{lookup: date})
+
+        return queryset
+
+
+class StreamingExportMixin:
+    """
+    Adds an ``export`` route streaming the whole filtered queryset as a JSON array or,
+    with ``?format=ndjson``, as NDJSON. Rows are read with a server side iterator and
+    serialized one at a time, so memory use does not grow with the export size.
+    Under ASGI the rows are read with the async ORM and the response is streamed
+    from the event loop rather than a worker thread.
+
+    The ``columnar`` route returns the same rows as one ``diaweb.columnar`` file.
+    """
+    export_chunk_size = 2000
+
+    @action(detail=False, methods=[HTTPMethod.GET], renderer_classes=[JSONStreamRenderer, NDJSONStreamRenderer])
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).order_by('measurement_date', 'pk')
+        serializer = self.get_serializer()
+        renderer = request.accepted_renderer
+
+        if isinstance(request._request, ASGIRequest):
+            rows = (serializer.to_representation(instance)
+                    async for instance in queryset.aiterator(self.export_chunk_size))
+            return StreamingHttpResponse(renderer.arender_stream(rows), content_type=renderer.media_type)
+
+        rows = (serializer.to_representation(instance) for instance in queryset.iterator(self.export_chunk_size))
+        return StreamingHttpResponse(renderer.render_stream(rows), content_type=renderer.media_type)
+
+    @action(detail=False, methods=[HTTPMethod.GET], renderer_classes=[ColumnarRenderer])
+    def columnar(self, request, *args, **kwargs):
+        model = self.get_queryset().model
+        queryset = self.filter_queryset(self.get_queryset()).order_by('measurement_date', 'pk')
+        rows = queryset.values_list(*[name for name, _ in columnar.COLUMNS[model]])
+
+        file = io.BytesIO()
+        columnar.write(file, columnar.to_columns(model, rows), {'series': columnar.SERIES_NAMES[model]})
+
+        filename = f'{columnar.SERIES_NAMES[model]}{columnar.EXTENSION}'
+        return Response(file.getvalue(), headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+class GlucoseViewSet(MeasurementFilterMixin, BulkCreateMixin, StreamingExportMixin, viewsets.ModelViewSet):
     queryset = Glucose.objects.all()
     serializer_class = GlucoseSerializer
     authentication_classes = [SessionAuthentication, BasicAuthentication]
@@ -83,22 +289,69 @@ class GlucoseViewSet(viewsets.ModelViewSet):
 
 
 
-class BloodViewSet(viewsets.ModelViewSet):
+class BloodViewSet(MeasurementFilterMixin, BulkCreateMixin, StreamingExportMixin, viewsets.ModelViewSet):
     queryset = Blood.objects.all()
     serializer_class = BloodSerializer
 
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(RelatedQuerysetMixin, viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
 
+    @action(detail=False, methods=[HTTPMethod.POST], authentication_classes=[SessionAuthentication, BasicAuthentication],
+            permission_classes=[IsAuthenticated])
+    def book(self, request):
+        """
+        Books the ``slot`` minutes long slot at ``date`` with ``physician`` for the
+        patient of the user, staff members book for any ``patient``. Responds 409 when
+        the slot is taken.
+        """
+        serializer = BookingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if hasattr(request.user, 'patient'):
+            patient = request.user.patient
+        elif request.user.is_staff and 'patient' in serializer.validated_data:
+            patient = serializer.validated_data['patient']
+        elif request.user.is_staff:
+            raise ValidationError({'patient': 'This field is required.'})
+        else:
+            raise PermissionDenied('Only patients and staff members can book appointments.')
+
+        try:
+            slot = serializer.validated_data.get('slot')
+            appointment = booking.book(patient, serializer.validated_data['physician'].pk,
+                                       serializer.validated_data['date'],
+                                       timedelta(minutes=slot) if slot else availability.SLOT_LENGTH)
+        except booking.OutsideReception as error:
+            raise ValidationError({'date': str(error)})
+        except booking.SlotTaken as error:
+            return Response({'detail': str(error)}, status=status.HTTP_409_CONFLICT)
+        return Response(AppointmentSerializer(appointment).data, status=status.HTTP_201_CREATED)
+
+
+class JobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                 viewsets.GenericViewSet):
+    """
+    Queues background jobs and reports their progress. Creating a job returns
+    ``202 Accepted`` right away, ``manage.py run_worker`` runs it.
+    """
+    queryset = Job.objects.order_by('-created_at')
+    serializer_class = JobSerializer
+    authentication_classes = [SessionAuthentication, BasicAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
 
 class ReceptionViewSet(viewsets.ModelViewSet):
     queryset = Reception.objects.all()
     serializer_class = ReceptionSerializer
 
 
-class WebUserViewSet(viewsets.ModelViewSet, metaclass=ABCMeta):
+class WebUserViewSet(RelatedQuerysetMixin, viewsets.ModelViewSet, metaclass=ABCMeta):
     renderer_classes = [JSONRenderer, WebUserTemplateHTMLRenderer]
     authentication_classes = [SessionAuthentication, BasicAuthentication]
     permission_classes = [IsAuthenticatedPostLeak]
@@ -124,14 +377,15 @@ class WebUserViewSet(viewsets.ModelViewSet, metaclass=ABCMeta):
         response = super().list(request, *args, **kwargs)
         response.template_name = 'diaweb/list.html'
         response.data = {'list': response.data,
-                         'name': self.get_queryset().first().__class__.__name__}
+                         'name': self.queryset.model.__name__}
         return response
 
     def retrieve(self, request, *args, **kwargs):
-        response = super().retrieve(request, *args, **kwargs)
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
         response.template_name = 'diaweb/detail.html'
-        response.data['name'] = self.get_queryset().first().__class__.__name__
-        response.data['result'] = self.get_queryset().get(pk=kwargs['pk'])
+        response.data['name'] = self.queryset.model.__name__
+        response.data['result'] = instance
         response.data['pk'] = kwargs['pk']
         return response
 
@@ -184,8 +438,7 @@ class WebUserViewSet(viewsets.ModelViewSet, metaclass=ABCMeta):
             response = self.partial_update(request, *args, **kwargs)
         else:
             response = self.retrieve(request, *args, **kwargs)
-            response.data['result'] = json.dumps(self.get_serializer(self.get_queryset().get(pk=kwargs['pk'])).data,
-                                                 indent=4)
+            response.data['result'] = json.dumps(self.get_serializer(response.data['result']).data, indent=4)
         response.template_name = 'diaweb/account_detail.html'
         response.data['serializer'] = self.get_serializer()
         response.data['style'] = self.style
@@ -0,0 +1,13 @@
+"""
+Entry point of the job worker processes of ``manage.py run_worker``. Spawned
+processes import this module before Django is set up, so it must not import
+models at module level.
+"""
+
+
+def run_process(index, poll_interval, once):
+    import django
+    django.setup()
+
+    from diaweb import jobs
+    jobs.work(jobs.worker_name(index), poll_interval, once)
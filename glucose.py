@@ -20,12 +20,13 @@ months = {
 }
 
 
-url_glucose = 'http://127.0.0.1:8000/api/glucose/'
-url_pressure = 'http://127.0.0.1:8000/api/bloods/'
+url_glucose = 'http://127.0.0.1:8000/api/glucose/bulk/'
+url_pressure = 'http://127.0.0.1:8000/api/bloods/bulk/'
 
 data = pd.read_csv('glucose.csv')
 blood_data = pd.read_csv('bp_log.csv')
 
+glucose_readings = []
 for index, row in data.iterrows():
 
     date = row['Date'].split(' ')[-1].split('/')
@@ -34,11 +35,15 @@ for index, row in data.iterrows():
     dinner_date = datetime.datetime(2023, months[date[1]], int(date[0]), np.random.randint(17, 21), np.random.randint(0,59))
 
     if row['Before breakfast']:
-        response = requests.post(url_glucose, data={'patient': 1, 'measurement': row['Before breakfast'], 'measurement_date': breakfast_date.strftime('%Y-%m-%dT%H:%M'), 'measurement_type': 1})
+        glucose_readings.append({'patient': 1, 'measurement': row['Before breakfast'], 'measurement_date': breakfast_date.strftime('%Y-%m-%dT%H:%M'), 'measurement_type': 1})
     if row['Before lunch']:
-        requests.post(url_glucose, data={'patient': 1, 'measurement': row['Before lunch'], 'measurement_date': lunch_date.strftime('%Y-%m-%dT%H:%M'), 'measurement_type': 3})
+        glucose_readings.append({'patient': 1, 'measurement': row['Before lunch'], 'measurement_date': lunch_date.strftime('%Y-%m-%dT%H:%M'), 'measurement_type': 3})
     if row['Before lunch']:
-        requests.post(url_glucose, data={'patient': 1, 'measurement': row['Before dinner'], 'measurement_date': dinner_date.strftime('%Y-%m-%dT%H:%M'), 'measurement_type': 5})
+        glucose_readings.append({'patient': 1, 'measurement': row['Before dinner'], 'measurement_date': dinner_date.strftime('%Y-%m-%dT%H:%M'), 'measurement_type': 5})
 
+blood_readings = []
 for index, row in blood_data.iterrows():
-    response = requests.post(url_pressure, data={'patient': 1, 'systolic_pressure': row['SYS'], 'diastolic_pressure': row['DIA'], 'pulse_rate': row['Pulse'], 'measurement_date': row['Measurement Date'].replace(' ', 'T').replace('2021', '2023')})
\ No newline at end of file
+    blood_readings.append({'patient': 1, 'systolic_pressure': row['SYS'], 'diastolic_pressure': row['DIA'], 'pulse_rate': row['Pulse'], 'measurement_date': row['Measurement Date'].replace(' ', 'T').replace('2021', '2023')})
+
+response = requests.post(url_glucose, data=pd.Series(glucose_readings).to_json(orient='values'), headers={'Content-Type': 'application/json'})
+response = requests.post(url_pressure, data=pd.Series(blood_readings).to_json(orient='values'), headers={'Content-Type': 'application/json'})